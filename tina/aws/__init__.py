@@ -0,0 +1 @@
+from .clients import configure, get_client, get_resource, get_session
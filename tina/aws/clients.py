@@ -0,0 +1,77 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+import boto3
+from botocore.config import Config
+
+
+# Size of each client's HTTPS connection pool. Raise this when many threads share a
+# client, e.g. when fanning out messages or running scheduled actions in parallel.
+MAX_POOL_CONNECTIONS = int(os.environ.get("TINA_AWS_MAX_POOL_CONNECTIONS", "10"))
+
+# Sessions, clients and resources are created lazily and kept at module level, so they
+# survive across warm Lambda invocations along with their pooled connections.
+# Resources aren't thread-safe, so each thread gets its own, but all of them share
+# the first one's client (and its connection pool).
+_lock = threading.Lock()
+_session: Optional[boto3.Session] = None
+_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_resources: Dict[Tuple[str, Optional[str]], Any] = {}
+_thread_resources = threading.local()
+_generation = 0  # Bumped by configure, to discard every thread's resources
+_config = Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+
+
+def configure(max_pool_connections: int) -> None:
+    """
+    Changes the connection pool size for clients and resources created from now on,
+    discarding any that were already created.
+    """
+    global _config, _generation
+    with _lock:
+        _config = Config(max_pool_connections=max_pool_connections)
+        _generation += 1
+        _clients.clear()
+        _resources.clear()
+
+
+def get_session() -> boto3.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.Session()
+        return _session
+
+
+def get_client(service_name: str, region_name: str = None):
+    session = get_session()
+    key = (service_name, region_name)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session.client(
+                service_name, region_name=region_name, config=_config
+            )
+        return _clients[key]
+
+
+def get_resource(service_name: str, region_name: str = None):
+    """
+    Returns this thread's resource for the service. Don't pass it, or objects made
+    from it such as Tables, to other threads.
+    """
+    session = get_session()
+    key = (service_name, region_name)
+    with _lock:
+        if getattr(_thread_resources, "generation", None) != _generation:
+            _thread_resources.generation = _generation
+            _thread_resources.resources = {}
+        resources = _thread_resources.resources
+        if key not in resources:
+            if key not in _resources:
+                _resources[key] = session.resource(
+                    service_name, region_name=region_name, config=_config
+                )
+            # Cheap: reuses the client, whose customisations are already registered.
+            template = _resources[key]
+            resources[key] = type(template)(client=template.meta.client)
+        return resources[key]
@@ -0,0 +1,32 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from . import clients
+
+
+class TestRegistry(unittest.TestCase):
+    def tearDown(self):
+        clients.configure(clients.MAX_POOL_CONNECTIONS)
+
+    def test_clients_are_reused(self):
+        first = clients.get_client("secretsmanager", region_name="eu-west-1")
+        second = clients.get_client("secretsmanager", region_name="eu-west-1")
+        self.assertIs(first, second)
+
+    def test_resources_are_reused(self):
+        first = clients.get_resource("dynamodb", region_name="eu-west-1")
+        second = clients.get_resource("dynamodb", region_name="eu-west-1")
+        self.assertIs(first, second)
+
+    def test_resources_are_per_thread_with_shared_client(self):
+        mine = clients.get_resource("dynamodb", region_name="eu-west-1")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            theirs = executor.submit(
+                clients.get_resource, "dynamodb", region_name="eu-west-1"
+            ).result()
+        self.assertIsNot(mine, theirs)
+        self.assertIs(mine.meta.client, theirs.meta.client)
+
+    def test_configure_sets_pool_size(self):
+        clients.configure(max_pool_connections=32)
+        client = clients.get_client("dynamodb", region_name="eu-west-1")
+        self.assertEqual(32, client.meta.config.max_pool_connections)
@@ -1,11 +1,12 @@
 from tina.conversation.conversation import ConversationTracker
 import random
 import re
-import requests
-from ..conversation import Conversation, state
+from ..conversation import Conversation, Keywords, Phrase, state
 
 
 class Joker(Conversation):
+    triggers = [Keywords("joke", "ha", "ha-ha", "haha", "funny"), Phrase("knock knock")]
+
     def __init__(self, tracker: ConversationTracker, recipient: str):
         super().__init__(tracker, recipient)
         self.recipient = recipient
@@ -28,6 +29,8 @@ class Joker(Conversation):
         return False
 
     def tell_joke(self):
+        import requests
+
         r = requests.get(
             "https://icanhazdadjoke.com/", headers={"Accept": "application/json"}
         )
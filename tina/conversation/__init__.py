@@ -1 +1,2 @@
 from .conversation import Conversation, ConversationTracker, state
+from .triggers import Keywords, Pattern, Phrase, Trigger
@@ -1,23 +1,41 @@
 from __future__ import annotations
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from logging.handlers import MemoryHandler
-import inflect
 import inspect
 import logging
 from ..dialog import generic_reply
-from ..twilio import send_sms
-from .persistence import ConversationsPersistence
-from typing import Any, Callable, Dict, List, Tuple, Type, TypeVar
+from ..twilio import coalesce, send_sms
+from ..utils import fan_out
+from .persistence import (
+    ConversationConflict,
+    ConversationRecord,
+    ConversationsPersistence,
+    ConversationState,
+)
+from .triggers import Trigger, TriggerIndex
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, TypeVar
 
 
 logger = logging.getLogger(__name__)
 
+# How many times a message is replayed after losing a race with a concurrent message
+# from the same recipient, before giving up.
+MAX_CONFLICT_REPLAYS = 5
+
+# How long a conversation waits for a reply before it's abandoned, unless the
+# Conversation sets its own timeout.
+DEFAULT_CONVERSATION_TIMEOUT = timedelta(hours=24)
+
 
 class ConversationTypeRegistry:
     def __init__(self):
         self.type_map: dict[str, Type[Conversation]] = {}
+        self._trigger_index: TriggerIndex = None
 
     def register(self, conversation_type: Type[Conversation]) -> None:
         self.type_map[conversation_type.key] = conversation_type
+        self._trigger_index = None
 
     def get_conversation_handler(self, conversation_key: str) -> Type[Conversation]:
         return self.type_map[conversation_key]
@@ -25,6 +43,15 @@ class ConversationTypeRegistry:
     def get_all_types(self) -> List[Type[Conversation]]:
         return list(self.type_map.values())
 
+    def get_types_for_message(self, contents: str) -> List[Type[Conversation]]:
+        """
+        The conversation types whose triggers match the message, plus any that
+        declare no triggers, in registration order.
+        """
+        if self._trigger_index is None:
+            self._trigger_index = TriggerIndex(self.get_all_types())
+        return self._trigger_index.match(contents)
+
 
 global_registry = ConversationTypeRegistry()
 
@@ -34,25 +61,143 @@ def get_conversation_registry():
 
 
 class ConversationTracker:
-    def __init__(self, persistence=None, registry=global_registry):
+    """
+    If inline_recipient is set, messages to that recipient are collected in
+    inline_replies instead of being sent, so that the inbound webhook handler can
+    return them in its TwiML response. Messages to anyone else are sent as usual.
+
+    Each turn() is also a unit of work: conversation state changes made during it are
+    buffered, and only each recipient's final state is written, in one go, when the
+    turn ends. If the turn raises, the buffered changes are discarded. Messages sent
+    during a turn are buffered too, and coalesced into as few SMS segments as
+    possible when the turn ends.
+
+    Conversations are versioned. If another invocation changes the sender's
+    conversation while a message is being handled, the write is rejected, the turn's
+    messages are dropped, and the message is replayed against the new state.
+
+    Conversations expire if the recipient doesn't reply within the Conversation's
+    timeout. An expired conversation is treated as absent, and its on_expired hook is
+    called, either when its recipient next sends a message or from sweep_expired.
+    Conversations stored before expiry times were recorded never expire.
+    """
+
+    def __init__(
+        self,
+        persistence=None,
+        registry=global_registry,
+        inline_recipient: str = None,
+        clock: Callable[[], datetime] = None,
+    ):
         if not persistence:
             persistence = ConversationsPersistence()
+        if not clock:
+            clock = lambda: datetime.now(timezone.utc)
         self.persistence = persistence
+        self.clock = clock
         self.registry = registry
+        self.inline_recipient = inline_recipient
+        self.inline_replies: List[str] = []
+        self._outbound: Dict[str, List[str]] = None
+        # Recipient -> final conversation state (None if ended) for the current turn.
+        self._pending_states: Dict[str, Optional[ConversationState]] = None
+        self._pending_writes: List[Dict[str, Any]] = None
+        # Recipient -> conversation version read during the current turn (None if
+        # they had no conversation).
+        self._read_versions: Dict[str, Optional[int]] = None
+
+    @contextmanager
+    def turn(self) -> Iterator[None]:
+        if self._outbound is not None:
+            yield  # Already buffering for an enclosing turn
+            return
+        self._outbound = {}
+        self._pending_states = {}
+        self._pending_writes = []
+        self._read_versions = {}
+        try:
+            yield
+            self.commit()
+        except ConversationConflict:
+            self._outbound.clear()  # The turn will be replayed
+            raise
+        finally:
+            self._pending_states = None
+            self._pending_writes = None
+            self._read_versions = None
+            self.flush()
+            self._outbound = None
+
+    def commit(self) -> None:
+        if self._pending_states or self._pending_writes:
+            self.persistence.write_changes(
+                self._pending_states, self._pending_writes, self._read_versions
+            )
+            self._pending_states.clear()
+            self._pending_writes.clear()
+
+    def add_write(self, transact_item: Dict[str, Any]) -> None:
+        """
+        Adds a TransactWriteItems item (e.g. a larder update) to be written atomically
+        with the turn's conversation state. Outside a turn, it's written immediately.
+        """
+        if self._pending_writes is not None:
+            self._pending_writes.append(transact_item)
+        else:
+            self.persistence.write_changes({}, [transact_item])
 
-    def handle_message(self, sender: str, contents: str) -> None:
-        maybe_conversation = self.persistence.get_current_conversation(sender)
+    def send(self, recipient: str, message: str) -> None:
+        if self._outbound is not None:
+            self._outbound.setdefault(recipient, []).append(message)
+        else:
+            self._deliver(recipient, message)
+
+    def flush(self) -> None:
+        if not self._outbound:
+            return
+        for recipient, messages in self._outbound.items():
+            for message in coalesce(messages):
+                self._deliver(recipient, message)
+        self._outbound.clear()
+
+    def _deliver(self, recipient: str, message: str) -> None:
+        if recipient == self.inline_recipient:
+            self.inline_replies.append(message)
+        else:
+            send_sms(recipient, message)
 
-        if maybe_conversation is None:
+    def handle_message(self, sender: str, contents: str) -> None:
+        for attempt in range(MAX_CONFLICT_REPLAYS + 1):
+            try:
+                with self.turn():
+                    self._handle_message(sender, contents)
+                return
+            except ConversationConflict:
+                if attempt == MAX_CONFLICT_REPLAYS:
+                    raise
+                logger.info(
+                    f"Conversation with {sender} changed concurrently - replaying message"
+                )
+
+    def _handle_message(self, sender: str, contents: str) -> None:
+        record = self.persistence.get_current_conversation(sender)
+        self._read_versions[sender] = record.version if record else None
+        if record is not None and record.expiresAt is not None:
+            if record.expiresAt <= self.clock():
+                self._notify_expired(sender, record)
+                self.end_current_conversation(sender)
+                record = None
+
+        if record is None:
             self.handle_spontaneous_message(sender, contents)
         else:
-            conversation_key, state, data = maybe_conversation
             self.handle_conversation_message(
-                conversation_key, state, data, sender, contents
+                record.conversationKey, record.state, record.data, sender, contents
             )
 
     def handle_spontaneous_message(self, sender, contents):
-        for conversation_type in self.registry.get_all_types():
+        for conversation_type in self.registry.get_types_for_message(contents):
+            saved = self._save_pending()
             try:
                 conversation = conversation_type(self, sender)
                 was_handled = conversation.handle_spontaneous_message(contents)
@@ -60,9 +205,10 @@ class ConversationTracker:
                     break
             except Exception as e:
                 logger.exception("Exception when handling spontaneous message")
+                self._restore_pending(saved)
                 continue
         else:
-            send_sms(sender, generic_reply())
+            self.send(sender, generic_reply())
 
     def handle_conversation_message(
         self,
@@ -74,47 +220,107 @@ class ConversationTracker:
     ) -> None:
         try:
             conversation_type = self.registry.get_conversation_handler(conversation_key)
-        except:
+            handler = conversation_type._states[state]
+        except KeyError:
             logger.error(
-                f"Unable to find handler for conversation '{conversation_key}'"
+                f"Unable to find handler for conversation state ({conversation_key}, {state}) - ending"
             )
-            send_sms(
+            self.send(
                 sender,
                 "Sorry, I completely lost track of what we were talking about. Never mind - it probably wasn't important!",
             )
-            self.persistence.delete_current_conversation(conversation.recipient)
-
-        try:
-            conversation = conversation_type(self, sender)
-            handler = getattr(conversation, state)
-        except:
-            logger.error(
-                f"Unable to find handler for conversation state ({conversation_key},{state} - ending"
-            )
-            send_sms(
-                conversation.recipient,
-                "Sorry, I completely lost track of what we were talking about. Never mind - it probably wasn't important!",
-            )
-            self.persistence.delete_current_conversation(conversation.recipient)
+            self.end_current_conversation(sender)
             return
 
         try:
-            handler(contents, data)
+            handler(conversation_type(self, sender), contents, data)
         except Exception as e:
+            # The webhook will fail, so neither this nor the inline replies collected so
+            # far will reach the sender in the TwiML response. Anything said before the
+            # failure is sent over REST first, to keep messages in order.
+            self.flush()
+            for message in self.inline_replies:
+                send_sms(self.inline_recipient, message)
+            self.inline_replies.clear()
+            import inflect
+
             p = inflect.engine()
             send_sms(
-                conversation.recipient,
+                sender,
                 f"Gah, sorry, I hit {p.an(str(e.__class__))} while trying to reply to you. It's frustrating being a computer sometimes. Try again and let's see if I can get it right this time!",
             )
             raise e
 
     def set_current_conversation(
-        self, recipient: str, key: str, state: str, data: dict[str, Any]
+        self,
+        recipient: str,
+        key: str,
+        state: str,
+        data: dict[str, Any],
+        timeout: timedelta = DEFAULT_CONVERSATION_TIMEOUT,
     ) -> None:
-        self.persistence.set_current_conversation(recipient, key, state, data)
+        expires_at = self.clock() + timeout
+        if self._pending_states is not None:
+            self._pending_states[recipient] = (key, state, data, expires_at)
+        else:
+            self.persistence.set_current_conversation(
+                recipient, key, state, data, expires_at
+            )
 
     def end_current_conversation(self, recipient: str) -> None:
-        self.persistence.delete_current_conversation(recipient)
+        if self._pending_states is not None:
+            self._pending_states[recipient] = None
+        else:
+            self.persistence.delete_current_conversation(recipient)
+
+    def sweep_expired(self) -> int:
+        """
+        Clears expired conversations that DynamoDB's TTL process hasn't removed yet,
+        calling each one's on_expired hook, and returns how many were cleared.
+        """
+
+        def clear(expired: Tuple[str, ConversationRecord]) -> bool:
+            recipient, record = expired
+            # Only the invocation that deletes the conversation notifies, so a reply
+            # arriving at the same moment can't cause a second notification.
+            if not self.persistence.delete_conversation_if_unchanged(
+                recipient, record.version
+            ):
+                return False
+            self._notify_expired(recipient, record)
+            return True
+
+        results = fan_out(
+            clear, self.persistence.get_expired_conversations(self.clock())
+        )
+        for result in results:
+            if result.error is not None:
+                logger.error(
+                    f"Failed to clear expired conversation with {result.item[0]}",
+                    exc_info=result.error,
+                )
+        return sum(1 for result in results if result.result)
+
+    def _notify_expired(self, recipient: str, record: ConversationRecord) -> None:
+        try:
+            conversation_type = self.registry.get_conversation_handler(
+                record.conversationKey
+            )
+        except KeyError:
+            return
+        try:
+            conversation_type(self, recipient).on_expired(record.state, record.data)
+        except Exception:
+            logger.exception(f"Exception in on_expired for {record.conversationKey}")
+
+    def _save_pending(self):
+        if self._pending_states is None:
+            return None
+        return dict(self._pending_states), list(self._pending_writes)
+
+    def _restore_pending(self, saved) -> None:
+        if saved is not None:
+            self._pending_states, self._pending_writes = saved
 
 
 class ConversationMeta(type):
@@ -122,21 +328,27 @@ class ConversationMeta(type):
         assert name == "Conversation" or any(
             Conversation in inspect.getmro(base) for base in bases
         ), "All conversations must subtype Conversation"
+
+        # State name -> unbound state method, including inherited states. Built once
+        # here so that dispatching to a state is a single lookup.
         states = {}
-        new_request_handler = None
+        for base in reversed(bases):
+            states.update(getattr(base, "_states", {}))
         for k, v in attrs.items():
-            if inspect.isfunction(v):
-                if getattr(k, "is_conversation_state", False):
-                    states[k] = v
-                if getattr(k, "is_new_request_handler", False):
-                    assert (
-                        new_request_handler is None
-                    ), "Only one @new_request_handler annotation is allowed per Conversation!"
-                    new_request_handler = v
-
-        for base in bases:
-            if hasattr(base, "_states"):
-                states.update(base._states)
+            if getattr(v, "is_conversation_state", False):
+                assert inspect.isfunction(
+                    v
+                ), f"@state must annotate a plain method, but {name}.{k} isn't one"
+                try:
+                    inspect.signature(v).bind(None, "contents", {})
+                except TypeError:
+                    raise TypeError(
+                        f"State {name}.{k} must take (self, contents, data)"
+                    ) from None
+                states[k] = v
+            elif k in states:
+                # Overridden by something that isn't a state.
+                del states[k]
         attrs["_states"] = states
 
         conversation_type = type.__new__(cls, name, bases, attrs)
@@ -144,10 +356,6 @@ class ConversationMeta(type):
             conversation_type.__module__ + "." + conversation_type.__qualname__
         )
         global_registry.register(conversation_type)
-
-        if new_request_handler is not None:
-            global_registry.register_for_user_initiation()
-
         return conversation_type
 
 
@@ -162,13 +370,19 @@ class Conversation(metaclass=ConversationMeta):
     When a conversation calls set_state, it is registering itself for a callback (in a future lambda call) when the recipient
     replies to the message. The Conversation will be reinitialized with the given recipient, and the corresponding state method
     will be called, passing the contents of the message and the stored data.
+    If the recipient doesn't reply within `timeout`, the conversation is abandoned and on_expired is called instead.
 
     Conversations can also register for callbacks on new messages, outside of conversations, that meet specified predicates.
     They do this by overriding handle_spontaneous_message, which is passed the contents of the message as a string.
     They should return True if the message was handled, and False otherwise, so that the caller knows whether to pass the
     message to other handlers.
+    Conversations should list the Keywords, Phrases and Patterns that interest them in `triggers`, so that they are only
+    offered messages that match. Conversations without triggers are offered every spontaneous message.
     """
 
+    triggers: List[Trigger] = []
+    timeout: timedelta = DEFAULT_CONVERSATION_TIMEOUT
+
     def __init__(self, conversation_tracker: ConversationTracker, recipient: str):
         self.conversation_tracker = conversation_tracker
         self.recipient = recipient
@@ -176,23 +390,27 @@ class Conversation(metaclass=ConversationMeta):
     def set_state(self, new_state: str, data: dict[str, Any] = None):
         if data is None:
             data = {}
-        assert hasattr(self, new_state)
-        state_fn = getattr(self, new_state)
-        assert inspect.ismethod(state_fn)
-        assert state_fn.is_conversation_state  # i.e. is annotated with @state
+        assert new_state in self._states, f"'{new_state}' isn't a @state of {self.key}"
         self.conversation_tracker.set_current_conversation(
-            self.recipient, self.key, new_state, data
+            self.recipient, self.key, new_state, data, self.timeout
         )
 
     def end_conversation(self):
         self.conversation_tracker.end_current_conversation(self.recipient)
 
     def send(self, message):
-        send_sms(self.recipient, message)
+        self.conversation_tracker.send(self.recipient, message)
 
     def handle_spontaneous_message(self, contents) -> bool:
         return False
 
+    def on_expired(self, state: str, data: dict[str, Any]) -> None:
+        """
+        Called once a conversation has gone unanswered for longer than its timeout,
+        with the state and data it was left in. Override to tidy up or let the
+        recipient know.
+        """
+
 
 def state(fn):
     fn.is_conversation_state = True
@@ -1,40 +1,206 @@
-from dataclasses import replace
+import threading
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, Optional, Tuple
-from boto3 import Session
-from boto3.dynamodb.conditions import Key
+from typing import Any, Dict, List, Optional, Tuple
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
+from ..aws import get_resource
+from ..utils import paginate, parse_epoch_time, to_epoch_time
 
 
 CONVERSATIONS_TABLE = "TinaConversation"
 
+# (conversation key, state, data, expiry time) for a recipient's current conversation.
+ConversationState = Tuple[str, str, Dict[str, Any], datetime]
+
+
+@dataclass
+class ConversationRecord:
+    conversationKey: str
+    state: str
+    data: Dict[str, Any]
+    # Incremented on every write; 0 for items written before versioning.
+    version: int = 0
+    # When the conversation is abandoned. Also the table's TTL attribute, so DynamoDB
+    # eventually deletes the item, though that can lag by a couple of days.
+    expiresAt: Optional[datetime] = None
+
+
+class ConversationConflict(Exception):
+    """
+    Raised when a conversation was changed by someone else since it was read, so the
+    write was rejected.
+    """
+
 
 class ConversationsPersistence:
     def __init__(self):
-        self.session = Session().resource("dynamodb")
-        self.table = self.session.Table(CONVERSATIONS_TABLE)
+        # sweep_expired uses one instance from several threads, and boto3 resources
+        # aren't thread-safe, so each thread gets its own Table.
+        self._tables = threading.local()
+
+    @property
+    def table(self) -> Table:
+        table = getattr(self._tables, "table", None)
+        if table is None:
+            table = get_resource("dynamodb").Table(CONVERSATIONS_TABLE)
+            self._tables.table = table
+        return table
 
-    def get_current_conversation(
-        self, recipient: str
-    ) -> Optional[Tuple[str, str, str]]:
+    @table.setter
+    def table(self, table: Table) -> None:
+        self._tables.table = table
+
+    def get_current_conversation(self, recipient: str) -> Optional[ConversationRecord]:
         result = self.table.get_item(Key={"Recipient": recipient})
         if "Item" in result:
-            item = result["Item"]
-            return item["ConversationKey"], item["State"], item["Data"]
+            return self._deserialize_record(result["Item"])
         else:
             return None
 
+    def get_expired_conversations(
+        self, current_time: datetime
+    ) -> List[Tuple[str, ConversationRecord]]:
+        """
+        (recipient, record) for every conversation that has expired. Those written
+        before conversations had expiry times never expire; they're left to end the
+        way they always did, when their recipient next replies.
+        """
+        items = paginate(
+            self.table.scan,
+            FilterExpression=Attr("ExpiresAt").lte(to_epoch_time(current_time)),
+        )
+        return [(item["Recipient"], self._deserialize_record(item)) for item in items]
+
     def set_current_conversation(
-        self, recipient: str, conversation_key: str, state: str, data: Dict[str, Any]
+        self,
+        recipient: str,
+        conversation_key: str,
+        state: str,
+        data: Dict[str, Any],
+        expires_at: datetime,
     ):
-        self.table.put_item(
-            Item={
-                "Recipient": recipient,
-                "ConversationKey": conversation_key,
-                "State": state,
-                "Data": data,
-            }
+        self.table.update_item(
+            **self._update_args(recipient, (conversation_key, state, data, expires_at))
         )
 
     def delete_current_conversation(self, recipient: str):
         self.table.delete_item(Key={"Recipient": recipient})
+
+    def delete_conversation_if_unchanged(self, recipient: str, version: int) -> bool:
+        """
+        Deletes the recipient's conversation if it's still at the given version, and
+        returns whether it did.
+        """
+        args = {"Key": {"Recipient": recipient}}
+        self._add_version_condition(args, version)
+        try:
+            self.table.delete_item(**args)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise e
+
+    def write_changes(
+        self,
+        conversations: Dict[str, Optional[ConversationState]],
+        other_writes: List[Dict[str, Any]] = (),
+        expected_versions: Dict[str, Optional[int]] = None,
+    ) -> None:
+        """
+        Sets each recipient's current conversation (or ends it, for None), together
+        with any other TransactWriteItems items, atomically. A single conversation
+        change on its own is written with a plain update or delete.
+
+        For recipients in expected_versions, the write only succeeds if their
+        conversation is still at the given version (or, for None, still absent);
+        otherwise ConversationConflict is raised and nothing is written.
+        """
+        if expected_versions is None:
+            expected_versions = {}
+        writes = []
+        for recipient, conversation in conversations.items():
+            if conversation is None:
+                args = {"Key": {"Recipient": recipient}}
+            else:
+                args = self._update_args(recipient, conversation)
+            if recipient in expected_versions:
+                self._add_version_condition(args, expected_versions[recipient])
+            writes.append((conversation is None, args))
+
+        if not other_writes and len(writes) == 1:
+            is_delete, args = writes[0]
+            try:
+                if is_delete:
+                    self.table.delete_item(**args)
+                else:
+                    self.table.update_item(**args)
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                    raise ConversationConflict() from e
+                raise e
+            return
+
+        items = [
+            {
+                ("Delete" if is_delete else "Update"): {
+                    "TableName": CONVERSATIONS_TABLE,
+                    **args,
+                }
+            }
+            for is_delete, args in writes
+        ]
+        items.extend(other_writes)
+        if not items:
+            return
+        try:
+            self.table.meta.client.transact_write_items(TransactItems=items)
+        except ClientError as e:
+            reasons = e.response.get("CancellationReasons", [])
+            if e.response["Error"]["Code"] == "TransactionCanceledException" and any(
+                reason.get("Code") == "ConditionalCheckFailed"
+                for reason in reasons[: len(writes)]
+            ):
+                raise ConversationConflict() from e
+            raise e
+
+    @staticmethod
+    def _update_args(recipient: str, conversation: ConversationState) -> Dict[str, Any]:
+        conversation_key, state, data, expires_at = conversation
+        return {
+            "Key": {"Recipient": recipient},
+            "UpdateExpression": "SET ConversationKey = :key, #state = :state, #data = :data, ExpiresAt = :expires ADD Version :one",
+            "ExpressionAttributeNames": {"#state": "State", "#data": "Data"},
+            "ExpressionAttributeValues": {
+                ":key": conversation_key,
+                ":state": state,
+                ":data": data,
+                ":expires": to_epoch_time(expires_at),
+                ":one": 1,
+            },
+        }
+
+    @staticmethod
+    def _deserialize_record(item: Dict[str, Any]) -> ConversationRecord:
+        return ConversationRecord(
+            conversationKey=item["ConversationKey"],
+            state=item["State"],
+            data=item["Data"],
+            version=int(item.get("Version", 0)),
+            expiresAt=parse_epoch_time(item["ExpiresAt"])
+            if "ExpiresAt" in item
+            else None,
+        )
+
+    @staticmethod
+    def _add_version_condition(args: Dict[str, Any], version: Optional[int]) -> None:
+        if version is None:
+            condition = "attribute_not_exists(Recipient)"
+        elif version == 0:
+            condition = "attribute_exists(Recipient) AND attribute_not_exists(Version)"
+        else:
+            condition = "Version = :version"
+            args.setdefault("ExpressionAttributeValues", {})[":version"] = version
+        args["ConditionExpression"] = condition
@@ -0,0 +1,438 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from unittest.mock import MagicMock, patch
+from .conversation import (
+    Conversation,
+    ConversationTracker,
+    ConversationTypeRegistry,
+    DEFAULT_CONVERSATION_TIMEOUT,
+    state,
+)
+from .persistence import ConversationConflict, ConversationRecord
+from .triggers import Keywords
+
+
+SENDER = "+447700900000"
+NOW = datetime(2022, 6, 1, 12, tzinfo=timezone.utc)
+
+
+class Echo(Conversation):
+    def handle_spontaneous_message(self, contents) -> bool:
+        if contents.startswith("echo"):
+            self.send(contents)
+            self.set_state("echo_again", {"count": 1})
+            return True
+        return False
+
+    @state
+    def echo_again(self, contents, data):
+        self.send(contents)
+        self.send(f"That's {data['count'] + 1} echoes")
+        self.end_conversation()
+
+
+class MockConversationsPersistence:
+    def __init__(self):
+        self.conversations: Dict[str, ConversationRecord] = {}
+        self.commits = []
+
+    def get_current_conversation(self, recipient: str) -> Optional[ConversationRecord]:
+        return self.conversations.get(recipient)
+
+    def set_current_conversation(
+        self, recipient, conversation_key, state, data, expires_at=None
+    ):
+        previous = self.conversations.get(recipient)
+        self.conversations[recipient] = ConversationRecord(
+            conversation_key,
+            state,
+            data,
+            previous.version + 1 if previous else 1,
+            expires_at,
+        )
+
+    def delete_current_conversation(self, recipient):
+        self.conversations.pop(recipient, None)
+
+    def get_expired_conversations(self, current_time):
+        return [
+            (recipient, record)
+            for recipient, record in self.conversations.items()
+            if record.expiresAt is not None and record.expiresAt <= current_time
+        ]
+
+    def delete_conversation_if_unchanged(self, recipient, version):
+        current = self.conversations.get(recipient)
+        if current is None or current.version != version:
+            return False
+        self.delete_current_conversation(recipient)
+        return True
+
+    def write_changes(self, conversations, other_writes=(), expected_versions=None):
+        for recipient, version in (expected_versions or {}).items():
+            if recipient in conversations:
+                current = self.conversations.get(recipient)
+                if (current.version if current else None) != version:
+                    raise ConversationConflict()
+        self.commits.append((dict(conversations), list(other_writes)))
+        for recipient, conversation in conversations.items():
+            if conversation is None:
+                self.delete_current_conversation(recipient)
+            else:
+                self.set_current_conversation(recipient, *conversation)
+
+
+def make_tracker(**kwargs) -> ConversationTracker:
+    registry = ConversationTypeRegistry()
+    registry.register(Echo)
+    return ConversationTracker(
+        MockConversationsPersistence(), registry, clock=lambda: NOW, **kwargs
+    )
+
+
+class Fragile(Conversation):
+    @state
+    def start(self, contents, data):
+        self.send("Working on it")
+        raise RuntimeError("Oops")
+
+
+class TestInlineReplies(unittest.TestCase):
+    def test_replies_sent_over_rest_when_handler_fails(self):
+        registry = ConversationTypeRegistry()
+        registry.register(Fragile)
+        tracker = ConversationTracker(
+            MockConversationsPersistence(),
+            registry,
+            inline_recipient=SENDER,
+            clock=lambda: NOW,
+        )
+        tracker.inline_replies.append("Earlier reply")
+        tracker.persistence.set_current_conversation(SENDER, Fragile.key, "start", {})
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            with self.assertRaises(RuntimeError):
+                tracker.handle_message(SENDER, "hello")
+        sent = [call.args for call in send_sms.call_args_list]
+        self.assertEqual(
+            [(SENDER, "Earlier reply"), (SENDER, "Working on it")], sent[:2]
+        )
+        self.assertIn("Gah, sorry", sent[2][1])
+        self.assertEqual(3, len(sent))
+        self.assertEqual([], tracker.inline_replies)
+
+    def test_replies_to_sender_collected(self):
+        tracker = make_tracker(inline_recipient=SENDER)
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.handle_message(SENDER, "echo hello")
+            tracker.handle_message(SENDER, "echo again")
+        send_sms.assert_not_called()
+        self.assertEqual(
+            ["echo hello", "echo again That's 2 echoes"], tracker.inline_replies
+        )
+
+    def test_other_recipients_sent_via_rest(self):
+        tracker = make_tracker(inline_recipient=SENDER)
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.send("+447700900001", "Hi there")
+        send_sms.assert_called_once_with("+447700900001", "Hi there")
+        self.assertEqual([], tracker.inline_replies)
+
+    def test_without_inline_recipient_everything_sent(self):
+        tracker = make_tracker()
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.handle_message(SENDER, "echo hello")
+        send_sms.assert_called_once_with(SENDER, "echo hello")
+
+
+class TestTurns(unittest.TestCase):
+    def test_sends_in_a_turn_coalesced(self):
+        tracker = make_tracker()
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.handle_message(SENDER, "echo hello")
+            send_sms.reset_mock()
+            tracker.handle_message(SENDER, "echo again")
+        send_sms.assert_called_once_with(SENDER, "echo again That's 2 echoes")
+
+    def test_nothing_sent_until_turn_ends(self):
+        tracker = make_tracker()
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            with tracker.turn():
+                tracker.send(SENDER, "One.")
+                tracker.send("+447700900001", "Other.")
+                tracker.send(SENDER, "Two.")
+                send_sms.assert_not_called()
+        self.assertEqual(
+            [((SENDER, "One. Two."),), (("+447700900001", "Other."),)],
+            send_sms.call_args_list,
+        )
+
+
+class Greeter(Conversation):
+    triggers = [Keywords("hello")]
+    instances = 0
+
+    def __init__(self, tracker, recipient):
+        super().__init__(tracker, recipient)
+        Greeter.instances += 1
+
+    def handle_spontaneous_message(self, contents) -> bool:
+        self.send("Hi!")
+        return True
+
+
+class TestSpontaneousDispatch(unittest.TestCase):
+    def test_only_triggered_types_instantiated(self):
+        registry = ConversationTypeRegistry()
+        registry.register(Greeter)
+        tracker = ConversationTracker(MockConversationsPersistence(), registry)
+        Greeter.instances = 0
+        with patch("tina.conversation.conversation.send_sms") as send_sms, patch(
+            "tina.conversation.conversation.generic_reply", return_value="Eh?"
+        ):
+            tracker.handle_message(SENDER, "what's up")
+            self.assertEqual(0, Greeter.instances)
+            tracker.handle_message(SENDER, "hello there")
+            self.assertEqual(1, Greeter.instances)
+        self.assertEqual(
+            [((SENDER, "Eh?"),), ((SENDER, "Hi!"),)], send_sms.call_args_list
+        )
+
+
+class Base(Conversation):
+    @state
+    def first(self, contents, data):
+        self.set_state("second")
+
+    @state
+    def second(self, contents, data):
+        self.send("base second")
+
+
+class Derived(Base):
+    @state
+    def second(self, contents, data):
+        self.send("derived second")
+
+    def first(self, contents, data):
+        pass
+
+
+class TestStates(unittest.TestCase):
+    def test_states_collected(self):
+        self.assertEqual({"first", "second"}, set(Base._states))
+        self.assertEqual({"echo_again"}, set(Echo._states))
+
+    def test_inherited_and_overridden_states(self):
+        self.assertEqual({"second"}, set(Derived._states))
+        self.assertIs(Derived.second, Derived._states["second"])
+
+    def test_set_state_rejects_unknown_states(self):
+        tracker = make_tracker()
+        with self.assertRaises(AssertionError):
+            Derived(tracker, SENDER).set_state("first")
+        with self.assertRaises(AssertionError):
+            Derived(tracker, SENDER).set_state("handle_spontaneous_message")
+
+    def test_state_signature_validated(self):
+        with self.assertRaises(TypeError):
+
+            class BadState(Conversation):
+                @state
+                def no_data(self, contents):
+                    pass
+
+    def test_unknown_state_ends_conversation(self):
+        tracker = make_tracker()
+        tracker.persistence.set_current_conversation(SENDER, Echo.key, "gone", {})
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.handle_message(SENDER, "hello")
+        send_sms.assert_called_once()
+        self.assertIsNone(tracker.persistence.get_current_conversation(SENDER))
+
+    def test_unknown_conversation_ends_conversation(self):
+        tracker = make_tracker()
+        tracker.persistence.set_current_conversation(SENDER, "no.such.Type", "x", {})
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            tracker.handle_message(SENDER, "hello")
+        send_sms.assert_called_once()
+        self.assertIsNone(tracker.persistence.get_current_conversation(SENDER))
+
+
+class Chatty(Conversation):
+    @state
+    def start(self, contents, data):
+        self.set_state("middle", {"step": 1})
+        self.set_state("end", {"step": 2})
+        self.conversation_tracker.add_write({"Put": {"TableName": "Larder"}})
+        if contents == "fail":
+            raise RuntimeError("Oops")
+
+    @state
+    def middle(self, contents, data):
+        pass
+
+    @state
+    def end(self, contents, data):
+        self.end_conversation()
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def make_tracker(self):
+        registry = ConversationTypeRegistry()
+        registry.register(Chatty)
+        tracker = ConversationTracker(
+            MockConversationsPersistence(), registry, clock=lambda: NOW
+        )
+        tracker.persistence.set_current_conversation(SENDER, Chatty.key, "start", {})
+        return tracker
+
+    def test_only_final_state_written_once(self):
+        tracker = self.make_tracker()
+        tracker.handle_message(SENDER, "go")
+        self.assertEqual(
+            [
+                (
+                    {
+                        SENDER: (
+                            Chatty.key,
+                            "end",
+                            {"step": 2},
+                            NOW + DEFAULT_CONVERSATION_TIMEOUT,
+                        )
+                    },
+                    [{"Put": {"TableName": "Larder"}}],
+                )
+            ],
+            tracker.persistence.commits,
+        )
+
+    def test_changes_discarded_on_error(self):
+        tracker = self.make_tracker()
+        with patch("tina.conversation.conversation.send_sms"):
+            with self.assertRaises(RuntimeError):
+                tracker.handle_message(SENDER, "fail")
+        self.assertEqual([], tracker.persistence.commits)
+        self.assertEqual(
+            "start", tracker.persistence.get_current_conversation(SENDER).state
+        )
+
+    def test_writes_through_outside_turn(self):
+        tracker = self.make_tracker()
+        Chatty(tracker, SENDER).set_state("middle")
+        self.assertEqual(
+            "middle", tracker.persistence.get_current_conversation(SENDER).state
+        )
+        self.assertEqual([], tracker.persistence.commits)
+
+
+class TestConflicts(unittest.TestCase):
+    def test_message_replayed_after_conflict(self):
+        tracker = make_tracker(inline_recipient=SENDER)
+        persistence = tracker.persistence
+        persistence.set_current_conversation(
+            SENDER, Echo.key, "echo_again", {"count": 1}
+        )
+        original_write = persistence.write_changes
+        raced = []
+
+        def racing_write(*args):
+            if not raced:
+                # Another invocation handles a message from the same sender first.
+                raced.append(True)
+                persistence.set_current_conversation(
+                    SENDER, Echo.key, "echo_again", {"count": 5}
+                )
+            return original_write(*args)
+
+        persistence.write_changes = racing_write
+        tracker.handle_message(SENDER, "echo")
+        self.assertEqual(["echo That's 6 echoes"], tracker.inline_replies)
+        self.assertEqual(1, len(persistence.commits))
+
+    def test_gives_up_after_repeated_conflicts(self):
+        tracker = make_tracker()
+        tracker.persistence.write_changes = MagicMock(side_effect=ConversationConflict)
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            with self.assertRaises(ConversationConflict):
+                tracker.handle_message(SENDER, "echo hello")
+        send_sms.assert_not_called()
+
+
+class Reminder(Conversation):
+    timeout = timedelta(hours=2)
+    expired = []
+
+    def handle_spontaneous_message(self, contents) -> bool:
+        if contents == "remind me":
+            self.set_state("waiting", {"about": "eggs"})
+            return True
+        return False
+
+    @state
+    def waiting(self, contents, data):
+        self.send("Got it")
+        self.end_conversation()
+
+    def on_expired(self, state, data):
+        Reminder.expired.append((self.recipient, state, data))
+        self.send("Never mind then")
+
+
+class TestExpiry(unittest.TestCase):
+    def setUp(self):
+        Reminder.expired = []
+        self.now = NOW
+        registry = ConversationTypeRegistry()
+        registry.register(Reminder)
+        registry.register(Echo)
+        self.tracker = ConversationTracker(
+            MockConversationsPersistence(), registry, clock=lambda: self.now
+        )
+
+    def test_expiry_uses_conversation_timeout(self):
+        with patch("tina.conversation.conversation.send_sms"):
+            self.tracker.handle_message(SENDER, "remind me")
+        record = self.tracker.persistence.get_current_conversation(SENDER)
+        self.assertEqual(NOW + timedelta(hours=2), record.expiresAt)
+
+    def test_expired_state_treated_as_absent(self):
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            self.tracker.handle_message(SENDER, "remind me")
+            self.now += timedelta(hours=3)
+            self.tracker.handle_message(SENDER, "echo hi")
+        self.assertEqual([(SENDER, "waiting", {"about": "eggs"})], Reminder.expired)
+        self.assertEqual(
+            [((SENDER, "Never mind then echo hi"),)], send_sms.call_args_list
+        )
+        self.assertEqual(
+            "echo_again",
+            self.tracker.persistence.get_current_conversation(SENDER).state,
+        )
+
+    def test_expired_state_ended_if_not_replaced(self):
+        with patch("tina.conversation.conversation.send_sms"), patch(
+            "tina.conversation.conversation.generic_reply", return_value="Eh?"
+        ):
+            self.tracker.handle_message(SENDER, "remind me")
+            self.now += timedelta(hours=3)
+            self.tracker.handle_message(SENDER, "what?")
+        self.assertIsNone(self.tracker.persistence.get_current_conversation(SENDER))
+
+    def test_sweep(self):
+        persistence = self.tracker.persistence
+        persistence.set_current_conversation(
+            "+1", Reminder.key, "waiting", {}, NOW - timedelta(minutes=1)
+        )
+        persistence.set_current_conversation(
+            "+2", Reminder.key, "waiting", {}, NOW + timedelta(minutes=1)
+        )
+        persistence.set_current_conversation(
+            "+3", "no.longer.Exists", "x", {}, NOW - timedelta(minutes=1)
+        )
+        # Written before conversations had expiry times.
+        persistence.set_current_conversation("+4", Reminder.key, "waiting", {}, None)
+        with patch("tina.conversation.conversation.send_sms") as send_sms:
+            self.assertEqual(2, self.tracker.sweep_expired())
+        send_sms.assert_called_once_with("+1", "Never mind then")
+        self.assertEqual(["+2", "+4"], list(persistence.conversations))
@@ -0,0 +1,136 @@
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from .persistence import (
+    CONVERSATIONS_TABLE,
+    ConversationConflict,
+    ConversationsPersistence,
+)
+from ..utils.dynamo_testing import matches
+
+
+EXPIRY = datetime(2022, 6, 2, tzinfo=timezone.utc)
+
+
+def make_persistence():
+    with patch("tina.conversation.persistence.get_resource") as get_resource:
+        persistence = ConversationsPersistence()
+    persistence.table = MagicMock()
+    return persistence
+
+
+class TestWriteChanges(unittest.TestCase):
+    def test_single_change_is_a_plain_write(self):
+        persistence = make_persistence()
+        persistence.write_changes({"+1": ("key", "state", {"a": 1}, EXPIRY)})
+        persistence.table.update_item.assert_called_once()
+        persistence.write_changes({"+1": None})
+        persistence.table.delete_item.assert_called_once_with(Key={"Recipient": "+1"})
+        persistence.table.meta.client.transact_write_items.assert_not_called()
+
+    def test_changes_with_other_writes_are_one_transaction(self):
+        persistence = make_persistence()
+        larder_update = {"Update": {"TableName": "Larder"}}
+        persistence.write_changes(
+            {"+1": ("key", "state", {}, EXPIRY), "+2": None}, [larder_update]
+        )
+        persistence.table.update_item.assert_not_called()
+        (call,) = persistence.table.meta.client.transact_write_items.call_args_list
+        items = call.kwargs["TransactItems"]
+        self.assertEqual(CONVERSATIONS_TABLE, items[0]["Update"]["TableName"])
+        self.assertEqual({"Recipient": "+2"}, items[1]["Delete"]["Key"])
+        self.assertEqual(larder_update, items[2])
+
+
+def client_error(code, reasons=None):
+    response = {"Error": {"Code": code}}
+    if reasons is not None:
+        response["CancellationReasons"] = [{"Code": reason} for reason in reasons]
+    return ClientError(response, "Write")
+
+
+class TestVersioning(unittest.TestCase):
+    def test_reads_version(self):
+        persistence = make_persistence()
+        persistence.table.get_item.return_value = {
+            "Item": {
+                "ConversationKey": "key",
+                "State": "state",
+                "Data": {},
+                "Version": Decimal(3),
+            }
+        }
+        self.assertEqual(3, persistence.get_current_conversation("+1").version)
+
+    def test_conditions_on_read_version(self):
+        persistence = make_persistence()
+        persistence.write_changes(
+            {"+1": ("k", "s", {}, EXPIRY)}, expected_versions={"+1": 3}
+        )
+        args = persistence.table.update_item.call_args.kwargs
+        self.assertEqual("Version = :version", args["ConditionExpression"])
+        self.assertEqual(3, args["ExpressionAttributeValues"][":version"])
+
+        persistence.write_changes({"+1": None}, expected_versions={"+1": None})
+        args = persistence.table.delete_item.call_args.kwargs
+        self.assertEqual("attribute_not_exists(Recipient)", args["ConditionExpression"])
+
+    def test_failed_condition_is_a_conflict(self):
+        persistence = make_persistence()
+        persistence.table.update_item.side_effect = client_error(
+            "ConditionalCheckFailedException"
+        )
+        with self.assertRaises(ConversationConflict):
+            persistence.write_changes(
+                {"+1": ("k", "s", {}, EXPIRY)}, expected_versions={"+1": 1}
+            )
+
+    def test_only_conversation_conditions_are_conflicts(self):
+        persistence = make_persistence()
+        transact = persistence.table.meta.client.transact_write_items
+        transact.side_effect = client_error(
+            "TransactionCanceledException", ["None", "ConditionalCheckFailed"]
+        )
+        with self.assertRaises(ClientError):
+            persistence.write_changes({"+1": ("k", "s", {}, EXPIRY)}, [{"Update": {}}])
+
+        transact.side_effect = client_error(
+            "TransactionCanceledException", ["ConditionalCheckFailed", "None"]
+        )
+        with self.assertRaises(ConversationConflict):
+            persistence.write_changes({"+1": ("k", "s", {}, EXPIRY)}, [{"Update": {}}])
+
+
+class TestExpiry(unittest.TestCase):
+    def test_writes_expiry(self):
+        persistence = make_persistence()
+        persistence.write_changes({"+1": ("k", "s", {}, EXPIRY)})
+        args = persistence.table.update_item.call_args.kwargs
+        self.assertIn("ExpiresAt = :expires", args["UpdateExpression"])
+        self.assertEqual(
+            int(EXPIRY.timestamp()), args["ExpressionAttributeValues"][":expires"]
+        )
+
+    def test_reads_expiry(self):
+        persistence = make_persistence()
+        persistence.table.get_item.return_value = {
+            "Item": {
+                "ConversationKey": "k",
+                "State": "s",
+                "Data": {},
+                "ExpiresAt": Decimal(int(EXPIRY.timestamp())),
+            }
+        }
+        self.assertEqual(EXPIRY, persistence.get_current_conversation("+1").expiresAt)
+
+    def test_sweeps_only_conversations_past_their_expiry(self):
+        persistence = make_persistence()
+        persistence.table.scan.return_value = {"Items": []}
+        persistence.get_expired_conversations(EXPIRY)
+        condition = persistence.table.scan.call_args.kwargs["FilterExpression"]
+        expires_at = Decimal(int(EXPIRY.timestamp()))
+        self.assertTrue(matches(condition, {"ExpiresAt": expires_at}))
+        self.assertFalse(matches(condition, {"ExpiresAt": expires_at + 1}))
+        self.assertFalse(matches(condition, {}))
@@ -0,0 +1,57 @@
+import unittest
+from .triggers import Keywords, Pattern, Phrase, TriggerIndex
+
+
+class Jokes:
+    triggers = [Keywords("joke", "Funny"), Phrase("knock knock")]
+
+
+class Weather:
+    triggers = [Pattern(r"\b(rain|sun)(ny|y)?\b"), Keywords("weather")]
+
+
+class Timer:
+    triggers = [Pattern(r"\d+ ?min")]
+
+
+class Fallback:
+    pass
+
+
+class TestTriggerIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = TriggerIndex([Jokes, Weather, Timer, Fallback])
+
+    def test_keywords(self):
+        self.assertEqual([Jokes, Fallback], self.index.match("Tell me a JOKE!"))
+        self.assertEqual([Jokes, Fallback], self.index.match("very funny"))
+
+    def test_keywords_match_whole_words(self):
+        self.assertEqual([Fallback], self.index.match("jokers"))
+
+    def test_phrases(self):
+        self.assertEqual([Jokes, Fallback], self.index.match("Knock, knock"))
+        self.assertEqual([Fallback], self.index.match("knock on wood"))
+
+    def test_patterns(self):
+        self.assertEqual([Weather, Fallback], self.index.match("Is it sunny?"))
+        self.assertEqual([Timer, Fallback], self.index.match("remind me in 5 mins"))
+
+    def test_multiple_matches_in_registration_order(self):
+        self.assertEqual(
+            [Jokes, Weather, Timer, Fallback],
+            self.index.match("In 10 min, tell me a joke about the rain"),
+        )
+
+    def test_untriggered_types_always_offered(self):
+        self.assertEqual([Fallback], self.index.match("hello"))
+
+    def test_overlapping_patterns_all_match(self):
+        class Greeting:
+            triggers = [Pattern("hello")]
+
+        class World:
+            triggers = [Pattern("hello world")]
+
+        index = TriggerIndex([Greeting, World])
+        self.assertEqual([Greeting, World], index.match("Hello world"))
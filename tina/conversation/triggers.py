@@ -0,0 +1,113 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Set, Tuple, Type
+
+
+TOKEN_REGEX = re.compile(r"[a-z0-9'-]+")
+
+
+class Trigger:
+    """
+    Something in an incoming message that a Conversation wants to hear about. A
+    Conversation lists its triggers in its `triggers` class attribute, and is only
+    offered spontaneous messages that match at least one of them.
+    """
+
+
+@dataclass(frozen=True)
+class Keywords(Trigger):
+    """Matches if any of the words appears in the message, ignoring case."""
+
+    words: Tuple[str, ...]
+
+    def __init__(self, *words: str):
+        object.__setattr__(self, "words", tuple(word.lower() for word in words))
+
+
+@dataclass(frozen=True)
+class Phrase(Trigger):
+    """Matches if the words of the phrase appear consecutively, ignoring case."""
+
+    text: str
+
+
+@dataclass(frozen=True)
+class Pattern(Trigger):
+    """
+    Matches if the regex matches anywhere in the message, ignoring case. The regex
+    shouldn't use named groups or backreferences, as it's combined with others.
+    """
+
+    regex: str
+
+
+def tokenize(contents: str) -> List[str]:
+    return TOKEN_REGEX.findall(contents.lower())
+
+
+class TriggerIndex:
+    """
+    All registered triggers compiled for single-pass matching: keywords and phrases
+    are looked up by word while walking the message's tokens once, and all patterns
+    are combined into one regex of optional lookaheads, one per pattern, each
+    searching the whole message from the start. A single match attempt then reports
+    every pattern that matches anywhere, even where patterns overlap.
+    """
+
+    def __init__(self, conversation_types: Sequence[Type]):
+        self.order = {t: i for i, t in enumerate(conversation_types)}
+        self.untriggered: Set[Type] = set()
+        self.keywords: Dict[str, Set[Type]] = {}
+        # First word -> (remaining words, type), for phrases.
+        self.phrases: Dict[str, List[Tuple[Tuple[str, ...], Type]]] = {}
+        self.pattern_types: List[Type] = []
+        patterns: List[str] = []
+
+        for conversation_type in conversation_types:
+            triggers = getattr(conversation_type, "triggers", None)
+            if not triggers:
+                self.untriggered.add(conversation_type)
+                continue
+            for trigger in triggers:
+                if isinstance(trigger, Keywords):
+                    for word in trigger.words:
+                        self.keywords.setdefault(word, set()).add(conversation_type)
+                elif isinstance(trigger, Phrase):
+                    first, *rest = tokenize(trigger.text)
+                    self.phrases.setdefault(first, []).append(
+                        (tuple(rest), conversation_type)
+                    )
+                elif isinstance(trigger, Pattern):
+                    patterns.append(
+                        rf"(?=[\s\S]*?(?P<p{len(patterns)}>{trigger.regex}))?"
+                    )
+                    self.pattern_types.append(conversation_type)
+                else:
+                    raise TypeError(f"Unsupported trigger {trigger!r}")
+
+        self.combined_pattern = (
+            re.compile("^" + "".join(patterns), re.IGNORECASE) if patterns else None
+        )
+
+    def match(self, contents: str) -> List[Type]:
+        """
+        The conversation types that should be offered the message, in registration
+        order. Types that declare no triggers are always included.
+        """
+        matched = set(self.untriggered)
+        tokens = tokenize(contents)
+        for i, token in enumerate(tokens):
+            matched.update(self.keywords.get(token, ()))
+            for rest, conversation_type in self.phrases.get(token, ()):
+                if tuple(tokens[i + 1 : i + 1 + len(rest)]) == rest:
+                    matched.add(conversation_type)
+
+        if self.combined_pattern is not None:
+            # Always matches, as every lookahead is optional.
+            match = self.combined_pattern.match(contents)
+            for group, value in match.groupdict().items():
+                if value is not None:
+                    matched.add(self.pattern_types[int(group[1:])])
+
+        return sorted(matched, key=self.order.__getitem__)
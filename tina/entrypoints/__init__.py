@@ -1 +1,32 @@
-from .entrypoints import check_in, handle_message, ping, manual
+"""
+Lambda entrypoints. Each one lives in its own module and is only imported when
+the Lambda runtime first looks it up, so a cold start loads just the dependencies
+of the entrypoint being invoked.
+"""
+import logging
+import sys
+
+
+logging.getLogger("tina").setLevel(logging.DEBUG)
+
+# Entrypoint name -> module that defines it.
+ENTRYPOINT_MODULES = {
+    "check_in": "tina.entrypoints.checkin",
+    "handle_message": "tina.entrypoints.message_handler",
+    "manual": "tina.entrypoints.manual_run",
+    "ping": "tina.entrypoints.health",
+}
+
+__all__ = list(ENTRYPOINT_MODULES)
+
+
+def __getattr__(name):
+    if name not in ENTRYPOINT_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name = ENTRYPOINT_MODULES[name]
+    # __import__ rather than importlib.import_module, as only the former shows up in
+    # -X importtime output, which importprofile relies on.
+    __import__(module_name)
+    entrypoint = getattr(sys.modules[module_name], name)
+    globals()[name] = entrypoint
+    return entrypoint
@@ -0,0 +1,68 @@
+import logging
+from ..bagatelles import register_bagatelles
+from ..conversation import ConversationTracker
+from ..larder import Larder, StockCheck, maybe_check_stock
+from ..scheduler import Scheduler
+from ..scheduler.persistence import SchedulePersistence
+from ..secrets import prefetch_secrets
+from ..twilio import retry_outbox
+
+
+logger = logging.getLogger(__name__)
+
+
+# (action key, handler, recurrence) for every scheduled action.
+ALL_ACTIONS = [
+    (StockCheck.ACTION_KEY, maybe_check_stock, StockCheck.RECURRENCE),
+]
+
+_larder_backfilled = False
+
+
+def check_in(event, context):
+    global _larder_backfilled
+    logger.info("Running scheduled check-in")
+    register_bagatelles()
+    prefetch_secrets()
+    persistence = SchedulePersistence()
+    scheduler = Scheduler(persistence)
+    action_keys = [action_key for action_key, _, _ in ALL_ACTIONS]
+    recurrences = {action_key: recurrence for action_key, _, recurrence in ALL_ACTIONS}
+
+    # Entries written before the DueIndex existed would otherwise count as scheduled
+    # but never fall due. They also predate recurrences, so would only fire once.
+    migrated = persistence.migrate_legacy_entries(action_keys, recurrences)
+    if migrated:
+        logger.info(f"Migrated {migrated} legacy schedule entries")
+
+    # Likewise, larder items from before the CheckDueIndex are invisible to the stock
+    # check until backfilled. The scan only needs to happen once per container.
+    if not _larder_backfilled:
+        try:
+            backfilled = Larder().backfill_check_due()
+            _larder_backfilled = True
+            if backfilled:
+                logger.info(f"Backfilled {backfilled} larder items")
+        except Exception:
+            logger.exception("Unable to backfill larder items")
+
+    for action_key, handler, _ in ALL_ACTIONS:
+        scheduler.register_action(action_key, handler)
+    scheduler.ensure_all_scheduled(action_keys, recurrences)
+
+    for outcome in scheduler.execute_all_parallel():
+        logger.info(
+            f"{outcome.entry.action.actionKey}: {outcome.status.value} in {outcome.duration}"
+        )
+
+    try:
+        retry_outbox()
+    except Exception:
+        logger.exception("Unable to retry outbox messages")
+
+    try:
+        cleared = ConversationTracker().sweep_expired()
+        logger.info(f"Cleared {cleared} expired conversations")
+    except Exception:
+        logger.exception("Unable to sweep expired conversations")
+    return {"statusCode": 200, "body": "Done!"}
@@ -0,0 +1,137 @@
+"""
+Reports how long each Lambda entrypoint takes to import, broken down by the
+modules with the highest cumulative import cost.
+
+Run with `python -m tina.entrypoints.importprofile [entrypoint ...]` to profile
+entrypoints in fresh interpreters, or pass `--log PATH` to report on the output
+of a Lambda run locally with PYTHONPROFILEIMPORTTIME=1 set (see `make run-local`
+and `make profile-imports`). With
+`--budget-ms`, exits non-zero if any entrypoint takes longer than the budget.
+"""
+import argparse
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Iterable, List
+from . import ENTRYPOINT_MODULES
+
+
+DEFAULT_TOP_MODULES = 15
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+class ImportFailed(Exception):
+    pass
+
+
+def parse_import_times(lines: Iterable[str]) -> List[ImportTiming]:
+    """
+    Parses the `import time:` lines written to stderr by `python -X importtime`,
+    ignoring anything else.
+    """
+    timings = []
+    for line in lines:
+        match = IMPORT_TIME_LINE.search(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            timings.append(
+                ImportTiming(
+                    module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2
+                )
+            )
+    return timings
+
+
+def profile_module(module: str) -> List[ImportTiming]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ImportFailed(result.stderr.strip().splitlines()[-1])
+    return import_subtree(parse_import_times(result.stderr.splitlines()), module)
+
+
+def import_subtree(timings: List[ImportTiming], module: str) -> List[ImportTiming]:
+    """
+    The timings of module and everything it imported, leaving out modules loaded
+    by interpreter startup. Timings are logged children first, so the subtree is
+    the run of nested entries just before the module's own top-level entry.
+    """
+    end = max(i for i, t in enumerate(timings) if t.module == module and t.depth == 0)
+    start = end
+    while start > 0 and timings[start - 1].depth > 0:
+        start -= 1
+    return timings[start : end + 1]
+
+
+def total_ms(timings: List[ImportTiming]) -> float:
+    return sum(t.cumulative_us for t in timings if t.depth == 0) / 1000
+
+
+def report(title: str, timings: List[ImportTiming], top: int) -> None:
+    print(f"{title}: {total_ms(timings):.1f} ms total")
+    for timing in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        print(
+            f"  {timing.cumulative_us / 1000:>9.1f} ms  "
+            f"{timing.self_us / 1000:>7.1f} ms self  {timing.module}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "entrypoints", nargs="*", help=f"any of {', '.join(ENTRYPOINT_MODULES)}"
+    )
+    parser.add_argument("--log", help="report on an existing -X importtime log")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_MODULES)
+    parser.add_argument("--budget-ms", type=float)
+    args = parser.parse_args()
+    unknown = set(args.entrypoints) - set(ENTRYPOINT_MODULES)
+    if unknown:
+        parser.error(f"unknown entrypoints: {', '.join(sorted(unknown))}")
+
+    results = {}
+    failed = []
+    if args.log:
+        with open(args.log) as f:
+            timings = parse_import_times(f)
+        for name, module in ENTRYPOINT_MODULES.items():
+            if any(t.module == module and t.depth == 0 for t in timings):
+                results[name] = import_subtree(timings, module)
+        if not results:
+            results[args.log] = timings
+    else:
+        for name in args.entrypoints or ENTRYPOINT_MODULES:
+            try:
+                results[name] = profile_module(ENTRYPOINT_MODULES[name])
+            except ImportFailed as e:
+                print(f"{name}: import failed ({e})\n")
+                failed.append(name)
+
+    over_budget = []
+    for title, timings in results.items():
+        report(title, timings, args.top)
+        print()
+        if args.budget_ms is not None and total_ms(timings) > args.budget_ms:
+            over_budget.append(title)
+
+    if over_budget:
+        print(f"Over the {args.budget_ms} ms budget: {', '.join(over_budget)}")
+    if failed or over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
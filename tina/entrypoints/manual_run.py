@@ -0,0 +1,9 @@
+from ..playwright import test_playwright
+from ..shopper.ocado import main
+
+
+def manual(event, context):
+    # Used for manual testing of new functions and workflows, by
+    # editing the code below.
+    main()
+    return {"statusCode": 200, "body": "Done!"}
@@ -0,0 +1,33 @@
+import logging
+from ..bagatelles import register_bagatelles
+from ..conversation import ConversationTracker
+from ..larder import StockCheck  # Registers the conversation, so replies reach it
+from ..twilio import get_inbound_dedupe, messaging_response
+from urllib.parse import unquote
+
+
+logger = logging.getLogger(__name__)
+
+
+def handle_message(event, context):
+    # Twilio retries webhooks that are slow or fail, so ignore repeat deliveries.
+    message_sid = unquote(event.get("MessageSid", ""))
+    dedupe = get_inbound_dedupe()
+    if message_sid and not dedupe.claim(message_sid):
+        logger.info(f"Ignoring repeat delivery of message {message_sid}")
+        return messaging_response([])
+
+    try:
+        register_bagatelles()
+        # No prefetch_secrets: replies go inline as TwiML, so the Twilio credentials
+        # are only fetched, lazily, if something has to be sent over REST.
+        sender = unquote(event["From"])
+        body = unquote(event["Body"]).replace("+", " ")
+        logger.info("Handling a message from " + sender)
+        conversations = ConversationTracker(inline_recipient=sender)
+        conversations.handle_message(sender, body)
+        return messaging_response(conversations.inline_replies)
+    except Exception as e:
+        if message_sid:
+            dedupe.release(message_sid)
+        raise e
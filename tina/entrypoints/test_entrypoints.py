@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import unittest
+from .importprofile import import_subtree, parse_import_times
+
+
+IMPORT_TIME_LOG = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   encodings.aliases
+import time:       200 |        300 | encodings
+import time:        50 |         50 | tina.entrypoints
+import time:        20 |         20 |     tina.larder.persistence
+import time:        10 |         30 |   tina.larder
+import time:        40 |         70 | tina.entrypoints.checkin
+some other log line
+"""
+
+
+class TestLazyEntrypoints(unittest.TestCase):
+    def test_ping_loads_nothing_else(self):
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, tina.entrypoints as e; e.ping; print(' '.join(sys.modules))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        for module in ("boto3", "requests", "playwright", "tina.conversation"):
+            self.assertNotIn(module, loaded)
+
+    def test_handle_message_registers_stateful_conversations(self):
+        registered = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import tina.entrypoints as e; e.handle_message; "
+                "from tina.conversation.conversation import global_registry; "
+                "print(' '.join(global_registry.type_map))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        from tina.larder import StockCheck
+
+        self.assertIn(StockCheck.key, registered)
+
+    def test_unknown_attribute(self):
+        import tina.entrypoints
+
+        with self.assertRaises(AttributeError):
+            tina.entrypoints.nonexistent
+
+
+class TestImportProfile(unittest.TestCase):
+    def test_parse(self):
+        timings = parse_import_times(IMPORT_TIME_LOG.splitlines())
+        self.assertEqual(6, len(timings))
+        self.assertEqual("encodings.aliases", timings[0].module)
+        self.assertEqual(1, timings[0].depth)
+        self.assertEqual(2, timings[3].depth)
+        self.assertEqual(300, timings[1].cumulative_us)
+
+    def test_subtree(self):
+        timings = parse_import_times(IMPORT_TIME_LOG.splitlines())
+        subtree = import_subtree(timings, "tina.entrypoints.checkin")
+        self.assertEqual(
+            ["tina.larder.persistence", "tina.larder", "tina.entrypoints.checkin"],
+            [t.module for t in subtree],
+        )
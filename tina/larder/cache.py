@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+DEFAULT_TTL_SECONDS = float(os.environ.get("TINA_LARDER_CACHE_TTL_SECONDS", "300"))
+
+
+class LarderCache:
+    """
+    Remembers the results of larder reads for ttl_seconds. Its main use is the due
+    items query: each recipient's StockCheck.initiate asks for the same items when a
+    check is fanned out, and warm invocations repeat the query on every check-in.
+    Writes made through a Larder clear the cache; writes made anywhere else (e.g. by
+    another container) show up once it expires.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        # Bumped on every invalidation, so a read that started before a write can't
+        # repopulate the cache with what it saw.
+        self._generation = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            stored_at, value = cached
+            if self.clock() - stored_at >= self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return value
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, key: Hashable, value: Any, generation: int) -> None:
+        """
+        Stores the result of a read that started at the given generation, unless the
+        cache has been invalidated since.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (self.clock(), value)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+_cache: Optional[LarderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_larder_cache() -> LarderCache:
+    """
+    Returns the process-wide larder cache, which persists across warm invocations.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LarderCache()
+        return _cache
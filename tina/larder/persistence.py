@@ -1,56 +1,285 @@
 import boto3
-from dataclasses import replace
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
-from typing import Callable, Dict, List, Optional
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 from tina.utils.dateutils import to_epoch_time
+from ..aws import get_resource
+from ..utils import paginate
+from .cache import LarderCache, get_larder_cache
 from .objects import LarderItem, ShopOption
 from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
 
 
 LARDER_TABLE = "Larder"
 
+# Attributes every projection must include, as items can't be read without them.
+REQUIRED_ATTRIBUTES = ("ItemName", "LastChecked", "Quantity")
+
+# Enough to decide what needs checking and ask about it, without shopping details.
+CHECK_ATTRIBUTES = REQUIRED_ATTRIBUTES + ("CheckFrequencyInDays", "GroupNoun")
+
+# Sparse global secondary index over items that have a check frequency, partitioned on
+# the constant CheckShard attribute and sorted on NextCheckDue, so "what is due before
+# T" is a range query in due order. Projects at least CHECK_ATTRIBUTES.
+CHECK_DUE_INDEX = "CheckDueIndex"
+CHECK_SHARD = "tracked"
+
+# The most items DynamoDB accepts in one TransactWriteItems call.
+MAX_TRANSACTION_ITEMS = 100
+
 
 class Larder:
+    """
+    Reads and writes the larder table. Larders on the default session share the
+    process-wide LarderCache, so repeated calls to get_items_due_update, get_contents
+    and get_item are served from memory until this process writes to the larder or
+    the cache expires. Callers that must see deletions made elsewhere, like
+    StockCheck.save_counts, call invalidate_cache first.
+    """
+
     def __init__(
-        self, clock: Callable[[], datetime] = None, session: boto3.Session = None
+        self,
+        clock: Callable[[], datetime] = None,
+        session: boto3.Session = None,
+        cache: LarderCache = None,
     ):
         if not clock:
             clock = lambda: datetime.now(timezone.utc)
-        if session is None:
-            session = boto3.Session()
         self.clock = clock
-        self.table = session.resource("dynamodb").Table(LARDER_TABLE)
+        self.session = session
+        if session is None:
+            resource = get_resource("dynamodb")
+            if cache is None:
+                cache = get_larder_cache()
+        else:
+            resource = session.resource("dynamodb")
+        self.table = resource.Table(LARDER_TABLE)
+        self.cache = cache
+
+    def get_contents(
+        self, attributes: Iterable[str] = None, segments: int = 1
+    ) -> Iterator[LarderItem]:
+        """
+        Yields every item in the larder, reading page by page. If attributes are
+        given, only those DynamoDB attributes (plus the required ones) are read, and
+        the rest are left as None. With segments > 1, the table is scanned in that
+        many parallel segments, and items are yielded as each segment completes.
+        """
+        if self.cache is None:
+            yield from self._scan_contents(attributes, segments)
+            return
 
-    def get_contents(self) -> List[LarderItem]:
-        results = self.table.scan()["Items"]
-        return [self._deserialize_entry(item) for item in results]
+        key = ("contents", None if attributes is None else tuple(attributes))
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield from cached
+            return
+
+        generation = self.cache.generation()
+        items = []
+        for item in self._scan_contents(attributes, segments):
+            items.append(item)
+            yield item
+        self.cache.put(key, items, generation)
+
+    def _scan_contents(
+        self, attributes: Optional[Iterable[str]], segments: int
+    ) -> Iterator[LarderItem]:
+        scan_args = self._projection_args(attributes)
+        if segments <= 1:
+            for entry in paginate(self.table.scan, **scan_args):
+                yield self._deserialize_entry(entry)
+            return
+
+        def scan_segment(segment: int) -> List[Dict[str, Any]]:
+            return list(
+                paginate(
+                    self._thread_table().scan,
+                    Segment=segment,
+                    TotalSegments=segments,
+                    **scan_args,
+                )
+            )
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(scan_segment, i) for i in range(segments)]
+            for future in as_completed(futures):
+                for entry in future.result():
+                    yield self._deserialize_entry(entry)
 
     def get_item(self, item_name: str) -> LarderItem:
+        return self._read_through(("item", item_name), self._get_item, item_name)
+
+    def _get_item(self, item_name: str) -> LarderItem:
         result = self.table.get_item(Key={"ItemName": item_name})
         return self._deserialize_entry(result["Item"])
 
     def put_item(self, item: LarderItem) -> None:
         item.validate()
         self.table.put_item(Item=self._serialize_entry(item))
+        self.invalidate_cache()
 
-    def update_quantity(self, item_name: str, new_quantity: float) -> None:
-        old_item = self.get_item(item_name)
-        updated_item = replace(
-            old_item, quantity=new_quantity, lastChecked=self.clock()
-        )
-        self.put_item(updated_item)
+    def update_quantity(self, item_name: str, new_quantity: float) -> LarderItem:
+        """
+        Records a new count for an existing item in a single write, and returns the
+        updated item. Raises KeyError if there's no such item.
+        """
+        try:
+            result = self.table.update_item(
+                **self._quantity_update_args(item_name, new_quantity),
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise KeyError(item_name) from e
+            raise e
+        finally:
+            self.invalidate_cache()
+        return self._deserialize_entry(result["Attributes"])
 
-    def get_items_due_update(self):
-        now = self.clock()
+    def update_quantities(self, quantities: Dict[str, float]) -> None:
+        """
+        Records new counts for several existing items, in as few transactions as
+        DynamoDB allows. Each transaction is all-or-nothing, and raises KeyError if
+        any of its items doesn't exist.
+        """
+        items = self.quantity_updates(quantities)
+        for start in range(0, len(items), MAX_TRANSACTION_ITEMS):
+            batch = items[start : start + MAX_TRANSACTION_ITEMS]
+            try:
+                self.table.meta.client.transact_write_items(TransactItems=batch)
+            except ClientError as e:
+                self.invalidate_cache()
+                if e.response["Error"]["Code"] != "TransactionCanceledException":
+                    raise e
+                missing = [
+                    item["Update"]["Key"]["ItemName"]
+                    for item, reason in zip(
+                        batch, e.response.get("CancellationReasons", [])
+                    )
+                    if reason.get("Code") == "ConditionalCheckFailed"
+                ]
+                if missing:
+                    raise KeyError(*missing) from e
+                raise e
+        self.invalidate_cache()
+
+    def quantity_updates(self, quantities: Dict[str, float]) -> List[Dict[str, Any]]:
+        """
+        TransactWriteItems items that record new counts for existing items, for
+        writing together with other changes. Whoever writes them should call
+        invalidate_cache afterwards.
+        """
         return [
-            item
-            for item in self.get_contents()
-            if item.checkFrequencyDays is not None
-            and item.lastChecked + timedelta(days=int(item.checkFrequencyDays)) < now
+            {
+                "Update": {
+                    "TableName": LARDER_TABLE,
+                    **self._quantity_update_args(item_name, quantity),
+                }
+            }
+            for item_name, quantity in quantities.items()
         ]
 
+    def _quantity_update_args(
+        self, item_name: str, new_quantity: float
+    ) -> Dict[str, Any]:
+        # NextCheckDue is only indexed alongside CheckShard, so on untracked items,
+        # which have no CheckFrequencySeconds, it's set but inert.
+        return {
+            "Key": {"ItemName": item_name},
+            "UpdateExpression": "SET Quantity = :quantity, LastChecked = :now, NextCheckDue = :now + if_not_exists(CheckFrequencySeconds, :zero)",
+            "ConditionExpression": "attribute_exists(ItemName)",
+            "ExpressionAttributeValues": {
+                ":quantity": Decimal(str(new_quantity)),
+                ":now": to_epoch_time(self.clock()),
+                ":zero": 0,
+            },
+        }
+
+    def get_items_due_update(self, limit: int = None) -> List[LarderItem]:
+        """
+        Items whose next check is overdue, most overdue first, read with only the
+        attributes a stock check needs. If limit is given, at most that many are read.
+        """
+        return list(self._read_through(("due", limit), self._query_due, limit))
+
+    def _query_due(self, limit: Optional[int]) -> List[LarderItem]:
+        query_args = self._projection_args(CHECK_ATTRIBUTES)
+        if limit is not None:
+            query_args["Limit"] = limit
+        results = paginate(
+            self.table.query,
+            IndexName=CHECK_DUE_INDEX,
+            KeyConditionExpression=Key("CheckShard").eq(CHECK_SHARD)
+            & Key("NextCheckDue").lt(to_epoch_time(self.clock())),
+            **query_args,
+        )
+        return [self._deserialize_entry(entry) for entry in islice(results, limit)]
+
+    def backfill_check_due(self) -> int:
+        """
+        Rewrites items created before the indexed layout, which have a check frequency
+        but no NextCheckDue or CheckFrequencySeconds, so are invisible to
+        get_items_due_update or would stay due after their next count. Returns
+        the number backfilled.
+        """
+        legacy_items = list(
+            paginate(
+                self.table.scan,
+                FilterExpression=Attr("CheckFrequencyInDays").exists()
+                & (
+                    Attr("NextCheckDue").not_exists()
+                    | Attr("CheckFrequencySeconds").not_exists()
+                ),
+            )
+        )
+        with self.table.batch_writer() as batch:
+            for item in legacy_items:
+                batch.put_item(
+                    Item=self._serialize_entry(self._deserialize_entry(item))
+                )
+        self.invalidate_cache()
+        return len(legacy_items)
+
+    def _thread_table(self) -> Table:
+        # boto3 resources aren't thread-safe, so other threads need a Table of their
+        # own. A caller who passes their own session owns that problem.
+        if self.session is None:
+            return get_resource("dynamodb").Table(LARDER_TABLE)
+        return self.table
+
+    def invalidate_cache(self) -> None:
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _read_through(self, key, read: Callable[..., Any], *args) -> Any:
+        if self.cache is None:
+            return read(*args)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation()
+        result = read(*args)
+        self.cache.put(key, result, generation)
+        return result
+
+    @staticmethod
+    def _projection_args(attributes: Optional[Iterable[str]]) -> Dict[str, Any]:
+        if attributes is None:
+            return {}
+        names = list(dict.fromkeys(REQUIRED_ATTRIBUTES + tuple(attributes)))
+        return {
+            "ProjectionExpression": ", ".join(f"#a{i}" for i in range(len(names))),
+            "ExpressionAttributeNames": {
+                f"#a{i}": name for i, name in enumerate(names)
+            },
+        }
+
     @staticmethod
     def _deserialize_entry(entry_item: Dict[str, any]) -> LarderItem:
         item = LarderItem(
@@ -95,6 +324,11 @@ class Larder:
             entry["GroupNoun"] = item.groupNoun
         if item.checkFrequencyDays is not None:
             entry["CheckFrequencyInDays"] = item.checkFrequencyDays
+            # Seconds as well as days, so updates can move NextCheckDue on in place.
+            frequency = timedelta(days=int(item.checkFrequencyDays))
+            entry["CheckFrequencySeconds"] = int(frequency.total_seconds())
+            entry["CheckShard"] = CHECK_SHARD
+            entry["NextCheckDue"] = to_epoch_time(item.lastChecked + frequency)
         if item.minAmount is not None:
             entry["MinAmount"] = item.minAmount
         if item.buyVia is not None:
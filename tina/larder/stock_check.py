@@ -1,16 +1,16 @@
 from datetime import timedelta
-import inflect
+from decimal import Decimal
 import logging
 import re
-import random
 
 from random import choice
 
 from ..conversation import Conversation, ConversationTracker, state
 from ..dialog import greeting, yesorno
-from .persistence import Larder
-from ..scheduler import Scheduler
+from .persistence import MAX_TRANSACTION_ITEMS, Larder
+from ..scheduler import JitteredInterval
 from ..twilio import get_recipients
+from ..utils import fan_out
 
 
 logger = logging.getLogger(__name__)
@@ -18,35 +18,37 @@ number_regex = re.compile("[\d\.]+")
 
 
 def maybe_check_stock():
-    for recipient in get_recipients():
-        stock_check = StockCheck(ConversationTracker(), recipient)
-        if stock_check.should_initiate():
-            logging.info("Stock check needed for one or more items - initiating")
-            stock_check.initiate()
-        else:
-            logging.info("Stock is up to date - will not request stock check")
-            stock_check.reschedule()
+    # The larder is shared, so whether a check is due is the same for everyone.
+    if not Larder().get_items_due_update(limit=1):
+        logging.info("Stock is up to date - will not request stock check")
+        return
+
+    logging.info("Stock check needed for one or more items - initiating")
+    results = fan_out(
+        lambda recipient: StockCheck(ConversationTracker(), recipient).initiate(),
+        get_recipients(),
+    )
+    for result in results:
+        if result.error is not None:
+            logger.error(
+                f"Failed to start stock check with {result.item}", exc_info=result.error
+            )
 
 
 class StockCheck(Conversation):
     ACTION_KEY = "StockCheck"
+    RECURRENCE = JitteredInterval(timedelta(hours=12), timedelta(hours=36))
+    # Shorter than the shortest gap between checks, so a check that's ignored never
+    # blocks the next one.
+    timeout = timedelta(hours=11)
 
-    def __init__(
-        self,
-        conversation_tracker: ConversationTracker,
-        recipient: str,
-        scheduler: Scheduler = None,
-    ):
+    def __init__(self, conversation_tracker: ConversationTracker, recipient: str):
         super().__init__(conversation_tracker, recipient)
-        if scheduler is None:
-            scheduler = Scheduler()
-        self.scheduler = scheduler
-
-    def should_initiate(self):
-        larder = Larder()
-        return larder.get_items_due_update()
 
     def initiate(self):
+        # The items to ask about, as [name, group noun] pairs, most overdue first.
+        # Answers are collected in "counts" and only written to the larder at the end.
+        queue = self.due_queue()
         message = (
             greeting()
             + " "
@@ -60,51 +62,103 @@ class StockCheck(Conversation):
             )
         )
         self.send(message)
-        self.set_state("get_user_goahead")
+        self.set_state("get_user_goahead", {"queue": queue, "counts": {}})
+
+    @staticmethod
+    def due_queue():
+        return [[item.name, item.groupNoun] for item in Larder().get_items_due_update()]
+
+    @staticmethod
+    def upgrade_data(data):
+        """
+        Checks started before the queue was kept in the conversation data stored at
+        most the item being asked about, as "current_item", and wrote each count as
+        it came in. Rebuilds the queue from the items still due, current item first.
+        """
+        if "queue" in data:
+            return data
+        queue = StockCheck.due_queue()
+        current_item = data.get("current_item")
+        if current_item is not None:
+            current = [entry for entry in queue if entry[0] == current_item]
+            rest = [entry for entry in queue if entry[0] != current_item]
+            queue = (current or [[current_item, None]]) + rest
+        return {"queue": queue, "counts": {}}
 
     @state
-    def get_user_goahead(self, message, _data):
+    def get_user_goahead(self, message, data):
+        data = self.upgrade_data(data)
         user_preference = yesorno(message)
         if user_preference == "yes":
             self.send("Great, let's get started.")
-            self.ask_next_question()
+            self.ask_next_question(data)
         elif user_preference == "no":
             self.send("That's ok! Another time then.")
-            self.reschedule()
         else:
             self.send("Sorry, I didn't quite get that. Try again?")
 
-    def ask_next_question(self):
-        larder = Larder()
-        due_items = larder.get_items_due_update()
-        if due_items:
+    def ask_next_question(self, data):
+        if data["queue"]:
+            import inflect
+
             p = inflect.engine()
-            item = next(iter(due_items))
-            if item.groupNoun is not None:
-                self.send(
-                    f"How many {p.plural(item.groupNoun)} of {item.name} do you have?"
-                )
+            name, group_noun = data["queue"][0]
+            if group_noun is not None:
+                self.send(f"How many {p.plural(group_noun)} of {name} do you have?")
             else:
-                self.send(f"How many {p.plural(item.name)} do you have?")
-            self.set_state("interpret_count", {"current_item": item.name})
+                self.send(f"How many {p.plural(name)} do you have?")
+            self.set_state("interpret_count", data)
         else:
-            self.finish()
+            self.finish(data)
 
     @state
     def interpret_count(self, message, data):
-        current_item = data["current_item"]
+        data = self.upgrade_data(data)
         count_match = number_regex.search(message)
         if count_match:
-            quantity = float(count_match.group(0))
-            larder = Larder()
-            larder.update_quantity(current_item, quantity)
-            self.ask_next_question()
+            name, _ = data["queue"].pop(0)
+            # Decimal, as DynamoDB doesn't accept floats in the conversation data.
+            data["counts"][name] = Decimal(str(float(count_match.group(0))))
+            self.ask_next_question(data)
         else:
             self.send(
                 "Sorry, didn't catch that. I don't understand number words, yet, so can you use digits?"
             )
 
-    def finish(self):
+    def on_expired(self, state, data):
+        # Keep whatever was counted before the recipient stopped replying.
+        if data.get("counts"):
+            self.save_counts(data["counts"])
+
+    def save_counts(self, counts):
+        """
+        Writes the counts to the larder together with the conversation's own changes,
+        so a replayed turn can't apply them twice. Counts for items deleted during the
+        check are dropped. Any that won't fit in the turn's transaction, alongside the
+        conversation itself, are written straight away.
+        """
+        larder = Larder()
+        larder.invalidate_cache()  # Deletions made elsewhere must be seen
+        existing = {item.name for item in larder.get_contents(attributes=())}
+        dropped = [name for name in counts if name not in existing]
+        if dropped:
+            logger.warning(f"Not saving counts for deleted items {dropped}")
+        counts = {name: count for name, count in counts.items() if name in existing}
+
+        names = list(counts)
+        in_turn = names[: MAX_TRANSACTION_ITEMS - 1]
+        overflow = names[MAX_TRANSACTION_ITEMS - 1 :]
+        if overflow:
+            larder.update_quantities({name: counts[name] for name in overflow})
+        for transact_item in larder.quantity_updates(
+            {name: counts[name] for name in in_turn}
+        ):
+            self.conversation_tracker.add_write(transact_item)
+        # Nothing else reads the larder before the turn is committed.
+        larder.invalidate_cache()
+
+    def finish(self, data):
+        self.save_counts(data["counts"])
         self.send(
             choice(
                 [
@@ -117,8 +171,3 @@ class StockCheck(Conversation):
             )
         )
         self.end_conversation()
-        self.reschedule()
-
-    def reschedule(self, mean_hours=24):
-        delay = random.randint(int(mean_hours * 0.5), int(mean_hours * 1.5))
-        self.scheduler.do_with_delay(self.ACTION_KEY, timedelta(hours=delay))
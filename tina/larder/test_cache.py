@@ -0,0 +1,34 @@
+import unittest
+from .cache import LarderCache
+from ..utils.testing import FakeClock
+
+
+class TestLarderCache(unittest.TestCase):
+    def test_value_cached_within_ttl(self):
+        clock = FakeClock()
+        cache = LarderCache(ttl_seconds=100, clock=clock)
+        cache.put("key", ["value"], cache.generation())
+        clock.now = 50
+        self.assertEqual(["value"], cache.get("key"))
+
+    def test_expired_value_dropped(self):
+        clock = FakeClock()
+        cache = LarderCache(ttl_seconds=100, clock=clock)
+        cache.put("key", ["value"], cache.generation())
+        clock.now = 100
+        self.assertIsNone(cache.get("key"))
+
+    def test_invalidate_clears_everything(self):
+        cache = LarderCache(clock=FakeClock())
+        cache.put("a", 1, cache.generation())
+        cache.put("b", 2, cache.generation())
+        cache.invalidate()
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_read_overtaken_by_write_not_stored(self):
+        cache = LarderCache(clock=FakeClock())
+        generation = cache.generation()
+        cache.invalidate()
+        cache.put("key", ["stale"], generation)
+        self.assertIsNone(cache.get("key"))
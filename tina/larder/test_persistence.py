@@ -4,10 +4,13 @@ from decimal import Decimal
 from typing import Any, Dict, List
 import unittest
 from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
 
 from tina.larder.objects import LarderItem, ShopOption
-from .persistence import Larder
+from .cache import LarderCache
+from .persistence import CHECK_DUE_INDEX, Larder
 from ..utils import parse_epoch_time, to_epoch_time
+from ..utils.dynamo_testing import matches
 
 
 class TestReads(unittest.TestCase):
@@ -212,7 +215,64 @@ class TestReads(unittest.TestCase):
             ],
         ).as_session()
         larder = Larder(session=session)
-        self.assertRaises(KeyError, larder.get_contents)
+        self.assertRaises(KeyError, lambda: list(larder.get_contents()))
+
+    def test_get_contents_follows_pages(self):
+        table = MockTable(
+            self,
+            [
+                {"ItemName": f"item{i}", "LastChecked": 1658062168, "Quantity": i}
+                for i in range(5)
+            ],
+            page_size=2,
+        )
+        larder = Larder(session=table.as_session())
+        self.assertCountEqual(
+            [f"item{i}" for i in range(5)],
+            [item.name for item in larder.get_contents()],
+        )
+        self.assertEqual(3, len(table.scans))
+
+    def test_get_contents_in_parallel_segments(self):
+        table = MockTable(
+            self,
+            [
+                {"ItemName": f"item{i}", "LastChecked": 1658062168, "Quantity": i}
+                for i in range(7)
+            ],
+            page_size=2,
+        )
+        larder = Larder(session=table.as_session())
+        self.assertCountEqual(
+            [f"item{i}" for i in range(7)],
+            [item.name for item in larder.get_contents(segments=3)],
+        )
+        self.assertEqual(
+            {0, 1, 2}, {scan["Segment"] for scan in table.scans if "Segment" in scan}
+        )
+
+    def test_get_contents_with_projection(self):
+        table = MockTable(
+            self,
+            [
+                {
+                    "ItemName": "tuna",
+                    "LastChecked": 1658062168,
+                    "Quantity": Decimal(2),
+                    "GroupNoun": "tin",
+                    "BuyVia": "fakemart",
+                    "OnlineShopOptions": [
+                        {"ProductId": "super-saver-tuna", "Quantity": Decimal(1)}
+                    ],
+                }
+            ],
+        )
+        larder = Larder(session=table.as_session())
+        (tuna,) = larder.get_contents(["GroupNoun"])
+        self.assertEqual("tin", tuna.groupNoun)
+        self.assertEqual(2, tuna.quantity)
+        self.assertIsNone(tuna.buyVia)
+        self.assertIsNone(tuna.onlineShopOptions)
 
 
 class TestWrites(unittest.TestCase):
@@ -255,6 +315,9 @@ class TestWrites(unittest.TestCase):
                     "LastChecked": 1658062168,
                     "Quantity": Decimal(2),
                     "CheckFrequencyInDays": 7,
+                    "CheckFrequencySeconds": 604800,
+                    "CheckShard": "tracked",
+                    "NextCheckDue": 1658666968,
                     "BuyVia": "fakemart",
                     "MinAmount": Decimal(2),
                     "TargetAmount": Decimal(6),
@@ -286,23 +349,90 @@ class TestWrites(unittest.TestCase):
             self,
             [{"ItemName": "banana", "LastChecked": 1658062168, "Quantity": Decimal(3)}],
         )
-        larder = Larder(session=table.as_session())
-        larder.update_quantity("banana", 17)
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        banana = larder.update_quantity("banana", 17)
         self.assertEqual(17, table.contents["banana"]["Quantity"])
+        self.assertEqual(to_epoch_time(NOW), table.contents["banana"]["LastChecked"])
+        self.assertEqual(17, banana.quantity)
+        self.assertEqual(NOW, banana.lastChecked)
+        self.assertEqual(1, table.writes)
+
+    def test_update_quantity_moves_next_check_due(self):
+        table = MockTable(self, [tracked_entry("rice", 40, 30)])
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        larder.update_quantity("rice", 2)
+        self.assertEqual(
+            to_epoch_time(NOW + timedelta(days=30)),
+            table.contents["rice"]["NextCheckDue"],
+        )
+        self.assertEqual([], larder.get_items_due_update())
 
+    def test_update_quantity_of_missing_item(self):
+        larder = Larder(session=MockTable(self).as_session())
+        self.assertRaises(KeyError, larder.update_quantity, "unicorn", 1)
 
-class TestOverdueRetrieval(unittest.TestCase):
-    def test_get_overdue_items(self):
-        now = datetime(
-            year=2022,
-            month=7,
-            day=3,
-            hour=18,
-            minute=30,
-            second=00,
-            tzinfo=timezone.utc,
+    def test_update_quantities(self):
+        table = MockTable(
+            self, [tracked_entry("rice", 40, 30), tracked_entry("tea", 10, 7)]
         )
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        larder.update_quantities({"rice": 2, "tea": 0.5})
+        self.assertEqual(Decimal(2), table.contents["rice"]["Quantity"])
+        self.assertEqual(Decimal("0.5"), table.contents["tea"]["Quantity"])
+        self.assertEqual(1, table.writes)
+
+    def test_update_quantities_is_atomic(self):
+        table = MockTable(self, [tracked_entry("rice", 40, 30)])
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        with self.assertRaises(KeyError) as raised:
+            larder.update_quantities({"rice": 2, "unicorn": 1})
+        self.assertEqual(("unicorn",), raised.exception.args)
+        self.assertEqual(Decimal(1), table.contents["rice"]["Quantity"])
+
+    def test_update_quantities_in_chunks(self):
+        table = MockTable(
+            self,
+            [
+                {"ItemName": f"item{i}", "LastChecked": 1658062168, "Quantity": 1}
+                for i in range(150)
+            ],
+        )
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        larder.update_quantities({f"item{i}": 3 for i in range(150)})
+        self.assertEqual(2, table.writes)
+        self.assertTrue(
+            all(entry["Quantity"] == 3 for entry in table.contents.values())
+        )
+
+
+NOW = datetime(
+    year=2022,
+    month=7,
+    day=3,
+    hour=18,
+    minute=30,
+    second=00,
+    tzinfo=timezone.utc,
+)
 
+
+def tracked_entry(name: str, days_since_check: int, frequency_days: int) -> TableEntry:
+    return {
+        "ItemName": name,
+        "LastChecked": to_epoch_time(NOW - timedelta(days=days_since_check)),
+        "Quantity": Decimal(1),
+        "CheckFrequencyInDays": frequency_days,
+        "CheckFrequencySeconds": frequency_days * 86400,
+        "CheckShard": "tracked",
+        "NextCheckDue": to_epoch_time(
+            NOW - timedelta(days=days_since_check - frequency_days)
+        ),
+    }
+
+
+class TestOverdueRetrieval(unittest.TestCase):
+    def test_get_overdue_items(self):
+        now = NOW
         table = MockTable(
             self,
             [
@@ -316,12 +446,16 @@ class TestOverdueRetrieval(unittest.TestCase):
                     "LastChecked": to_epoch_time(now - timedelta(days=2)),
                     "Quantity": Decimal(2),
                     "CheckFrequencyInDays": 7,
+                    "CheckShard": "tracked",
+                    "NextCheckDue": to_epoch_time(now + timedelta(days=5)),
                 },
                 {
                     "ItemName": "due",
                     "LastChecked": to_epoch_time(now - timedelta(days=15)),
                     "Quantity": Decimal(1),
                     "CheckFrequencyInDays": 14,
+                    "CheckShard": "tracked",
+                    "NextCheckDue": to_epoch_time(now - timedelta(days=1)),
                 },
             ],
         )
@@ -338,20 +472,168 @@ class TestOverdueRetrieval(unittest.TestCase):
             ],
             larder.get_items_due_update(),
         )
+        self.assertEqual([CHECK_DUE_INDEX], [q["IndexName"] for q in table.queries])
+        self.assertEqual([], table.scans)
+
+    def test_most_overdue_first(self):
+        table = MockTable(
+            self,
+            [
+                tracked_entry("milk", 3, 2),
+                tracked_entry("rice", 40, 30),
+                tracked_entry("tea", 10, 7),
+            ],
+            page_size=2,
+        )
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        self.assertEqual(
+            ["rice", "tea", "milk"],
+            [item.name for item in larder.get_items_due_update()],
+        )
+
+    def test_limit_stops_reading(self):
+        table = MockTable(
+            self,
+            [
+                tracked_entry("milk", 3, 2),
+                tracked_entry("rice", 40, 30),
+                tracked_entry("tea", 10, 7),
+            ],
+        )
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        self.assertEqual(
+            ["rice"], [item.name for item in larder.get_items_due_update(limit=1)]
+        )
+        self.assertEqual(1, len(table.queries))
+        self.assertEqual(1, table.queries[0]["Limit"])
+
+    def test_backfill_check_due(self):
+        due = tracked_entry("rice", 40, 30)
+        del due["CheckFrequencySeconds"], due["CheckShard"], due["NextCheckDue"]
+        table = MockTable(
+            self,
+            [
+                due,
+                tracked_entry("tea", 10, 7),
+                {"ItemName": "salt", "LastChecked": 1658062168, "Quantity": 1},
+            ],
+        )
+        larder = Larder(clock=lambda: NOW, session=table.as_session())
+        self.assertEqual(["tea"], [item.name for item in larder.get_items_due_update()])
+        self.assertEqual(1, larder.backfill_check_due())
+        self.assertEqual(
+            ["rice", "tea"], [item.name for item in larder.get_items_due_update()]
+        )
+        self.assertNotIn("NextCheckDue", table.contents["salt"])
+
+
+class TestCaching(unittest.TestCase):
+    def setUp(self):
+        self.table = MockTable(
+            self, [tracked_entry("rice", 40, 30), tracked_entry("tea", 10, 7)]
+        )
+        self.cache = LarderCache()
+
+    def make_larder(self) -> Larder:
+        return Larder(
+            clock=lambda: NOW, session=self.table.as_session(), cache=self.cache
+        )
+
+    def test_reads_shared_between_larders(self):
+        self.assertEqual(2, len(self.make_larder().get_items_due_update()))
+        self.assertEqual(2, len(self.make_larder().get_items_due_update()))
+        self.assertEqual(2, len(list(self.make_larder().get_contents())))
+        self.assertEqual(2, len(list(self.make_larder().get_contents())))
+        self.assertEqual(1, len(self.table.queries))
+        self.assertEqual(1, len(self.table.scans))
+
+    def test_partial_read_not_cached(self):
+        next(self.make_larder().get_contents())
+        list(self.make_larder().get_contents())
+        self.assertEqual(2, len(self.table.scans))
+
+    def test_writes_invalidate(self):
+        larder = self.make_larder()
+        larder.get_items_due_update()
+        larder.update_quantity("rice", 3)
+        self.assertEqual(["tea"], [item.name for item in larder.get_items_due_update()])
+
+        self.make_larder().update_quantities({"tea": 1})
+        self.assertEqual([], self.make_larder().get_items_due_update())
+
+    def test_explicit_session_uncached_by_default(self):
+        larder = Larder(clock=lambda: NOW, session=self.table.as_session())
+        larder.get_items_due_update()
+        larder.get_items_due_update()
+        self.assertEqual(2, len(self.table.queries))
 
 
 TableEntry = Dict[str, Any]
 
 
 class MockTable:
-    def __init__(self, test: unittest.TestCase, entries: List[TableEntry] = None):
+    def __init__(
+        self,
+        test: unittest.TestCase,
+        entries: List[TableEntry] = None,
+        page_size: int = 100,
+    ):
         if entries is None:
             entries = []
         self.test = test
         self.contents = MockTable.group_by_item_id(entries)
-
-    def scan(self) -> List[TableEntry]:
-        return {"Items": self.contents.values()}
+        self.page_size = page_size
+        self.scans = []
+        self.queries = []
+        self.writes = 0
+        self.meta = MagicMock()
+        self.meta.client.transact_write_items.side_effect = self.transact_write_items
+
+    def scan(self, **kwargs) -> Dict[str, Any]:
+        self.scans.append(kwargs)
+        names = sorted(self.contents)
+        if "Segment" in kwargs:
+            names = names[kwargs["Segment"] :: kwargs["TotalSegments"]]
+        if "FilterExpression" in kwargs:
+            names = [
+                name
+                for name in names
+                if matches(kwargs["FilterExpression"], self.contents[name])
+            ]
+        return self._page(names, kwargs)
+
+    def query(self, **kwargs) -> Dict[str, Any]:
+        self.queries.append(kwargs)
+        self.test.assertEqual(CHECK_DUE_INDEX, kwargs["IndexName"])
+        names = sorted(
+            (
+                name
+                for name, entry in self.contents.items()
+                if matches(kwargs["KeyConditionExpression"], entry)
+            ),
+            key=lambda name: self.contents[name]["NextCheckDue"],
+        )
+        return self._page(names, kwargs)
+
+    def _page(self, names: List[str], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if "ExclusiveStartKey" in kwargs:
+            names = names[names.index(kwargs["ExclusiveStartKey"]["ItemName"]) + 1 :]
+        page_size = min(self.page_size, kwargs.get("Limit", self.page_size))
+        page = [self.contents[name] for name in names[:page_size]]
+
+        if "ProjectionExpression" in kwargs:
+            attributes = [
+                kwargs["ExpressionAttributeNames"][placeholder]
+                for placeholder in kwargs["ProjectionExpression"].split(", ")
+            ]
+            page = [
+                {k: v for k, v in entry.items() if k in attributes} for entry in page
+            ]
+
+        response = {"Items": page}
+        if len(names) > page_size:
+            response["LastEvaluatedKey"] = {"ItemName": page[-1]["ItemName"]}
+        return response
 
     def get_item(self, Key: Dict[str, Any]) -> Dict[str, TableEntry]:
         self.test.assertCountEqual(Key.keys(), ["ItemName"], msg="Unexpected query key")
@@ -361,6 +643,59 @@ class MockTable:
         self.test.assertIn("ItemName", Item, msg=f"Missing item name on item '{Item}'")
         self.contents[Item["ItemName"]] = Item
 
+    def update_item(self, ReturnValues=None, **update) -> Dict[str, Any]:
+        self.writes += 1
+        if update["Key"]["ItemName"] not in self.contents:
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+            )
+        entry = self._apply_quantity_update(update)
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": entry}
+        return {}
+
+    def transact_write_items(self, TransactItems) -> None:
+        self.writes += 1
+        reasons = [
+            {"Code": "ConditionalCheckFailed"}
+            if item["Update"]["Key"]["ItemName"] not in self.contents
+            else {"Code": "None"}
+            for item in TransactItems
+        ]
+        if any(reason["Code"] != "None" for reason in reasons):
+            raise ClientError(
+                {
+                    "Error": {"Code": "TransactionCanceledException"},
+                    "CancellationReasons": reasons,
+                },
+                "TransactWriteItems",
+            )
+        for item in TransactItems:
+            self.test.assertEqual("Larder", item["Update"]["TableName"])
+            self._apply_quantity_update(item["Update"])
+
+    def _apply_quantity_update(self, update: Dict[str, Any]) -> TableEntry:
+        self.test.assertEqual(
+            "attribute_exists(ItemName)", update["ConditionExpression"]
+        )
+        self.test.assertEqual(
+            "SET Quantity = :quantity, LastChecked = :now, NextCheckDue = :now + if_not_exists(CheckFrequencySeconds, :zero)",
+            update["UpdateExpression"],
+        )
+        values = update["ExpressionAttributeValues"]
+        entry = self.contents[update["Key"]["ItemName"]]
+        entry["Quantity"] = values[":quantity"]
+        entry["LastChecked"] = values[":now"]
+        entry["NextCheckDue"] = values[":now"] + entry.get(
+            "CheckFrequencySeconds", values[":zero"]
+        )
+        return entry
+
+    def batch_writer(self):
+        batch = MagicMock()
+        batch.__enter__.return_value = self
+        return batch
+
     def as_session(self):
         """
         Returns an object that mimics a boto3 Session, so a consumer can call
@@ -0,0 +1,159 @@
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+from ..conversation import ConversationTracker
+from ..conversation.conversation import ConversationTypeRegistry
+from ..conversation.test_conversation import MockConversationsPersistence
+from .cache import LarderCache
+from .persistence import Larder
+from .stock_check import StockCheck, maybe_check_stock
+from .test_persistence import NOW, MockTable, tracked_entry
+
+
+RECIPIENT = "+447700900000"
+
+
+class TestStockCheck(unittest.TestCase):
+    def setUp(self):
+        rice = tracked_entry("rice", 40, 30)
+        rice["GroupNoun"] = "bag"
+        self.table = MockTable(self, [rice, tracked_entry("banana", 10, 7)])
+        registry = ConversationTypeRegistry()
+        registry.register(StockCheck)
+        self.persistence = MockConversationsPersistence()
+        self.tracker = ConversationTracker(
+            self.persistence, registry, inline_recipient=RECIPIENT, clock=lambda: NOW
+        )
+        self.cache = None
+        patcher = patch(
+            "tina.larder.stock_check.Larder",
+            lambda: Larder(
+                clock=lambda: NOW, session=self.table.as_session(), cache=self.cache
+            ),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reply(self, contents: str) -> str:
+        self.tracker.inline_replies.clear()
+        self.tracker.handle_message(RECIPIENT, contents)
+        return " ".join(self.tracker.inline_replies)
+
+    def larder_writes(self):
+        return [write for _, writes in self.persistence.commits for write in writes]
+
+    def test_asks_about_each_due_item_once(self):
+        StockCheck(self.tracker, RECIPIENT).initiate()
+        self.assertIn("How many bags of rice", self.reply("yes"))
+        self.assertIn("How many bananas", self.reply("2 bags"))
+        self.assertNotIn("How many", self.reply("6"))
+        self.assertIsNone(self.persistence.get_current_conversation(RECIPIENT))
+        self.assertEqual(1, len(self.table.queries))
+
+    def test_counts_written_with_conversation_end(self):
+        StockCheck(self.tracker, RECIPIENT).initiate()
+        self.reply("yes")
+        self.reply("2")
+        self.assertEqual([], self.larder_writes())
+        self.reply("6.5")
+
+        self.table.transact_write_items(self.larder_writes())
+        self.assertEqual(Decimal(2), self.table.contents["rice"]["Quantity"])
+        self.assertEqual(Decimal("6.5"), self.table.contents["banana"]["Quantity"])
+        last_conversations, _ = self.persistence.commits[-1]
+        self.assertEqual({RECIPIENT: None}, last_conversations)
+
+    def test_partial_counts_written_on_expiry(self):
+        StockCheck(self.tracker, RECIPIENT).initiate()
+        self.reply("yes")
+        self.reply("2")
+        record = self.persistence.get_current_conversation(RECIPIENT)
+        StockCheck(self.tracker, RECIPIENT).on_expired(record.state, record.data)
+
+        self.table.transact_write_items(self.larder_writes())
+        self.assertEqual(Decimal(2), self.table.contents["rice"]["Quantity"])
+        self.assertEqual(Decimal(1), self.table.contents["banana"]["Quantity"])
+
+    def test_counts_for_deleted_items_dropped(self):
+        StockCheck(self.tracker, RECIPIENT).initiate()
+        self.reply("yes")
+        self.reply("2")
+        del self.table.contents["banana"]
+        self.reply("6")
+
+        self.table.transact_write_items(self.larder_writes())
+        self.assertEqual(Decimal(2), self.table.contents["rice"]["Quantity"])
+        self.assertNotIn("banana", self.table.contents)
+
+    def test_counts_beyond_transaction_limit_written_directly(self):
+        for i in range(120):
+            self.table.contents[f"item{i}"] = {
+                "ItemName": f"item{i}",
+                "LastChecked": 1658062168,
+                "Quantity": Decimal(0),
+            }
+        counts = {f"item{i}": Decimal(i) for i in range(120)}
+        with self.tracker.turn():
+            StockCheck(self.tracker, RECIPIENT).save_counts(counts)
+            StockCheck(self.tracker, RECIPIENT).end_conversation()
+
+        _, turn_writes = self.persistence.commits[-1]
+        self.assertEqual(99, len(turn_writes))
+        self.table.transact_write_items(turn_writes)
+        self.assertTrue(
+            all(self.table.contents[f"item{i}"]["Quantity"] == i for i in range(120))
+        )
+
+    def test_legacy_check_resumed_from_current_item(self):
+        # Written before the queue was kept in the conversation data.
+        self.persistence.set_current_conversation(
+            RECIPIENT, StockCheck.key, "interpret_count", {"current_item": "banana"}
+        )
+        self.assertIn("How many bags of rice", self.reply("3"))
+        self.assertNotIn("How many", self.reply("2"))
+
+        self.table.transact_write_items(self.larder_writes())
+        self.assertEqual(Decimal(3), self.table.contents["banana"]["Quantity"])
+        self.assertEqual(Decimal(2), self.table.contents["rice"]["Quantity"])
+
+    def test_legacy_goahead_rebuilds_queue(self):
+        self.persistence.set_current_conversation(
+            RECIPIENT, StockCheck.key, "get_user_goahead", {}
+        )
+        self.assertIn("How many bags of rice", self.reply("yes"))
+
+    def test_fanned_out_checks_share_cached_due_query(self):
+        self.cache = LarderCache()
+        recipients = ["+447700900001", "+447700900002", "+447700900003"]
+        with patch(
+            "tina.larder.stock_check.get_recipients", return_value=recipients
+        ), patch(
+            "tina.larder.stock_check.ConversationTracker",
+            lambda: ConversationTracker(
+                self.persistence, self.tracker.registry, clock=lambda: NOW
+            ),
+        ), patch(
+            "tina.conversation.conversation.send_sms"
+        ):
+            maybe_check_stock()
+
+        for recipient in recipients:
+            self.assertEqual(
+                "get_user_goahead",
+                self.persistence.get_current_conversation(recipient).state,
+            )
+        # One query to see whether anything is due, and one for all the recipients.
+        self.assertEqual(2, len(self.table.queries))
+
+    def test_cached_contents_not_trusted_for_deletions(self):
+        self.cache = LarderCache()
+        StockCheck(self.tracker, RECIPIENT).initiate()
+        larder = Larder(session=self.table.as_session(), cache=self.cache)
+        list(larder.get_contents(attributes=()))
+        self.reply("yes")
+        self.reply("2")
+        del self.table.contents["banana"]  # By another container
+        self.reply("6")
+
+        self.table.transact_write_items(self.larder_writes())
+        self.assertNotIn("banana", self.table.contents)
@@ -1,2 +1,4 @@
-from .objects import ScheduledAction, ScheduleEntry
+from .objects import ActionOutcome, ActionStatus, ScheduledAction, ScheduleEntry
+from .memory import InMemorySchedulePersistence
+from .recurrence import CronSchedule, FixedInterval, JitteredInterval, Recurrence
 from .scheduler import Scheduler
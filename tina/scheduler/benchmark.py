@@ -0,0 +1,95 @@
+"""
+Benchmarks for the in-memory scheduler backend.
+
+Run with `python -m tina.scheduler.benchmark [entry_count]`.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from .memory import InMemorySchedulePersistence
+from .objects import ScheduleEntry, ScheduledAction
+from .scheduler import Scheduler
+
+
+DEFAULT_ENTRY_COUNT = 100_000
+
+
+def timed(label: str, count: int, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<40} {elapsed * 1000:>10.1f} ms  "
+        f"{elapsed / count * 1_000_000:>8.2f} us/op"
+    )
+    return result
+
+
+def run(entry_count: int, snapshot_path: str = None) -> None:
+    now = datetime.now(timezone.utc)
+    rng = random.Random(0)
+    entries = [
+        ScheduleEntry(
+            now + timedelta(seconds=rng.uniform(-3600, 86400)),
+            ScheduledAction(f"action-{i}"),
+        )
+        for i in range(entry_count)
+    ]
+    due_count = sum(1 for entry in entries if entry.timeUtc <= now)
+
+    persistence = InMemorySchedulePersistence(snapshot_path=snapshot_path)
+    scheduler = Scheduler(persistence, clock=lambda: now)
+    for entry in entries:
+        scheduler.register_action(entry.action.actionKey, lambda: None)
+
+    timed(
+        f"put {entry_count} entries (one at a time)",
+        entry_count,
+        lambda: [persistence.put_schedule_entry(entry) for entry in entries],
+    )
+    timed(
+        "next_due_time x1000",
+        1000,
+        lambda: [persistence.next_due_time(now) for _ in range(1000)],
+    )
+    timed(
+        "get_entries_for_action x1000",
+        1000,
+        lambda: [
+            persistence.get_entries_for_action(f"action-{i}") for i in range(1000)
+        ],
+    )
+    timed(
+        f"get_due_entries ({due_count} due)",
+        max(due_count, 1),
+        lambda: persistence.get_due_entries(now),
+    )
+    timed(
+        f"execute_all ({due_count} due)",
+        max(due_count, 1),
+        scheduler.execute_all,
+    )
+    timed(
+        f"delete {entry_count - due_count} remaining",
+        max(entry_count - due_count, 1),
+        lambda: persistence.delete_schedule_entries(
+            [entry for entry in entries if entry.timeUtc > now]
+        ),
+    )
+
+
+def main() -> None:
+    entry_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ENTRY_COUNT
+    print("In-memory only:")
+    run(entry_count)
+    print()
+    print("With SQLite snapshot:")
+    with tempfile.TemporaryDirectory() as directory:
+        run(entry_count, os.path.join(directory, "schedule.db"))
+
+
+if __name__ == "__main__":
+    main()
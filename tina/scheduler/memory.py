@@ -0,0 +1,228 @@
+import heapq
+import itertools
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .objects import ScheduleEntry, ScheduledAction
+from .recurrence import Recurrence
+
+
+EntryKey = Tuple[datetime, str]
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class InMemorySchedulePersistence:
+    """
+    A drop-in replacement for SchedulePersistence for long-running deployments.
+    Entries are held in a binary heap ordered by due time, so finding the next due
+    entry is O(1) and scheduling or firing an entry is O(log n). Deleted entries are
+    removed from the heap lazily, when they reach the top.
+
+    If snapshot_path is given, every change is also written through to a local SQLite
+    database, and the schedule is reloaded from it on construction. Leases are not
+    persisted; after a crash any leased entries simply become claimable again.
+    """
+
+    def __init__(self, snapshot_path: str = None):
+        self._lock = threading.RLock()
+        self._heap: List[Tuple[datetime, int, EntryKey]] = []
+        self._sequence = itertools.count()
+        self._entries: Dict[EntryKey, ScheduleEntry] = {}
+        self._by_action: Dict[str, Set[datetime]] = defaultdict(set)
+        self._leases: Dict[EntryKey, Tuple[datetime, str]] = {}  # Expiry, owner
+
+        self._snapshot = None
+        if snapshot_path is not None:
+            self._snapshot = SqliteSnapshot(snapshot_path)
+            for entry in self._snapshot.load():
+                self._add(entry)
+
+    def get_due_entries(self, current_time: datetime = None) -> List[ScheduleEntry]:
+        with self._lock:
+            due, _ = self._pop_until(lambda key: key[0] > current_time)
+            return [
+                entry
+                for entry in due
+                if not self._is_leased(self._key(entry), current_time)
+            ]
+
+    def get_entries_for_action(self, action_key: str) -> List[ScheduleEntry]:
+        with self._lock:
+            return [
+                self._entries[(time, action_key)]
+                for time in sorted(self._by_action.get(action_key, ()))
+            ]
+
+    def get_scheduled_action_keys(self, action_keys: Iterable[str]) -> Set[str]:
+        with self._lock:
+            return {key for key in action_keys if key in self._by_action}
+
+    def next_due_time(self, current_time: datetime) -> Optional[datetime]:
+        """
+        Returns the earliest time at which an entry could next be claimed: either the
+        due time of the first unleased entry, or the expiry of an outstanding lease.
+        """
+        with self._lock:
+            leased, first_unleased = self._pop_until(
+                lambda key: not self._is_leased(key, current_time)
+            )
+            candidates = [self._leases[self._key(entry)][0] for entry in leased]
+            if first_unleased is not None:
+                candidates.append(first_unleased[0])
+            return min(candidates, default=None)
+
+    def put_schedule_entry(self, entry: ScheduleEntry) -> None:
+        self.put_schedule_entries([entry])
+
+    def put_schedule_entries(self, entries: List[ScheduleEntry]) -> None:
+        with self._lock:
+            for entry in entries:
+                self._add(entry)
+            if self._snapshot is not None:
+                self._snapshot.save(entries)
+
+    def delete_schedule_entry(self, entry: ScheduleEntry) -> None:
+        self.delete_schedule_entries([entry])
+
+    def delete_schedule_entries(self, entries: List[ScheduleEntry]) -> None:
+        with self._lock:
+            for entry in entries:
+                key = self._key(entry)
+                if self._entries.pop(key, None) is not None:
+                    self._by_action[key[1]].discard(key[0])
+                    if not self._by_action[key[1]]:
+                        del self._by_action[key[1]]
+                self._leases.pop(key, None)
+            if self._snapshot is not None:
+                self._snapshot.remove(entries)
+            # Compact once dead heap slots outnumber live entries.
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [h for h in self._heap if h[2] in self._entries]
+                heapq.heapify(self._heap)
+
+    def reschedule_entry(
+        self, entry: ScheduleEntry, next_entry: ScheduleEntry, owner: str
+    ) -> bool:
+        with self._lock:
+            lease = self._leases.get(self._key(entry))
+            if lease is None or lease[1] != owner:
+                return False
+            self.delete_schedule_entry(entry)
+            self.put_schedule_entry(next_entry)
+            return True
+
+    def claim_entry(
+        self,
+        entry: ScheduleEntry,
+        owner: str,
+        current_time: datetime,
+        lease_expiry: datetime,
+    ) -> bool:
+        with self._lock:
+            key = self._key(entry)
+            if key not in self._entries or self._is_leased(key, current_time):
+                return False
+            self._leases[key] = (lease_expiry, owner)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, entry: ScheduleEntry) -> None:
+        key = self._key(entry)
+        if key not in self._entries:
+            heapq.heappush(self._heap, (key[0], next(self._sequence), key))
+            self._by_action[key[1]].add(key[0])
+        self._entries[key] = entry
+
+    def _pop_until(
+        self, stop: Callable[[EntryKey], bool]
+    ) -> Tuple[List[ScheduleEntry], Optional[EntryKey]]:
+        """
+        Returns live entries from the top of the heap, in due order, up to and
+        excluding the first whose key satisfies stop, along with that key (or None if
+        no entry satisfied it). The heap is left unchanged apart from discarding
+        deleted entries.
+        """
+        popped = []
+        stopped_at = None
+        while self._heap:
+            _, _, key = self._heap[0]
+            if key not in self._entries:
+                heapq.heappop(self._heap)
+            elif stop(key):
+                stopped_at = key
+                break
+            else:
+                popped.append(heapq.heappop(self._heap))
+        for item in popped:
+            heapq.heappush(self._heap, item)
+        return [self._entries[key] for _, _, key in popped], stopped_at
+
+    def _is_leased(self, key: EntryKey, current_time: datetime) -> bool:
+        lease = self._leases.get(key)
+        return lease is not None and lease[0] > current_time
+
+    @staticmethod
+    def _key(entry: ScheduleEntry) -> EntryKey:
+        return entry.timeUtc, entry.action.actionKey
+
+
+class SqliteSnapshot:
+    """
+    Write-through store of schedule entries in a local SQLite database.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS schedule ("
+            "scheduled_time INTEGER NOT NULL, action_key TEXT NOT NULL, "
+            "recurrence TEXT, PRIMARY KEY (scheduled_time, action_key))"
+        )
+        self.connection.commit()
+
+    def load(self) -> Iterable[ScheduleEntry]:
+        rows = self.connection.execute(
+            "SELECT scheduled_time, action_key, recurrence FROM schedule"
+        ).fetchall()
+        return [
+            ScheduleEntry(
+                timeUtc=EPOCH + time * MICROSECOND,
+                action=ScheduledAction(action_key),
+                recurrence=Recurrence.parse(recurrence) if recurrence else None,
+            )
+            for time, action_key, recurrence in rows
+        ]
+
+    def save(self, entries: List[ScheduleEntry]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO schedule VALUES (?, ?, ?)",
+                [
+                    self._row(entry)
+                    + (entry.recurrence.to_spec() if entry.recurrence else None,)
+                    for entry in entries
+                ],
+            )
+
+    def remove(self, entries: List[ScheduleEntry]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM schedule WHERE scheduled_time = ? AND action_key = ?",
+                map(self._row, entries),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @staticmethod
+    def _row(entry: ScheduleEntry) -> Tuple[int, str]:
+        # Stored as integer microseconds so entries round-trip exactly.
+        return (entry.timeUtc - EPOCH) // MICROSECOND, entry.action.actionKey
@@ -1,5 +1,8 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
+from .recurrence import Recurrence
 
 
 @dataclass
@@ -11,3 +14,18 @@ class ScheduledAction:
 class ScheduleEntry:
     timeUtc: datetime
     action: ScheduledAction
+    recurrence: Optional[Recurrence] = None  # If set, rescheduled after each firing
+
+
+class ActionStatus(Enum):
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+
+
+@dataclass
+class ActionOutcome:
+    entry: ScheduleEntry
+    status: ActionStatus
+    duration: timedelta
+    error: Optional[BaseException] = None
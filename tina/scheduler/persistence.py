@@ -1,53 +1,231 @@
 from datetime import datetime, timezone
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Set
 from boto3 import Session
 from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
+from ..aws import get_resource
 from .objects import ScheduleEntry, ScheduledAction
-from ..utils import to_epoch_time, parse_epoch_time
+from .recurrence import Recurrence
+from ..utils import to_epoch_time, parse_epoch_time, paginate
 
 
 SCHEDULE_TABLE = "TinaSchedule"
 
+# Global secondary index over pending entries, partitioned on the constant DueShard
+# attribute and sorted on ScheduledTime, so "what is due before T" is a range query.
+# Projects at least ActionKey, LeaseExpiry and Recurrence, as get_due_entries filters
+# on the lease and returns whole entries.
+DUE_INDEX = "DueIndex"
+DUE_SHARD = "pending"
+
+# Global secondary index partitioned on ActionKey and sorted on ScheduledTime.
+# Projects at least DueShard and Recurrence, which migrate_legacy_entries filters on
+# and get_entries_for_action returns.
+ACTION_INDEX = "ActionKeyIndex"
+
 
 class SchedulePersistence:
-    def __init__(self):
-        self.session = Session().resource("dynamodb")
+    def __init__(self, session: Session = None):
+        if session is None:
+            self.session = get_resource("dynamodb")
+        else:
+            self.session = session.resource("dynamodb")
         self.table = self.session.Table(SCHEDULE_TABLE)
 
     def get_due_entries(self, current_time: datetime = None) -> List[ScheduleEntry]:
-        results = self.table.scan(
-            FilterExpression=Key("ScheduledTime").lte(to_epoch_time(current_time))
-        )["Items"]
+        results = paginate(
+            self.table.query,
+            IndexName=DUE_INDEX,
+            KeyConditionExpression=Key("DueShard").eq(DUE_SHARD)
+            & Key("ScheduledTime").lte(to_epoch_time(current_time)),
+            FilterExpression=self._unleased_at(current_time),
+        )
         return list(map(self._deserialize_entry, results))
 
     def get_entries_for_action(self, action_key: str) -> List[ScheduleEntry]:
-        results = self.table.scan(FilterExpression=Attr("ActionKey").eq(action_key))[
-            "Items"
-        ]
+        results = paginate(
+            self.table.query,
+            IndexName=ACTION_INDEX,
+            KeyConditionExpression=Key("ActionKey").eq(action_key),
+        )
         return list(map(self._deserialize_entry, results))
 
+    def get_scheduled_action_keys(self, action_keys: Iterable[str]) -> Set[str]:
+        """
+        Returns which of the given action keys have at least one entry, with a
+        single-item ActionKeyIndex query per key, so the cost doesn't grow with the
+        number of entries.
+        """
+        return {
+            action_key
+            for action_key in set(action_keys)
+            if self.table.query(
+                IndexName=ACTION_INDEX,
+                KeyConditionExpression=Key("ActionKey").eq(action_key),
+                ProjectionExpression="ActionKey",
+                Limit=1,
+            )["Items"]
+        }
+
     def put_schedule_entry(self, entry: ScheduleEntry) -> None:
         self.table.put_item(Item=self._serialize_entry(entry))
 
+    def put_schedule_entries(self, entries: List[ScheduleEntry]) -> None:
+        with self.table.batch_writer() as batch:
+            for entry in entries:
+                batch.put_item(Item=self._serialize_entry(entry))
+
     def delete_schedule_entry(self, entry: ScheduleEntry) -> None:
-        self.table.delete_item(
-            Key={
-                "ScheduledTime": to_epoch_time(entry.timeUtc),
-                "ActionKey": entry.action.actionKey,
-            }
+        self.table.delete_item(Key=self._key(entry))
+
+    def delete_schedule_entries(self, entries: List[ScheduleEntry]) -> None:
+        with self.table.batch_writer() as batch:
+            for entry in entries:
+                batch.delete_item(Key=self._key(entry))
+
+    def reschedule_entry(
+        self, entry: ScheduleEntry, next_entry: ScheduleEntry, owner: str
+    ) -> bool:
+        """
+        Moves a fired recurring entry to its next occurrence in one transaction, so
+        there is never a moment when the action isn't scheduled. The move only happens
+        if the given owner still holds the lease on the entry; returns whether it did.
+        """
+        try:
+            self.table.meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Delete": {
+                            "TableName": SCHEDULE_TABLE,
+                            "Key": self._key(entry),
+                            "ConditionExpression": "LeaseOwner = :owner",
+                            "ExpressionAttributeValues": {":owner": owner},
+                        }
+                    },
+                    {
+                        "Put": {
+                            "TableName": SCHEDULE_TABLE,
+                            "Item": self._serialize_entry(next_entry),
+                        }
+                    },
+                ]
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "TransactionCanceledException":
+                return False
+            raise e
+
+    def claim_entry(
+        self,
+        entry: ScheduleEntry,
+        owner: str,
+        current_time: datetime,
+        lease_expiry: datetime,
+    ) -> bool:
+        """
+        Atomically takes a lease on the entry for the given owner, unless another
+        owner holds an unexpired lease on it. Returns whether the claim succeeded.
+        """
+        try:
+            self.table.update_item(
+                Key=self._key(entry),
+                UpdateExpression="SET LeaseOwner = :owner, LeaseExpiry = :expiry",
+                ConditionExpression=Attr("ActionKey").exists()
+                & self._unleased_at(current_time),
+                ExpressionAttributeValues={
+                    ":owner": owner,
+                    ":expiry": to_epoch_time(lease_expiry),
+                },
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise e
+
+    def migrate_legacy_entries(
+        self,
+        action_keys: Iterable[str] = None,
+        recurrences: Dict[str, Optional[Recurrence]] = None,
+    ) -> int:
+        """
+        Rewrites entries created before the indexed layout, which lack the DueShard
+        attribute and so are invisible to get_due_entries. If action_keys are given,
+        only their entries are checked, with a query each; otherwise the whole table
+        is scanned. For actions with a recurrence in recurrences, only the earliest
+        legacy entry is kept, given that recurrence if it has none, and the rest are
+        deleted. Returns the number of legacy entries migrated or deleted.
+        """
+        if recurrences is None:
+            recurrences = {}
+        legacy = Attr("DueShard").not_exists()
+        if action_keys is None:
+            legacy_items = list(paginate(self.table.scan, FilterExpression=legacy))
+        else:
+            legacy_items = [
+                item
+                for action_key in action_keys
+                for item in paginate(
+                    self.table.query,
+                    IndexName=ACTION_INDEX,
+                    KeyConditionExpression=Key("ActionKey").eq(action_key),
+                    FilterExpression=legacy,
+                )
+            ]
+        entries = sorted(
+            (self._deserialize_entry(item) for item in legacy_items),
+            key=lambda entry: entry.timeUtc,
         )
+        recurring = set()
+        with self.table.batch_writer() as batch:
+            for entry in entries:
+                action_key = entry.action.actionKey
+                recurrence = recurrences.get(action_key)
+                if recurrence is not None:
+                    if action_key in recurring:
+                        # The earliest entry now reschedules itself, so the pending
+                        # runs queued up behind it would only duplicate it.
+                        batch.delete_item(Key=self._key(entry))
+                        continue
+                    recurring.add(action_key)
+                    if entry.recurrence is None:
+                        entry.recurrence = recurrence
+                batch.put_item(Item=self._serialize_entry(entry))
+        return len(entries)
 
     @staticmethod
-    def _serialize_entry(entry: ScheduleEntry) -> Dict[str, any]:
+    def _unleased_at(current_time: datetime):
+        return Attr("LeaseExpiry").not_exists() | Attr("LeaseExpiry").lte(
+            to_epoch_time(current_time)
+        )
+
+    @staticmethod
+    def _key(entry: ScheduleEntry) -> Dict[str, any]:
         return {
             "ScheduledTime": to_epoch_time(entry.timeUtc),
             "ActionKey": entry.action.actionKey,
         }
 
+    @staticmethod
+    def _serialize_entry(entry: ScheduleEntry) -> Dict[str, any]:
+        item = {
+            "ScheduledTime": to_epoch_time(entry.timeUtc),
+            "ActionKey": entry.action.actionKey,
+            "DueShard": DUE_SHARD,
+        }
+        if entry.recurrence is not None:
+            item["Recurrence"] = entry.recurrence.to_spec()
+        return item
+
     @staticmethod
     def _deserialize_entry(entry_item: Dict[str, any]) -> ScheduleEntry:
+        recurrence = None
+        if "Recurrence" in entry_item:
+            recurrence = Recurrence.parse(entry_item["Recurrence"])
         return ScheduleEntry(
             timeUtc=parse_epoch_time(entry_item["ScheduledTime"]),
             action=ScheduledAction(actionKey=entry_item["ActionKey"]),
+            recurrence=recurrence,
         )
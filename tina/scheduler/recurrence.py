@@ -0,0 +1,146 @@
+from __future__ import annotations
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import FrozenSet, Tuple
+
+
+class Recurrence:
+    """
+    Describes how a recurring schedule entry works out its next occurrence. Each
+    recurrence serializes to a short spec string, e.g. "interval 3600",
+    "jitter 43200 129600" or "cron 0 9 * * 1-5", for storage alongside the entry.
+    """
+
+    def next_after(self, time: datetime) -> datetime:
+        raise NotImplementedError()
+
+    def to_spec(self) -> str:
+        raise NotImplementedError()
+
+    @staticmethod
+    def parse(spec: str) -> Recurrence:
+        kind, _, args = spec.partition(" ")
+        if kind == "interval":
+            return FixedInterval(timedelta(seconds=int(args)))
+        elif kind == "jitter":
+            minimum, maximum = args.split()
+            return JitteredInterval(
+                timedelta(seconds=int(minimum)), timedelta(seconds=int(maximum))
+            )
+        elif kind == "cron":
+            return CronSchedule(args)
+        raise ValueError(f"Unrecognised recurrence spec '{spec}'")
+
+
+@dataclass(frozen=True)
+class FixedInterval(Recurrence):
+    interval: timedelta
+
+    def next_after(self, time: datetime) -> datetime:
+        return time + self.interval
+
+    def to_spec(self) -> str:
+        return f"interval {int(self.interval.total_seconds())}"
+
+
+@dataclass(frozen=True)
+class JitteredInterval(Recurrence):
+    """
+    Recurs after a random delay between minimum and maximum, to whole-second precision.
+    """
+
+    minimum: timedelta
+    maximum: timedelta
+
+    def next_after(self, time: datetime) -> datetime:
+        seconds = random.randint(
+            int(self.minimum.total_seconds()), int(self.maximum.total_seconds())
+        )
+        return time + timedelta(seconds=seconds)
+
+    def to_spec(self) -> str:
+        return (
+            f"jitter {int(self.minimum.total_seconds())} "
+            f"{int(self.maximum.total_seconds())}"
+        )
+
+
+# (minimum, maximum) values for each of the five cron fields.
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+# Bounds the search for the next firing; every valid expression fires within this.
+CRON_SEARCH_DAYS = 366 * 5
+
+
+@dataclass(frozen=True)
+class CronSchedule(Recurrence):
+    """
+    A standard five-field cron expression (minute, hour, day of month, month, day of
+    week) evaluated in UTC. Fields support '*', single values, ranges 'a-b', lists
+    'a,b' and steps '*/n' or 'a-b/n'. Day of week runs from 0 (Sunday) to 7 (Sunday).
+    As in cron, if both day fields are restricted, a day matching either will do.
+    """
+
+    expression: str
+    _fields: Tuple[FrozenSet[int], ...] = field(init=False, repr=False, compare=False)
+    _either_day: bool = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        parts = self.expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression '{self.expression}' needs 5 fields")
+        fields = tuple(
+            self._parse_field(part, low, high)
+            for part, (low, high) in zip(parts, CRON_FIELD_RANGES)
+        )
+        if 7 in fields[4]:
+            fields = fields[:4] + (fields[4] | {0},)
+        object.__setattr__(self, "_fields", fields)
+        object.__setattr__(self, "_either_day", parts[2] != "*" and parts[4] != "*")
+
+    def next_after(self, time: datetime) -> datetime:
+        minutes, hours, _, _, _ = self._fields
+        start = time.astimezone(timezone.utc).replace(
+            second=0, microsecond=0
+        ) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for offset in range(CRON_SEARCH_DAYS):
+            candidate_day = day + timedelta(days=offset)
+            if not self._day_matches(candidate_day):
+                continue
+            for hour in sorted(hours):
+                for minute in sorted(minutes):
+                    candidate = candidate_day.replace(hour=hour, minute=minute)
+                    if candidate >= start:
+                        return candidate
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+    def to_spec(self) -> str:
+        return f"cron {self.expression}"
+
+    def _day_matches(self, day: datetime) -> bool:
+        _, _, days_of_month, months, days_of_week = self._fields
+        if day.month not in months:
+            return False
+        dom_match = day.day in days_of_month
+        dow_match = (day.weekday() + 1) % 7 in days_of_week
+        if self._either_day:
+            return dom_match or dow_match
+        return dom_match and dow_match
+
+    @staticmethod
+    def _parse_field(part: str, low: int, high: int) -> FrozenSet[int]:
+        values = set()
+        for item in part.split(","):
+            range_part, _, step = item.partition("/")
+            if range_part == "*":
+                start, end = low, high
+            elif "-" in range_part:
+                start, end = map(int, range_part.split("-"))
+            else:
+                start = end = int(range_part)
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron field '{part}' is out of range")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return frozenset(values)
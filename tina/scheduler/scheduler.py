@@ -1,20 +1,30 @@
 import logging
-from typing import Callable, List
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
 from .persistence import SchedulePersistence
-from .objects import ScheduleEntry, ScheduledAction
+from .objects import ActionOutcome, ActionStatus, ScheduleEntry, ScheduledAction
+from .recurrence import Recurrence
 from datetime import datetime, timezone, timedelta
 
 
 logger = logging.getLogger(__name__)
 
+# How often to re-check deadlines while actions are queued but not yet started.
+DEADLINE_POLL_SECONDS = 0.1
+
 
 class Scheduler:
     def __init__(
         self,
         persistence: SchedulePersistence = None,
         clock: Callable[[], datetime] = None,
+        lease_duration: timedelta = timedelta(minutes=15),
+        owner_id: str = None,
     ):
-        if not persistence:
+        if persistence is None:
             persistence = SchedulePersistence()
         self.persistence = persistence
 
@@ -22,40 +32,244 @@ class Scheduler:
             clock = lambda: datetime.now(timezone.utc)
         self.clock = clock
 
+        # Entries are leased to this scheduler before their actions run, so that
+        # overlapping check-ins never execute the same entry twice.
+        if not owner_id:
+            owner_id = str(uuid.uuid4())
+        self.owner_id = owner_id
+        self.lease_duration = lease_duration
+
         self.callback_map = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
 
     def execute_all(self) -> int:
-        tasks = self.get_overdue_tasks()
+        tasks = self.claim_overdue_tasks()
         if tasks:
             logger.info(f"Executing due tasks: {tasks}")
         else:
             logger.info("No tasks due")
         for task in tasks:
             self._invoke_action(task.action.actionKey)
-            self.persistence.delete_schedule_entry(task)
+            if task.recurrence is None:
+                self.persistence.delete_schedule_entry(task)
+            else:
+                self._reschedule(task)
         return len(tasks)
 
+    def execute_all_parallel(
+        self,
+        max_workers: int = 4,
+        action_timeout: timedelta = timedelta(seconds=60),
+    ) -> List[ActionOutcome]:
+        """
+        Runs all due actions on a pool of at most max_workers threads. An action that
+        runs for longer than action_timeout is reported as timed out and its entry is
+        kept, so it will be retried on the next check-in. Entries whose actions
+        succeeded are deleted in a single batch, or moved to their next occurrence if
+        they recur.
+        """
+        tasks = self.claim_overdue_tasks()
+        if not tasks:
+            logger.info("No tasks due")
+            return []
+        logger.info(f"Executing due tasks in parallel: {tasks}")
+
+        start_times: Dict[int, float] = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures: Dict[Future, int] = {
+            executor.submit(self._run_timed, idx, task, start_times): idx
+            for idx, task in enumerate(tasks)
+        }
+
+        timeout = action_timeout.total_seconds()
+        outcomes: Dict[int, ActionOutcome] = {}
+        pending = set(futures)
+        while pending:
+            deadlines = [
+                start_times[futures[f]] + timeout
+                for f in pending
+                if futures[f] in start_times
+            ]
+            wait_for = DEADLINE_POLL_SECONDS
+            if deadlines:
+                wait_for = min(wait_for, max(0, min(deadlines) - time.monotonic()))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                idx = futures[future]
+                duration = timedelta(seconds=time.monotonic() - start_times[idx])
+                error = future.exception()
+                if error is None:
+                    outcome = ActionOutcome(
+                        tasks[idx], ActionStatus.SUCCEEDED, duration
+                    )
+                else:
+                    logger.error(
+                        "Action '%s' failed",
+                        tasks[idx].action.actionKey,
+                        exc_info=error,
+                    )
+                    outcome = ActionOutcome(
+                        tasks[idx], ActionStatus.FAILED, duration, error
+                    )
+                outcomes[idx] = outcome
+
+            now = time.monotonic()
+            for future in list(pending):
+                idx = futures[future]
+                if idx in start_times and now - start_times[idx] >= timeout:
+                    logger.error(
+                        "Action '%s' timed out after %s",
+                        tasks[idx].action.actionKey,
+                        action_timeout,
+                    )
+                    outcomes[idx] = ActionOutcome(
+                        tasks[idx], ActionStatus.TIMED_OUT, action_timeout
+                    )
+                    pending.remove(future)
+
+        # Don't block on timed-out actions; they can't be interrupted. (shutdown's
+        # cancel_futures needs Python 3.9, and the Lambda image runs 3.8.)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+        results = [outcomes[idx] for idx in range(len(tasks))]
+        succeeded = [o.entry for o in results if o.status == ActionStatus.SUCCEEDED]
+        finished = [entry for entry in succeeded if entry.recurrence is None]
+        if finished:
+            self.persistence.delete_schedule_entries(finished)
+        for entry in succeeded:
+            if entry.recurrence is not None:
+                self._reschedule(entry)
+        return results
+
     def get_overdue_tasks(self) -> List[ScheduleEntry]:
         tasks = self.persistence.get_due_entries(current_time=self.clock())
         return sorted(tasks, key=lambda task: task.timeUtc)
 
-    def do_with_delay(self, action_key: str, delay: timedelta) -> None:
-        self.do_at_time(action_key, self.clock() + delay)
+    def claim_overdue_tasks(self) -> List[ScheduleEntry]:
+        """
+        Returns the overdue tasks that this scheduler managed to lease. Tasks leased by
+        a concurrent scheduler are skipped.
+        """
+        now = self.clock()
+        lease_expiry = now + self.lease_duration
+        claimed = []
+        for task in self.get_overdue_tasks():
+            if self.persistence.claim_entry(task, self.owner_id, now, lease_expiry):
+                claimed.append(task)
+            else:
+                logger.info(f"Task {task} is leased by another scheduler; skipping")
+        return claimed
 
-    def do_at_time(self, action_key: str, due_time: datetime) -> None:
-        entry = ScheduleEntry(timeUtc=due_time, action=ScheduledAction(action_key))
+    def do_with_delay(
+        self, action_key: str, delay: timedelta, recurrence: Recurrence = None
+    ) -> None:
+        self.do_at_time(action_key, self.clock() + delay, recurrence)
+
+    def do_at_time(
+        self, action_key: str, due_time: datetime, recurrence: Recurrence = None
+    ) -> None:
+        entry = ScheduleEntry(
+            timeUtc=due_time, action=ScheduledAction(action_key), recurrence=recurrence
+        )
         logger.info(f"Scheduled {action_key} for {due_time}")
         self.persistence.put_schedule_entry(entry)
+        self._wakeup.set()
 
-    def ensure_scheduled(self, action_key) -> None:
+    def ensure_scheduled(self, action_key, recurrence: Recurrence = None) -> None:
         existing_entries = self.persistence.get_entries_for_action(action_key)
         if not existing_entries:
             logger.warn(f"Action {action_key} was not scheduled; will run immediately")
-            self.do_at_time(action_key, self.clock())
+            self.do_at_time(action_key, self.clock(), recurrence)
+
+    def ensure_all_scheduled(
+        self,
+        action_keys: List[str],
+        recurrences: Dict[str, Optional[Recurrence]] = None,
+    ) -> List[str]:
+        """
+        Bulk version of ensure_scheduled: finds the unscheduled actions with one read
+        and schedules them all with one batch write. Returns the keys it scheduled.
+        """
+        if recurrences is None:
+            recurrences = {}
+        scheduled = self.persistence.get_scheduled_action_keys(action_keys)
+        missing = [key for key in action_keys if key not in scheduled]
+        if missing:
+            logger.warning(
+                f"Actions {missing} were not scheduled; will run immediately"
+            )
+            now = self.clock()
+            self.persistence.put_schedule_entries(
+                [
+                    ScheduleEntry(
+                        timeUtc=now,
+                        action=ScheduledAction(key),
+                        recurrence=recurrences.get(key),
+                    )
+                    for key in missing
+                ]
+            )
+            self._wakeup.set()
+        return missing
+
+    def run_forever(
+        self,
+        max_idle: timedelta = timedelta(minutes=5),
+        max_workers: int = 4,
+        action_timeout: timedelta = timedelta(seconds=60),
+    ) -> None:
+        """
+        Runs due actions as they fall due until stop() is called, for deployments where
+        the scheduler lives in a long-running process rather than a periodic check-in.
+        Between firings the scheduler sleeps until the next entry is due, waking early
+        if a new entry is scheduled. The persistence must support next_due_time, as
+        InMemorySchedulePersistence does.
+        """
+        self._stopping.clear()
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            self.execute_all_parallel(max_workers, action_timeout)
+
+            now = self.clock()
+            next_due = self.persistence.next_due_time(now)
+            sleep_for = max_idle
+            if next_due is not None:
+                sleep_for = min(max_idle, max(timedelta(0), next_due - now))
+            self._wakeup.wait(sleep_for.total_seconds())
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
 
     def register_action(self, action_key: str, callback_fn: Callable[[], None]) -> None:
         self.callback_map[action_key] = callback_fn
 
+    def _reschedule(self, entry: ScheduleEntry) -> None:
+        next_entry = ScheduleEntry(
+            timeUtc=entry.recurrence.next_after(self.clock()),
+            action=entry.action,
+            recurrence=entry.recurrence,
+        )
+        if self.persistence.reschedule_entry(entry, next_entry, self.owner_id):
+            logger.info(
+                f"Rescheduled {entry.action.actionKey} for {next_entry.timeUtc}"
+            )
+        else:
+            logger.warning(
+                f"Lost the lease on {entry}; leaving it for its new owner to reschedule"
+            )
+        self._wakeup.set()
+
+    def _run_timed(
+        self, idx: int, task: ScheduleEntry, start_times: Dict[int, float]
+    ) -> None:
+        start_times[idx] = time.monotonic()
+        self._invoke_action(task.action.actionKey)
+
     def _invoke_action(self, action_key: str) -> None:
         if action_key in self.callback_map:
             self.callback_map[action_key]()
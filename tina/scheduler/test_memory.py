@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from .memory import InMemorySchedulePersistence
+from .objects import ScheduleEntry, ScheduledAction
+from .scheduler import Scheduler
+
+
+TEST_TIME = datetime(
+    year=2022, month=7, day=3, hour=18, minute=30, second=00, tzinfo=timezone.utc
+)
+
+
+def entry(offset: timedelta, action_key: str) -> ScheduleEntry:
+    return ScheduleEntry(TEST_TIME + offset, ScheduledAction(action_key))
+
+
+class TestInMemoryPersistence(unittest.TestCase):
+    def test_due_entries_in_order(self):
+        persistence = InMemorySchedulePersistence()
+        later = entry(timedelta(minutes=-1), "Later")
+        earlier = entry(timedelta(minutes=-5), "Earlier")
+        persistence.put_schedule_entry(later)
+        persistence.put_schedule_entry(entry(timedelta(minutes=1), "Not due"))
+        persistence.put_schedule_entry(earlier)
+        self.assertEqual([earlier, later], persistence.get_due_entries(TEST_TIME))
+        self.assertEqual(3, len(persistence))
+
+    def test_deleted_entries_are_not_due(self):
+        persistence = InMemorySchedulePersistence()
+        due = entry(timedelta(minutes=-1), "Example")
+        persistence.put_schedule_entry(due)
+        persistence.delete_schedule_entry(due)
+        self.assertEqual([], persistence.get_due_entries(TEST_TIME))
+        self.assertEqual([], persistence.get_entries_for_action("Example"))
+        self.assertIsNone(persistence.next_due_time(TEST_TIME))
+
+    def test_entries_for_action(self):
+        persistence = InMemorySchedulePersistence()
+        first = entry(timedelta(days=1), "Wanted")
+        second = entry(timedelta(days=2), "Wanted")
+        persistence.put_schedule_entry(second)
+        persistence.put_schedule_entry(first)
+        persistence.put_schedule_entry(entry(timedelta(days=1), "Unwanted"))
+        self.assertEqual([first, second], persistence.get_entries_for_action("Wanted"))
+
+    def test_leased_entries_skipped_until_expiry(self):
+        persistence = InMemorySchedulePersistence()
+        leased = entry(timedelta(minutes=-5), "Leased")
+        free = entry(timedelta(minutes=10), "Free")
+        persistence.put_schedule_entry(leased)
+        persistence.put_schedule_entry(free)
+        lease_expiry = TEST_TIME + timedelta(minutes=3)
+        self.assertTrue(
+            persistence.claim_entry(leased, "owner", TEST_TIME, lease_expiry)
+        )
+        self.assertFalse(
+            persistence.claim_entry(leased, "other", TEST_TIME, lease_expiry)
+        )
+        self.assertEqual([], persistence.get_due_entries(TEST_TIME))
+        self.assertEqual(lease_expiry, persistence.next_due_time(TEST_TIME))
+
+    def test_snapshot_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "schedule.db")
+            persistence = InMemorySchedulePersistence(snapshot_path=path)
+            kept = ScheduleEntry(
+                TEST_TIME + timedelta(microseconds=123456), ScheduledAction("Kept")
+            )
+            removed = entry(timedelta(hours=1), "Removed")
+            persistence.put_schedule_entries([kept, removed])
+            persistence.delete_schedule_entry(removed)
+            persistence._snapshot.close()
+
+            restored = InMemorySchedulePersistence(snapshot_path=path)
+            self.assertEqual([kept], restored.get_entries_for_action("Kept"))
+            self.assertEqual([], restored.get_entries_for_action("Removed"))
+            restored._snapshot.close()
+
+
+class TestRunForever(unittest.TestCase):
+    def test_fires_entry_when_due(self):
+        scheduler = Scheduler(InMemorySchedulePersistence())
+        fired = threading.Event()
+        scheduler.register_action("Example", fired.set)
+        runner = threading.Thread(
+            target=scheduler.run_forever, kwargs={"max_idle": timedelta(seconds=5)}
+        )
+        runner.start()
+        try:
+            scheduler.do_with_delay("Example", timedelta(milliseconds=50))
+            self.assertTrue(fired.wait(2))
+        finally:
+            scheduler.stop()
+            runner.join(5)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(0, len(scheduler.persistence))
@@ -0,0 +1,365 @@
+from __future__ import annotations
+import unittest
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+
+from .objects import ScheduleEntry, ScheduledAction
+from .persistence import ACTION_INDEX, DUE_INDEX, SchedulePersistence
+from .recurrence import CronSchedule
+from ..utils import to_epoch_time
+from ..utils.dynamo_testing import matches
+
+
+TEST_TIME = datetime(
+    year=2022, month=7, day=3, hour=18, minute=30, second=00, tzinfo=timezone.utc
+)
+
+
+class TestDueEntries(unittest.TestCase):
+    def test_due_entries_use_due_index(self):
+        table = MockScheduleTable(
+            self,
+            [
+                entry_item(TEST_TIME - timedelta(hours=1), "Due"),
+                entry_item(TEST_TIME + timedelta(hours=1), "Not due"),
+            ],
+        )
+        persistence = SchedulePersistence(session=table.as_session())
+        self.assertEqual(
+            [ScheduleEntry(TEST_TIME - timedelta(hours=1), ScheduledAction("Due"))],
+            persistence.get_due_entries(TEST_TIME),
+        )
+        self.assertEqual([DUE_INDEX], table.queried_indexes)
+        self.assertEqual(0, table.scan_count)
+
+    def test_due_entries_follow_pagination(self):
+        items = [
+            entry_item(TEST_TIME - timedelta(minutes=i), f"Task {i}") for i in range(5)
+        ]
+        table = MockScheduleTable(self, items, page_size=2)
+        persistence = SchedulePersistence(session=table.as_session())
+        self.assertEqual(5, len(persistence.get_due_entries(TEST_TIME)))
+        self.assertEqual(3, len(table.queried_indexes))
+
+
+class TestActionEntries(unittest.TestCase):
+    def test_entries_for_action_use_action_index(self):
+        table = MockScheduleTable(
+            self,
+            [
+                entry_item(TEST_TIME, "Wanted"),
+                entry_item(TEST_TIME + timedelta(days=1), "Wanted"),
+                entry_item(TEST_TIME, "Unwanted"),
+            ],
+        )
+        persistence = SchedulePersistence(session=table.as_session())
+        entries = persistence.get_entries_for_action("Wanted")
+        self.assertEqual(2, len(entries))
+        self.assertTrue(all(e.action.actionKey == "Wanted" for e in entries))
+        self.assertEqual([ACTION_INDEX], table.queried_indexes)
+
+
+class TestScheduledActionKeys(unittest.TestCase):
+    def test_finds_scheduled_keys_with_one_query_each(self):
+        table = MockScheduleTable(
+            self,
+            [
+                entry_item(TEST_TIME, "Scheduled"),
+                entry_item(TEST_TIME + timedelta(days=1), "Scheduled"),
+                entry_item(TEST_TIME, "Unrelated"),
+            ],
+        )
+        persistence = SchedulePersistence(session=table.as_session())
+        self.assertEqual(
+            {"Scheduled"},
+            persistence.get_scheduled_action_keys(["Scheduled", "Missing"]),
+        )
+        self.assertEqual([ACTION_INDEX, ACTION_INDEX], table.queried_indexes)
+        self.assertEqual(0, table.scan_count)
+
+
+class TestWrites(unittest.TestCase):
+    def test_put_sets_due_shard(self):
+        table = MockScheduleTable(self)
+        persistence = SchedulePersistence(session=table.as_session())
+        persistence.put_schedule_entry(
+            ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        )
+        self.assertEqual([entry_item(TEST_TIME, "Example")], table.items)
+
+    def test_legacy_entries_are_migrated(self):
+        legacy = entry_item(TEST_TIME, "Example")
+        del legacy["DueShard"]
+        table = MockScheduleTable(self, [legacy])
+        persistence = SchedulePersistence(session=table.as_session())
+        self.assertEqual(1, persistence.migrate_legacy_entries())
+        self.assertEqual(
+            [ScheduleEntry(TEST_TIME, ScheduledAction("Example"))],
+            persistence.get_due_entries(TEST_TIME),
+        )
+
+    def test_legacy_entries_migrated_for_given_actions_only(self):
+        legacy = entry_item(TEST_TIME, "Example")
+        del legacy["DueShard"]
+        other = entry_item(TEST_TIME, "Other")
+        del other["DueShard"]
+        table = MockScheduleTable(
+            self, [legacy, other, entry_item(TEST_TIME, "Current")]
+        )
+        persistence = SchedulePersistence(session=table.as_session())
+        self.assertEqual(1, persistence.migrate_legacy_entries(["Example", "Current"]))
+        self.assertEqual(0, table.scan_count)
+        self.assertEqual(
+            ["Current", "Example"],
+            sorted(e.action.actionKey for e in persistence.get_due_entries(TEST_TIME)),
+        )
+
+    def test_legacy_entries_given_registered_recurrence(self):
+        legacy = entry_item(TEST_TIME, "Example")
+        del legacy["DueShard"]
+        table = MockScheduleTable(self, [legacy])
+        persistence = SchedulePersistence(session=table.as_session())
+        recurrence = CronSchedule("0 9 * * *")
+        persistence.migrate_legacy_entries(["Example"], {"Example": recurrence})
+        self.assertEqual(
+            [ScheduleEntry(TEST_TIME, ScheduledAction("Example"), recurrence)],
+            persistence.get_due_entries(TEST_TIME),
+        )
+
+    def test_only_earliest_legacy_entry_kept_for_recurring_action(self):
+        legacy = [
+            entry_item(TEST_TIME + timedelta(days=days), "Example")
+            for days in (2, 0, 1)
+        ]
+        for item in legacy:
+            del item["DueShard"]
+        table = MockScheduleTable(self, legacy)
+        persistence = SchedulePersistence(session=table.as_session())
+        recurrence = CronSchedule("0 9 * * *")
+        persistence.migrate_legacy_entries(["Example"], {"Example": recurrence})
+        self.assertEqual(
+            [ScheduleEntry(TEST_TIME, ScheduledAction("Example"), recurrence)],
+            persistence.get_due_entries(TEST_TIME + timedelta(days=3)),
+        )
+        self.assertEqual(1, len(table.items))
+
+
+class TestRecurrence(unittest.TestCase):
+    def test_recurrence_round_trips(self):
+        table = MockScheduleTable(self)
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(
+            TEST_TIME, ScheduledAction("Example"), CronSchedule("0 9 * * *")
+        )
+        persistence.put_schedule_entry(entry)
+        self.assertEqual("cron 0 9 * * *", table.items[0]["Recurrence"])
+        self.assertEqual([entry], persistence.get_due_entries(TEST_TIME))
+
+    def test_reschedule_is_one_transaction(self):
+        table = MockScheduleTable(self, [entry_item(TEST_TIME, "Example")])
+        persistence = SchedulePersistence(session=table.as_session())
+        recurrence = CronSchedule("0 9 * * *")
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"), recurrence)
+        next_entry = ScheduleEntry(
+            TEST_TIME + timedelta(days=1), ScheduledAction("Example"), recurrence
+        )
+        persistence.claim_entry(
+            entry, "owner", TEST_TIME, TEST_TIME + timedelta(minutes=5)
+        )
+        self.assertTrue(persistence.reschedule_entry(entry, next_entry, "owner"))
+        self.assertEqual(1, table.transactions)
+        self.assertEqual([next_entry], persistence.get_entries_for_action("Example"))
+
+    def test_reschedule_requires_lease(self):
+        table = MockScheduleTable(self, [entry_item(TEST_TIME, "Example")])
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        next_entry = ScheduleEntry(TEST_TIME + timedelta(days=1), entry.action)
+        self.assertFalse(persistence.reschedule_entry(entry, next_entry, "owner"))
+        self.assertEqual([entry_item(TEST_TIME, "Example")], table.items)
+
+
+class TestLeases(unittest.TestCase):
+    def test_claim_unleased_entry(self):
+        table = MockScheduleTable(self, [entry_item(TEST_TIME, "Example")])
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        self.assertTrue(
+            persistence.claim_entry(
+                entry, "owner-a", TEST_TIME, TEST_TIME + timedelta(minutes=5)
+            )
+        )
+        self.assertEqual("owner-a", table.items[0]["LeaseOwner"])
+
+    def test_leased_entry_cannot_be_claimed_or_listed(self):
+        table = MockScheduleTable(self, [entry_item(TEST_TIME, "Example")])
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        lease_expiry = TEST_TIME + timedelta(minutes=5)
+        persistence.claim_entry(entry, "owner-a", TEST_TIME, lease_expiry)
+        self.assertFalse(
+            persistence.claim_entry(entry, "owner-b", TEST_TIME, lease_expiry)
+        )
+        self.assertEqual([], persistence.get_due_entries(TEST_TIME))
+
+    def test_expired_lease_can_be_reclaimed(self):
+        table = MockScheduleTable(self, [entry_item(TEST_TIME, "Example")])
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        persistence.claim_entry(
+            entry, "owner-a", TEST_TIME, TEST_TIME + timedelta(minutes=5)
+        )
+        later = TEST_TIME + timedelta(minutes=10)
+        self.assertTrue(
+            persistence.claim_entry(
+                entry, "owner-b", later, later + timedelta(minutes=5)
+            )
+        )
+
+    def test_deleted_entry_cannot_be_claimed(self):
+        table = MockScheduleTable(self)
+        persistence = SchedulePersistence(session=table.as_session())
+        entry = ScheduleEntry(TEST_TIME, ScheduledAction("Example"))
+        self.assertFalse(
+            persistence.claim_entry(
+                entry, "owner-a", TEST_TIME, TEST_TIME + timedelta(minutes=5)
+            )
+        )
+        self.assertEqual([], table.items)
+
+
+TableEntry = Dict[str, Any]
+
+
+def entry_item(time: datetime, action_key: str) -> TableEntry:
+    return {
+        "ScheduledTime": to_epoch_time(time),
+        "ActionKey": action_key,
+        "DueShard": "pending",
+    }
+
+
+class MockScheduleTable:
+    def __init__(
+        self,
+        test: unittest.TestCase,
+        items: List[TableEntry] = None,
+        page_size: int = 100,
+    ):
+        self.test = test
+        self.items = list(items or [])
+        self.page_size = page_size
+        self.queried_indexes: List[str] = []
+        self.scan_count = 0
+        self.transactions = 0
+        self.meta = MagicMock()
+        self.meta.client.transact_write_items.side_effect = self.transact_write_items
+
+    def query(
+        self,
+        IndexName,
+        KeyConditionExpression,
+        FilterExpression=None,
+        ExclusiveStartKey=0,
+        ProjectionExpression=None,
+        Limit=None,
+    ):
+        self.queried_indexes.append(IndexName)
+        results = [
+            i
+            for i in self.items
+            if matches(KeyConditionExpression, i)
+            and (FilterExpression is None or matches(FilterExpression, i))
+        ]
+        page = self._page(results, ExclusiveStartKey)
+        if Limit is not None:
+            page["Items"] = page["Items"][:Limit]
+        return page
+
+    def scan(
+        self,
+        FilterExpression=None,
+        ExclusiveStartKey=0,
+        IndexName=None,
+        ProjectionExpression=None,
+    ):
+        self.scan_count += 1
+        results = [
+            i
+            for i in self.items
+            if FilterExpression is None or matches(FilterExpression, i)
+        ]
+        return self._page(results, ExclusiveStartKey)
+
+    def put_item(self, Item: TableEntry) -> None:
+        self.delete_item(
+            Key={"ScheduledTime": Item["ScheduledTime"], "ActionKey": Item["ActionKey"]}
+        )
+        self.items.append(Item)
+
+    def delete_item(self, Key: Dict[str, Any]) -> None:
+        self.items = [
+            i
+            for i in self.items
+            if (i["ScheduledTime"], i["ActionKey"])
+            != (Key["ScheduledTime"], Key["ActionKey"])
+        ]
+
+    def update_item(
+        self, Key, UpdateExpression, ConditionExpression, ExpressionAttributeValues
+    ) -> None:
+        self.test.assertEqual(
+            "SET LeaseOwner = :owner, LeaseExpiry = :expiry", UpdateExpression
+        )
+        item = self._find(Key)
+        if not matches(ConditionExpression, item or {}):
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+            )
+        item["LeaseOwner"] = ExpressionAttributeValues[":owner"]
+        item["LeaseExpiry"] = ExpressionAttributeValues[":expiry"]
+
+    def transact_write_items(self, TransactItems) -> None:
+        self.transactions += 1
+        for transact_item in TransactItems:
+            if "Delete" in transact_item:
+                delete = transact_item["Delete"]
+                self.test.assertEqual(
+                    "LeaseOwner = :owner", delete["ConditionExpression"]
+                )
+                item = self._find(delete["Key"])
+                owner = delete["ExpressionAttributeValues"][":owner"]
+                if item is None or item.get("LeaseOwner") != owner:
+                    raise ClientError(
+                        {"Error": {"Code": "TransactionCanceledException"}},
+                        "TransactWriteItems",
+                    )
+        for transact_item in TransactItems:
+            if "Delete" in transact_item:
+                self.delete_item(Key=transact_item["Delete"]["Key"])
+            else:
+                self.put_item(Item=transact_item["Put"]["Item"])
+
+    def batch_writer(self):
+        batch = MagicMock()
+        batch.__enter__.return_value = self
+        return batch
+
+    def as_session(self):
+        session = MagicMock()
+        session.resource.return_value.Table.return_value = self
+        return session
+
+    def _find(self, Key: Dict[str, Any]) -> TableEntry:
+        for item in self.items:
+            if all(item[k] == v for k, v in Key.items()):
+                return item
+        return None
+
+    def _page(self, results: List[TableEntry], start: int) -> Dict[str, Any]:
+        page = {"Items": results[start : start + self.page_size]}
+        if start + self.page_size < len(results):
+            page["LastEvaluatedKey"] = start + self.page_size
+        return page
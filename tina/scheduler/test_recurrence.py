@@ -0,0 +1,79 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from .recurrence import CronSchedule, FixedInterval, JitteredInterval, Recurrence
+
+
+TEST_TIME = datetime(
+    year=2022, month=7, day=3, hour=18, minute=30, second=00, tzinfo=timezone.utc
+)  # A Sunday
+
+
+class TestIntervals(unittest.TestCase):
+    def test_fixed_interval(self):
+        recurrence = FixedInterval(timedelta(hours=6))
+        self.assertEqual(
+            TEST_TIME + timedelta(hours=6), recurrence.next_after(TEST_TIME)
+        )
+
+    def test_jittered_interval_within_bounds(self):
+        recurrence = JitteredInterval(timedelta(hours=12), timedelta(hours=36))
+        for _ in range(100):
+            delay = recurrence.next_after(TEST_TIME) - TEST_TIME
+            self.assertGreaterEqual(delay, timedelta(hours=12))
+            self.assertLessEqual(delay, timedelta(hours=36))
+
+
+class TestCron(unittest.TestCase):
+    def test_daily(self):
+        self.assertEqual(
+            datetime(2022, 7, 4, 9, 0, tzinfo=timezone.utc),
+            CronSchedule("0 9 * * *").next_after(TEST_TIME),
+        )
+
+    def test_later_today(self):
+        self.assertEqual(
+            datetime(2022, 7, 3, 18, 45, tzinfo=timezone.utc),
+            CronSchedule("*/15 * * * *").next_after(TEST_TIME),
+        )
+
+    def test_never_fires_at_the_same_minute(self):
+        self.assertEqual(
+            TEST_TIME + timedelta(days=1),
+            CronSchedule("30 18 * * *").next_after(TEST_TIME),
+        )
+
+    def test_weekdays(self):
+        self.assertEqual(
+            datetime(2022, 7, 4, 8, 0, tzinfo=timezone.utc),
+            CronSchedule("0 8 * * 1-5").next_after(TEST_TIME),
+        )
+
+    def test_day_of_month_or_day_of_week(self):
+        # Either the 1st of the month or a Saturday, whichever comes first.
+        self.assertEqual(
+            datetime(2022, 7, 9, 0, 0, tzinfo=timezone.utc),
+            CronSchedule("0 0 1 * 6").next_after(TEST_TIME),
+        )
+
+    def test_leap_day(self):
+        self.assertEqual(
+            datetime(2024, 2, 29, 12, 0, tzinfo=timezone.utc),
+            CronSchedule("0 12 29 2 *").next_after(TEST_TIME),
+        )
+
+    def test_invalid_expressions_rejected(self):
+        self.assertRaises(ValueError, CronSchedule, "0 9 * *")
+        self.assertRaises(ValueError, CronSchedule, "60 9 * * *")
+
+
+class TestSpecs(unittest.TestCase):
+    def test_specs_round_trip(self):
+        for recurrence in [
+            FixedInterval(timedelta(hours=1)),
+            JitteredInterval(timedelta(hours=12), timedelta(hours=36)),
+            CronSchedule("0 9 * * 1-5"),
+        ]:
+            self.assertEqual(recurrence, Recurrence.parse(recurrence.to_spec()))
+
+    def test_unknown_spec_rejected(self):
+        self.assertRaises(ValueError, Recurrence.parse, "fortnightly")
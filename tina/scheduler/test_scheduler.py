@@ -1,9 +1,13 @@
 from __future__ import annotations
+import threading
 import unittest
 from datetime import date, datetime, timedelta, timezone
-from typing import List, cast
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, cast
+from unittest.mock import patch
 from .scheduler import Scheduler
-from .objects import ScheduleEntry, ScheduledAction
+from .objects import ActionStatus, ScheduleEntry, ScheduledAction
+from .recurrence import FixedInterval
 from .persistence import SchedulePersistence
 
 
@@ -76,6 +80,19 @@ class TestTaskSubmission(unittest.TestCase):
         )
 
 
+class TestEnsureScheduled(unittest.TestCase):
+    def test_only_missing_actions_scheduled(self):
+        persistence = MockPersistence.with_tasks({"2022/07/04 09:00:00": "Scheduled"})
+        scheduler = Scheduler(persistence, NOW)
+        missing = scheduler.ensure_all_scheduled(["Scheduled", "Missing"])
+        self.assertEqual(["Missing"], missing)
+        self.assertIn(
+            ScheduleEntry(timeUtc=TEST_TIME, action=ScheduledAction("Missing")),
+            persistence.tasks,
+        )
+        self.assertEqual(1, persistence.batch_puts)
+
+
 class TestTaskExecution(unittest.TestCase):
     def test_due_tasks_execute(self):
         persistence = MockPersistence.with_tasks(
@@ -94,11 +111,177 @@ class TestTaskExecution(unittest.TestCase):
         self.assertEqual(tracker, [1, 2])
 
 
+class TestLeasing(unittest.TestCase):
+    def test_overlapping_schedulers_split_due_tasks(self):
+        persistence = MockPersistence.with_tasks(
+            {
+                "2022/07/03 12:25:00": "Due task 1",
+                "2022/07/03 18:25:00": "Due task 2",
+            }
+        )
+        first = Scheduler(persistence, NOW, owner_id="first")
+        second = Scheduler(persistence, NOW, owner_id="second")
+        persistence.claim_entry(
+            persistence.tasks[0], "first", TEST_TIME, TEST_TIME + timedelta(minutes=5)
+        )
+        self.assertEqual(
+            ["Due task 2"],
+            [task.action.actionKey for task in second.claim_overdue_tasks()],
+        )
+        self.assertEqual([], first.claim_overdue_tasks())
+
+    def test_leased_task_not_executed_twice(self):
+        persistence = MockPersistence.with_tasks({"2022/07/03 12:25:00": "Due task"})
+        tracker = []
+        other = Scheduler(persistence, NOW, owner_id="other")
+        self.assertEqual(1, len(other.claim_overdue_tasks()))
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.register_action("Due task", lambda: tracker.append(1))
+        scheduler.execute_all()
+        self.assertEqual([], tracker)
+
+
+class TestRecurringExecution(unittest.TestCase):
+    def test_recurring_entry_moves_to_next_occurrence(self):
+        daily = FixedInterval(timedelta(days=1))
+        persistence = MockPersistence()
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.do_at_time("Daily", TEST_TIME - timedelta(minutes=5), daily)
+        tracker = []
+        scheduler.register_action("Daily", lambda: tracker.append(1))
+        scheduler.execute_all()
+        self.assertEqual([1], tracker)
+        self.assertEqual(
+            [
+                ScheduleEntry(
+                    TEST_TIME + timedelta(days=1), ScheduledAction("Daily"), daily
+                )
+            ],
+            persistence.tasks,
+        )
+
+    def test_parallel_mode_reschedules_recurring_entries(self):
+        daily = FixedInterval(timedelta(days=1))
+        persistence = MockPersistence.with_tasks({"2022/07/03 12:25:00": "Once"})
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.do_at_time("Daily", TEST_TIME - timedelta(minutes=5), daily)
+        scheduler.register_action("Once", lambda: None)
+        scheduler.register_action("Daily", lambda: None)
+        scheduler.execute_all_parallel()
+        self.assertEqual(
+            [
+                ScheduleEntry(
+                    TEST_TIME + timedelta(days=1), ScheduledAction("Daily"), daily
+                )
+            ],
+            persistence.tasks,
+        )
+
+
+class TestParallelExecution(unittest.TestCase):
+    def test_succeeded_entries_deleted(self):
+        persistence = MockPersistence.with_tasks(
+            {
+                "2022/07/03 12:25:00": "Due task 1",
+                "2022/07/03 18:25:00": "Due task 2",
+                "2022/07/04 18:31:00": "Not due",
+            }
+        )
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.register_action("Due task 1", lambda: None)
+        scheduler.register_action("Due task 2", lambda: None)
+        outcomes = scheduler.execute_all_parallel()
+        self.assertEqual(
+            [ActionStatus.SUCCEEDED, ActionStatus.SUCCEEDED],
+            [outcome.status for outcome in outcomes],
+        )
+        self.assertEqual(
+            ["Not due"], [task.action.actionKey for task in persistence.tasks]
+        )
+
+    def test_actions_run_concurrently(self):
+        persistence = MockPersistence.with_tasks(
+            {
+                "2022/07/03 12:25:00": "First",
+                "2022/07/03 18:25:00": "Second",
+            }
+        )
+        barrier = threading.Barrier(2, timeout=5)
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.register_action("First", barrier.wait)
+        scheduler.register_action("Second", barrier.wait)
+        outcomes = scheduler.execute_all_parallel(max_workers=2)
+        self.assertTrue(all(o.status == ActionStatus.SUCCEEDED for o in outcomes))
+
+    def test_failed_and_timed_out_entries_kept(self):
+        persistence = MockPersistence.with_tasks(
+            {
+                "2022/07/03 12:25:00": "Slow",
+                "2022/07/03 13:25:00": "Broken",
+                "2022/07/03 18:25:00": "Fine",
+            }
+        )
+        release = threading.Event()
+
+        def broken():
+            raise RuntimeError("Oops")
+
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.register_action("Slow", lambda: release.wait(5))
+        scheduler.register_action("Broken", broken)
+        scheduler.register_action("Fine", lambda: None)
+        outcomes = scheduler.execute_all_parallel(
+            max_workers=3, action_timeout=timedelta(milliseconds=50)
+        )
+        release.set()
+        self.assertEqual(
+            [ActionStatus.TIMED_OUT, ActionStatus.FAILED, ActionStatus.SUCCEEDED],
+            [outcome.status for outcome in outcomes],
+        )
+        self.assertIsInstance(outcomes[1].error, RuntimeError)
+        self.assertEqual(
+            ["Slow", "Broken"], [task.action.actionKey for task in persistence.tasks]
+        )
+
+    def test_timed_out_action_with_python_38_executor(self):
+        persistence = MockPersistence.with_tasks(
+            {
+                "2022/07/03 12:25:00": "Slow",
+                "2022/07/03 18:25:00": "Fine",
+            }
+        )
+        release = threading.Event()
+        scheduler = Scheduler(persistence, NOW)
+        scheduler.register_action("Slow", lambda: release.wait(5))
+        scheduler.register_action("Fine", lambda: None)
+        with patch("tina.scheduler.scheduler.ThreadPoolExecutor", Python38Executor):
+            outcomes = scheduler.execute_all_parallel(
+                max_workers=2, action_timeout=timedelta(milliseconds=50)
+            )
+        release.set()
+        self.assertEqual(
+            [ActionStatus.TIMED_OUT, ActionStatus.SUCCEEDED],
+            [outcome.status for outcome in outcomes],
+        )
+        self.assertEqual(
+            ["Slow"], [task.action.actionKey for task in persistence.tasks]
+        )
+
+
+class Python38Executor(ThreadPoolExecutor):
+    """ThreadPoolExecutor.shutdown as it was before cancel_futures was added."""
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait)
+
+
 class MockPersistence:
     def __init__(self, tasks=None):
         if tasks is None:
             tasks = []
         self.tasks: List[ScheduleEntry] = tasks
+        self.leases: Dict[Tuple[datetime, str], datetime] = {}
+        self.batch_puts = 0
 
     @classmethod
     def with_tasks(clazz, descriptors: map[str, str]) -> MockPersistence:
@@ -107,12 +290,35 @@ class MockPersistence:
     def get_due_entries(self, current_time):
         return [task for task in self.tasks if task.timeUtc <= current_time]
 
+    def get_scheduled_action_keys(self, action_keys):
+        return {t.action.actionKey for t in self.tasks} & set(action_keys)
+
     def put_schedule_entry(self, entry: ScheduleEntry):
         self.tasks.append(entry)
 
+    def put_schedule_entries(self, entries: List[ScheduleEntry]):
+        self.batch_puts += 1
+        self.tasks.extend(entries)
+
+    def reschedule_entry(self, entry, next_entry, owner) -> bool:
+        self.tasks.remove(entry)
+        self.tasks.append(next_entry)
+        return True
+
+    def claim_entry(self, entry, owner, current_time, lease_expiry) -> bool:
+        key = (entry.timeUtc, entry.action.actionKey)
+        if entry not in self.tasks or self.leases.get(key, current_time) > current_time:
+            return False
+        self.leases[key] = lease_expiry
+        return True
+
     def delete_schedule_entry(self, entry: ScheduleEntry):
         self.tasks.remove(entry)
 
+    def delete_schedule_entries(self, entries: List[ScheduleEntry]):
+        for entry in entries:
+            self.tasks.remove(entry)
+
     def cast(self) -> SchedulePersistence:
         return cast(SchedulePersistence, self)
 
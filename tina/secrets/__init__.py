@@ -1 +1,11 @@
-from .secrets import get_secret
+from .secrets import (
+    AwsSecretsBackend,
+    CachedSecretProvider,
+    EnvSecretsBackend,
+    FileSecretsBackend,
+    get_provider,
+    get_secret,
+    prefetch_secrets,
+    register_secret,
+    set_provider,
+)
@@ -1,42 +1,233 @@
 import json
-import boto3
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
 from botocore.exceptions import ClientError
+from ..aws import get_client
 
 
-def get_secret(secret_name, region_name="eu-west-1"):
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
+logger = logging.getLogger(__name__)
 
-    # In this sample we only handle the specific exceptions for the 'GetSecretValue' API.
-    # See https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
-    # We rethrow the exception by default.
+Secret = Dict[str, Any]
 
-    try:
-        get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-        assert "SecretString" in get_secret_value_response
-        secret = json.loads(get_secret_value_response["SecretString"])
+DEFAULT_REGION = "eu-west-1"
+DEFAULT_TTL_SECONDS = float(os.environ.get("TINA_SECRETS_TTL_SECONDS", "900"))
+
+# Fraction of the TTL remaining at which a background refresh is started, so that
+# callers keep getting the cached value instead of blocking on expiry.
+REFRESH_AHEAD_FRACTION = 0.2
+
+
+class AwsSecretsBackend:
+    def fetch(self, secret_name: str, region_name: str = DEFAULT_REGION) -> Secret:
+        client = get_client("secretsmanager", region_name=region_name)
+
+        # In this sample we only handle the specific exceptions for the 'GetSecretValue' API.
+        # See https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
+        # We rethrow the exception by default.
+
+        try:
+            get_secret_value_response = client.get_secret_value(SecretId=secret_name)
+            assert "SecretString" in get_secret_value_response
+            secret = json.loads(get_secret_value_response["SecretString"])
+            return secret
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "DecryptionFailureException":
+                # Secrets Manager can't decrypt the protected secret text using the provided KMS key.
+                # Deal with the exception here, and/or rethrow at your discretion.
+                raise e
+            elif e.response["Error"]["Code"] == "InternalServiceErrorException":
+                # An error occurred on the server side.
+                # Deal with the exception here, and/or rethrow at your discretion.
+                raise e
+            elif e.response["Error"]["Code"] == "InvalidParameterException":
+                # You provided an invalid value for a parameter.
+                # Deal with the exception here, and/or rethrow at your discretion.
+                raise e
+            elif e.response["Error"]["Code"] == "InvalidRequestException":
+                # You provided a parameter value that is not valid for the current state of the resource.
+                # Deal with the exception here, and/or rethrow at your discretion.
+                raise e
+            elif e.response["Error"]["Code"] == "ResourceNotFoundException":
+                # We can't find the resource that you asked for.
+                # Deal with the exception here, and/or rethrow at your discretion.
+                raise e
+            else:
+                raise e
+
+
+class EnvSecretsBackend:
+    """
+    Reads secrets from environment variables, for offline runs. Each secret is a JSON
+    object in TINA_SECRET_<NAME>, where NAME is the secret's friendly name (the part
+    of the ARN after 'secret:') upper-cased, with other characters replaced by '_'.
+    For example, '...:secret:twilio-NNMyv4' is read from TINA_SECRET_TWILIO_NNMYV4.
+    """
+
+    def fetch(self, secret_name: str, region_name: str = DEFAULT_REGION) -> Secret:
+        variable = self.variable_name(secret_name)
+        if variable not in os.environ:
+            raise KeyError(f"Secret '{secret_name}' not set; expected ${variable}")
+        return json.loads(os.environ[variable])
+
+    @staticmethod
+    def variable_name(secret_name: str) -> str:
+        friendly_name = secret_name.rsplit("secret:", 1)[-1]
+        return "TINA_SECRET_" + re.sub(r"[^A-Z0-9]", "_", friendly_name.upper())
+
+
+class FileSecretsBackend:
+    """
+    Reads secrets from a local JSON file, for offline runs. The file maps each secret's
+    ARN or friendly name to the secret's JSON object.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self, secret_name: str, region_name: str = DEFAULT_REGION) -> Secret:
+        with open(self.path) as f:
+            secrets = json.load(f)
+        friendly_name = secret_name.rsplit("secret:", 1)[-1]
+        for key in (secret_name, friendly_name):
+            if key in secrets:
+                return secrets[key]
+        raise KeyError(f"Secret '{secret_name}' not found in {self.path}")
+
+
+class CachedSecretProvider:
+    """
+    Caches secrets in memory for ttl_seconds. Once a cached secret is close to expiry,
+    it is refreshed on a background thread while callers keep receiving the cached
+    value; only a missing or fully expired secret makes the caller wait for a fetch.
+    """
+
+    def __init__(
+        self,
+        backend,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[float, Secret]] = {}
+        self._refreshing: Set[str] = set()
+
+    def get(self, secret_name: str, region_name: str = DEFAULT_REGION) -> Secret:
+        with self._lock:
+            cached = self._cache.get(secret_name)
+        if cached is None:
+            return self._fetch(secret_name, region_name)
+
+        fetched_at, secret = cached
+        age = self.clock() - fetched_at
+        if age >= self.ttl_seconds:
+            return self._fetch(secret_name, region_name)
+        if age >= self.ttl_seconds * (1 - REFRESH_AHEAD_FRACTION):
+            self._refresh_in_background(secret_name, region_name)
         return secret
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "DecryptionFailureException":
-            # Secrets Manager can't decrypt the protected secret text using the provided KMS key.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response["Error"]["Code"] == "InternalServiceErrorException":
-            # An error occurred on the server side.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response["Error"]["Code"] == "InvalidParameterException":
-            # You provided an invalid value for a parameter.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response["Error"]["Code"] == "InvalidRequestException":
-            # You provided a parameter value that is not valid for the current state of the resource.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        elif e.response["Error"]["Code"] == "ResourceNotFoundException":
-            # We can't find the resource that you asked for.
-            # Deal with the exception here, and/or rethrow at your discretion.
-            raise e
-        else:
-            raise e
+
+    def prefetch(
+        self, secret_names: Iterable[str], region_name: str = DEFAULT_REGION
+    ) -> None:
+        """
+        Fetches any of the given secrets that aren't already cached, in parallel.
+        Failures are logged rather than raised; a later get will retry the fetch.
+        """
+        with self._lock:
+            missing = [name for name in set(secret_names) if name not in self._cache]
+        if not missing:
+            return
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = [
+                executor.submit(self._fetch, name, region_name) for name in missing
+            ]
+        for future in futures:
+            if future.exception() is not None:
+                logger.error("Failed to prefetch secret", exc_info=future.exception())
+
+    def invalidate(self, secret_name: Optional[str] = None) -> None:
+        with self._lock:
+            if secret_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(secret_name, None)
+
+    def _fetch(self, secret_name: str, region_name: str) -> Secret:
+        secret = self.backend.fetch(secret_name, region_name)
+        with self._lock:
+            self._cache[secret_name] = (self.clock(), secret)
+        return secret
+
+    def _refresh_in_background(self, secret_name: str, region_name: str) -> None:
+        with self._lock:
+            if secret_name in self._refreshing:
+                return
+            self._refreshing.add(secret_name)
+
+        def refresh():
+            try:
+                self._fetch(secret_name, region_name)
+            except Exception:
+                logger.exception("Background refresh of secret failed")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_name)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+_known_secrets: Set[str] = set()
+_provider: Optional[CachedSecretProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> CachedSecretProvider:
+    """
+    Returns the process-wide secret provider. The backend is chosen by the
+    TINA_SECRETS_BACKEND environment variable: 'aws' (the default), 'env', or 'file'
+    (which reads the file named by TINA_SECRETS_FILE).
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            backend_name = os.environ.get("TINA_SECRETS_BACKEND", "aws")
+            if backend_name == "env":
+                backend = EnvSecretsBackend()
+            elif backend_name == "file":
+                backend = FileSecretsBackend(os.environ["TINA_SECRETS_FILE"])
+            else:
+                backend = AwsSecretsBackend()
+            _provider = CachedSecretProvider(backend)
+        return _provider
+
+
+def set_provider(provider: Optional[CachedSecretProvider]) -> None:
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+
+def register_secret(secret_name: str) -> str:
+    """
+    Records a secret as one the app uses, so prefetch_secrets can load it at cold start.
+    Returns the name, so it can be used when defining a module-level constant.
+    """
+    _known_secrets.add(secret_name)
+    return secret_name
+
+
+def prefetch_secrets(secret_names: Iterable[str] = None) -> None:
+    if secret_names is None:
+        secret_names = _known_secrets
+    get_provider().prefetch(secret_names)
+
+
+def get_secret(secret_name, region_name=DEFAULT_REGION):
+    return get_provider().get(secret_name, region_name)
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from .secrets import CachedSecretProvider, EnvSecretsBackend, FileSecretsBackend
+from ..utils.testing import FakeClock
+
+
+TWILIO_ARN = "arn:aws:secretsmanager:eu-west-1:123456789012:secret:twilio-NNMyv4"
+
+
+class CountingBackend:
+    def __init__(self):
+        self.fetches = []
+        self.fetched = threading.Event()
+
+    def fetch(self, secret_name, region_name):
+        self.fetches.append(secret_name)
+        self.fetched.set()
+        return {"value": len(self.fetches)}
+
+
+class TestCachedSecretProvider(unittest.TestCase):
+    def test_secret_cached_within_ttl(self):
+        backend = CountingBackend()
+        clock = FakeClock()
+        provider = CachedSecretProvider(backend, ttl_seconds=100, clock=clock)
+        self.assertEqual({"value": 1}, provider.get("secret"))
+        clock.now = 50
+        self.assertEqual({"value": 1}, provider.get("secret"))
+        self.assertEqual(["secret"], backend.fetches)
+
+    def test_expired_secret_refetched(self):
+        backend = CountingBackend()
+        clock = FakeClock()
+        provider = CachedSecretProvider(backend, ttl_seconds=100, clock=clock)
+        provider.get("secret")
+        clock.now = 100
+        self.assertEqual({"value": 2}, provider.get("secret"))
+
+    def test_nearly_expired_secret_refreshed_in_background(self):
+        backend = CountingBackend()
+        clock = FakeClock()
+        provider = CachedSecretProvider(backend, ttl_seconds=100, clock=clock)
+        provider.get("secret")
+        backend.fetched.clear()
+        clock.now = 90
+        self.assertEqual({"value": 1}, provider.get("secret"))
+        self.assertTrue(backend.fetched.wait(5))
+
+    def test_prefetch_skips_cached_secrets(self):
+        backend = CountingBackend()
+        provider = CachedSecretProvider(backend)
+        provider.get("first")
+        provider.prefetch(["first", "second", "third"])
+        self.assertCountEqual(["first", "second", "third"], backend.fetches)
+        provider.get("second")
+        self.assertEqual(3, len(backend.fetches))
+
+
+class TestOfflineBackends(unittest.TestCase):
+    def test_env_backend(self):
+        with patch.dict(os.environ, {"TINA_SECRET_TWILIO_NNMYV4": '{"sid": "abc"}'}):
+            self.assertEqual({"sid": "abc"}, EnvSecretsBackend().fetch(TWILIO_ARN))
+
+    def test_env_backend_missing_secret(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertRaises(KeyError, EnvSecretsBackend().fetch, TWILIO_ARN)
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "secrets.json")
+            with open(path, "w") as f:
+                json.dump({"twilio-NNMyv4": {"sid": "abc"}}, f)
+            self.assertEqual({"sid": "abc"}, FileSecretsBackend(path).fetch(TWILIO_ARN))
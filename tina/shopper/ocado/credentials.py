@@ -1,8 +1,8 @@
 from typing import Tuple
-from ...secrets import get_secret
+from ...secrets import get_secret, register_secret
 
 
-SECRET_ARN = (
+SECRET_ARN = register_secret(
     "arn:aws:secretsmanager:eu-west-1:833033589552:secret:website_logins-2HbFM3"
 )
 
@@ -1 +1,9 @@
-from .api import notify_all, send_sms, get_recipients
+from .api import retry_outbox, send_sms
+from .dedupe import InboundDedupe, get_inbound_dedupe
+from .delivery import CircuitBreaker, CircuitOpenError, RetryPolicy
+from .fanout import DeliveryResult, notify_all, send_many
+from .outbox import Outbox, OutboxMessage
+from .secrets import get_recipients
+from .segments import coalesce, segment_count
+from .transport import MessageResult, TwilioError, TwilioTransport
+from .twiml import messaging_response
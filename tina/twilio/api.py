@@ -1,51 +1,98 @@
-import base64
-from urllib import request, parse
-from .secrets import get_sender_number, get_recipients, get_twilio_creds
+import logging
+from typing import Optional
+from .delivery import CircuitOpenError, get_delivery_service, is_retryable
+from .outbox import MAX_MESSAGE_AGE, Outbox
+from .ratelimit import get_sender_limiter
+from .secrets import get_sender_number, get_twilio_creds
+from .transport import MessageResult, get_transport
 
-TWILIO_SMS_URL = "https://api.twilio.com/2010-04-01/Accounts/{}/Messages.json"
 
+logger = logging.getLogger(__name__)
 
-def notify_all(message: str) -> None:
-    for recipient in get_recipients():
-        send_sms(recipient, message)
 
-
-def send_sms(destination: str, body: str) -> None:
+def send_sms(destination: str, body: str) -> Optional[MessageResult]:
+    """
+    Sends a message, retrying transient failures. If it still can't be delivered, it
+    is saved to the outbox for retry_outbox to send later, and None is returned.
+    Errors that retrying won't fix, such as an invalid number, are raised.
+    """
     to_number = destination
     from_number = get_sender_number()
     body = body
     sid, token = get_twilio_creds()
 
     if not sid:
-        return "Unable to access Twilio Account SID."
+        raise ValueError("Unable to access Twilio Account SID.")
     elif not token:
-        return "Unable to access Twilio Auth Token."
+        raise ValueError("Unable to access Twilio Auth Token.")
     elif not to_number:
-        return "The function needs a 'To' number in the format +12023351493"
+        raise ValueError("The function needs a 'To' number in the format +12023351493")
     elif not from_number:
-        return "The function needs a 'From' number in the format +19732644156"
+        raise ValueError(
+            "The function needs a 'From' number in the format +19732644156"
+        )
     elif not body:
-        return "The function needs a 'Body' message to send."
+        raise ValueError("The function needs a 'Body' message to send.")
 
-    # insert Twilio Account SID into the REST API URL
-    populated_url = TWILIO_SMS_URL.format(sid)
-    post_params = {"To": to_number, "From": from_number, "Body": body}
+    get_sender_limiter(from_number).acquire()
+    try:
+        result = get_delivery_service().deliver(
+            get_transport(sid, token), to_number, from_number, body
+        )
+    except Exception as e:
+        if not (isinstance(e, CircuitOpenError) or is_retryable(e)):
+            raise e
+        logger.error(f"Unable to send message to {to_number}; saving to outbox: {e}")
+        Outbox().enqueue(to_number, body, e)
+        return None
 
-    # encode the parameters for Python's urllib
-    data = parse.urlencode(post_params).encode()
-    req = request.Request(populated_url)
+    logger.info(f"Sent message {result.sid} to {to_number} ({result.status})")
+    return result
 
-    # add authentication header to request based on Account SID + Auth Token
-    authentication = "{}:{}".format(sid, token)
-    base64string = base64.b64encode(authentication.encode("utf-8"))
-    req.add_header("Authorization", "Basic %s" % base64string.decode("ascii"))
 
-    try:
-        # perform HTTP POST request
-        with request.urlopen(req, data) as f:
-            print("Twilio returned {}".format(str(f.read().decode("utf-8"))))
-    except Exception as e:
-        # something went wrong!
-        return e
+def retry_outbox(outbox: Outbox = None) -> int:
+    """
+    Tries once more to send each message in the outbox, oldest first, and returns the
+    number sent. Stops early if Twilio is still unhealthy. Messages that are too old
+    to be useful, or that fail with an error retrying won't fix, are dropped.
+    """
+    if outbox is None:
+        outbox = Outbox()
+    pending = outbox.get_pending()
+    if not pending:
+        return 0
+
+    from_number = get_sender_number()
+    sid, token = get_twilio_creds()
+    transport = get_transport(sid, token)
+    service = get_delivery_service()
+    limiter = get_sender_limiter(from_number)
+    oldest_allowed = outbox.clock() - MAX_MESSAGE_AGE
+    finished = []
+    sent = 0
+    for message in pending:
+        if message.queuedAt < oldest_allowed:
+            logger.warning(
+                f"Dropping outbox message {message.messageId} to {message.recipient} "
+                f"after {message.attempts} attempts: {message.lastError}"
+            )
+            finished.append(message)
+            continue
+        limiter.acquire()
+        try:
+            service.deliver(transport, message.recipient, from_number, message.body)
+        except CircuitOpenError:
+            break
+        except Exception as e:
+            if is_retryable(e):
+                outbox.record_failure(message, e)
+            else:
+                logger.error(f"Dropping outbox message {message.messageId}: {e}")
+                finished.append(message)
+            continue
+        finished.append(message)
+        sent += 1
 
-    return "SMS sent successfully!"
+    outbox.remove(finished)
+    logger.info(f"Sent {sent} of {len(pending)} outbox messages")
+    return sent
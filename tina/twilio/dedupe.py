@@ -0,0 +1,104 @@
+import boto3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+from botocore.exceptions import ClientError
+from ..aws import get_resource
+from ..utils import to_epoch_time
+
+
+DEDUPE_TABLE = "TinaInboundMessages"
+
+# Twilio gives up retrying a webhook well within this, so a MessageSid only needs
+# remembering for this long. ExpiresAt is the table's TTL attribute.
+DEDUPE_WINDOW = timedelta(hours=1)
+
+# How many recently seen MessageSids a warm container remembers.
+MEMORY_SIZE = 1024
+
+
+class InboundDedupe:
+    """
+    Records which inbound messages have been handled, so webhook retries from Twilio
+    can be ignored. Checks an in-memory cache first, for retries that reach the same
+    warm container, then claims the MessageSid with a conditional write.
+    """
+
+    def __init__(
+        self,
+        clock: Callable[[], datetime] = None,
+        session: boto3.Session = None,
+        window: timedelta = DEDUPE_WINDOW,
+    ):
+        if not clock:
+            clock = lambda: datetime.now(timezone.utc)
+        self.clock = clock
+        self.window = window
+        if session is None:
+            resource = get_resource("dynamodb")
+        else:
+            resource = session.resource("dynamodb")
+        self.table = resource.Table(DEDUPE_TABLE)
+        self._lock = threading.Lock()
+        self._seen: OrderedDict[str, datetime] = OrderedDict()
+
+    def claim(self, message_sid: str) -> bool:
+        """
+        Returns True if this is the first delivery of the message, in which case the
+        caller should handle it, and False if it's already been handled or is being
+        handled elsewhere.
+        """
+        now = self.clock()
+        with self._lock:
+            expiry = self._seen.get(message_sid)
+            if expiry is not None and expiry > now:
+                return False
+
+        expiry = now + self.window
+        try:
+            self.table.put_item(
+                Item={"MessageSid": message_sid, "ExpiresAt": to_epoch_time(expiry)},
+                ConditionExpression="attribute_not_exists(MessageSid) OR ExpiresAt < :now",
+                ExpressionAttributeValues={":now": to_epoch_time(now)},
+            )
+            claimed = True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+            claimed = False
+
+        self._remember(message_sid, expiry)
+        return claimed
+
+    def release(self, message_sid: str) -> None:
+        """
+        Forgets a claimed message, e.g. because handling it failed, so that Twilio's
+        retry will be handled.
+        """
+        with self._lock:
+            self._seen.pop(message_sid, None)
+        self.table.delete_item(Key={"MessageSid": message_sid})
+
+    def _remember(self, message_sid: str, expiry: datetime) -> None:
+        with self._lock:
+            self._seen[message_sid] = expiry
+            self._seen.move_to_end(message_sid)
+            while len(self._seen) > MEMORY_SIZE:
+                self._seen.popitem(last=False)
+
+
+_dedupe: Optional[InboundDedupe] = None
+_dedupe_lock = threading.Lock()
+
+
+def get_inbound_dedupe() -> InboundDedupe:
+    """
+    Returns the process-wide dedupe store, whose memory persists across warm
+    invocations.
+    """
+    global _dedupe
+    with _dedupe_lock:
+        if _dedupe is None:
+            _dedupe = InboundDedupe()
+        return _dedupe
@@ -0,0 +1,165 @@
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+from .transport import MessageResult, TwilioError, TwilioTransport
+
+
+logger = logging.getLogger(__name__)
+
+# Twilio responses worth retrying: rate limiting and server-side failures.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, TwilioError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    import requests
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay_seconds: float = 0.5
+    max_delay_seconds: float = 8.0
+
+    def delay_for(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before retrying after the given (zero-based) attempt failed.
+        Uses Twilio's Retry-After if it sent one, and otherwise exponential backoff
+        with full jitter, both capped at max_delay_seconds.
+        """
+        if retry_after is not None:
+            return min(max(retry_after, 0), self.max_delay_seconds)
+        ceiling = min(self.max_delay_seconds, self.base_delay_seconds * 2**attempt)
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to Twilio after failure_threshold consecutive failures, so an outage
+    fails fast instead of stalling on timeouts. After reset_timeout_seconds, a single
+    trial call is let through; if it succeeds the circuit closes again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout_seconds: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self.clock() - self._opened_at < self.reset_timeout_seconds:
+                return False
+            if self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def release_trial(self) -> None:
+        """
+        Ends a trial call that failed for reasons that say nothing about Twilio's
+        health, so another trial can be made.
+        """
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Twilio circuit breaker opened")
+                self._opened_at = self.clock()
+            self._trial_in_progress = False
+
+
+class DeliveryService:
+    def __init__(
+        self,
+        breaker: CircuitBreaker = None,
+        policy: RetryPolicy = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.sleep = sleep
+
+    def deliver(
+        self, transport: TwilioTransport, to_number: str, from_number: str, body: str
+    ) -> MessageResult:
+        """
+        Sends a message, retrying transient failures. Raises CircuitOpenError without
+        calling Twilio while the circuit is open, and otherwise re-raises the last
+        error once retries are exhausted or the error isn't worth retrying.
+        """
+        for attempt in range(self.policy.max_attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError("Twilio is unhealthy; not attempting delivery")
+            try:
+                result = transport.send(to_number, from_number, body)
+            except Exception as e:
+                if not is_retryable(e):
+                    if isinstance(e, TwilioError):
+                        # Twilio answered, even if it rejected this message.
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.release_trial()
+                    raise e
+                self.breaker.record_failure()
+                if attempt == self.policy.max_attempts - 1:
+                    raise e
+                delay = self.policy.delay_for(attempt, getattr(e, "retry_after", None))
+                logger.warning(
+                    f"Send to {to_number} failed ({e}); retrying in {delay}s"
+                )
+                self.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+
+_service: Optional[DeliveryService] = None
+_service_lock = threading.Lock()
+
+
+def get_delivery_service() -> DeliveryService:
+    """
+    Returns the process-wide delivery service, whose circuit breaker state persists
+    across warm invocations.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = DeliveryService()
+        return _service
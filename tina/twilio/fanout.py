@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+from ..utils import fan_out
+from .api import send_sms
+from .secrets import get_recipients
+from .transport import MessageResult
+
+
+@dataclass
+class DeliveryResult:
+    recipient: str
+    result: Optional[MessageResult] = None
+    error: Optional[BaseException] = None
+    queued: bool = False  # Couldn't be sent yet, so saved to the outbox
+
+
+def send_many(recipients: Iterable[str], body: str) -> List[DeliveryResult]:
+    """
+    Sends the same message to every recipient concurrently. Sends are still paced by
+    the sender number's rate limiter, so large broadcasts don't trip Twilio's limits.
+    """
+
+    return [
+        DeliveryResult(
+            r.item,
+            result=r.result,
+            error=r.error,
+            queued=r.error is None and r.result is None,
+        )
+        for r in fan_out(lambda recipient: send_sms(recipient, body), recipients)
+    ]
+
+
+def notify_all(message: str) -> List[DeliveryResult]:
+    return send_many(get_recipients(), message)
@@ -0,0 +1,96 @@
+import boto3
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+from ..aws import get_resource
+from ..utils import paginate, parse_epoch_time, to_epoch_time
+
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_TABLE = "TinaOutbox"
+
+# Messages older than this are dropped rather than retried, as they're unlikely to
+# make sense to the recipient any more.
+MAX_MESSAGE_AGE = timedelta(days=1)
+
+
+@dataclass
+class OutboxMessage:
+    messageId: str
+    recipient: str
+    body: str
+    queuedAt: datetime
+    attempts: int = 0
+    lastError: str = ""
+
+
+class Outbox:
+    """
+    Durable store of outgoing messages that couldn't be delivered, so they can be
+    retried later in bulk.
+    """
+
+    def __init__(
+        self, clock: Callable[[], datetime] = None, session: boto3.Session = None
+    ):
+        if not clock:
+            clock = lambda: datetime.now(timezone.utc)
+        self.clock = clock
+        if session is None:
+            resource = get_resource("dynamodb")
+        else:
+            resource = session.resource("dynamodb")
+        self.table = resource.Table(OUTBOX_TABLE)
+
+    def enqueue(self, recipient: str, body: str, error: BaseException) -> OutboxMessage:
+        message = OutboxMessage(
+            messageId=str(uuid.uuid4()),
+            recipient=recipient,
+            body=body,
+            queuedAt=self.clock(),
+            attempts=1,
+            lastError=str(error),
+        )
+        self.table.put_item(Item=self._serialize(message))
+        return message
+
+    def get_pending(self) -> List[OutboxMessage]:
+        messages = [self._deserialize(item) for item in paginate(self.table.scan)]
+        return sorted(messages, key=lambda message: message.queuedAt)
+
+    def record_failure(self, message: OutboxMessage, error: BaseException) -> None:
+        self.table.update_item(
+            Key={"MessageId": message.messageId},
+            UpdateExpression="SET Attempts = Attempts + :one, LastError = :error",
+            ExpressionAttributeValues={":one": 1, ":error": str(error)},
+        )
+
+    def remove(self, messages: List[OutboxMessage]) -> None:
+        with self.table.batch_writer() as batch:
+            for message in messages:
+                batch.delete_item(Key={"MessageId": message.messageId})
+
+    @staticmethod
+    def _serialize(message: OutboxMessage) -> Dict[str, any]:
+        return {
+            "MessageId": message.messageId,
+            "Recipient": message.recipient,
+            "Body": message.body,
+            "QueuedAt": to_epoch_time(message.queuedAt),
+            "Attempts": message.attempts,
+            "LastError": message.lastError,
+        }
+
+    @staticmethod
+    def _deserialize(item: Dict[str, any]) -> OutboxMessage:
+        return OutboxMessage(
+            messageId=item["MessageId"],
+            recipient=item["Recipient"],
+            body=item["Body"],
+            queuedAt=parse_epoch_time(item["QueuedAt"]),
+            attempts=int(item.get("Attempts", 0)),
+            lastError=item.get("LastError", ""),
+        )
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+
+# Twilio limits how many messages per second each sender number can send. Messages
+# above this rate are queued by Twilio, and API requests far above it are rejected
+# with a 429, so we pace sends to match. BURST lets a small household's broadcast go
+# out at once.
+MESSAGES_PER_SECOND = float(os.environ.get("TINA_TWILIO_MPS", "1"))
+BURST = int(os.environ.get("TINA_TWILIO_BURST", "5"))
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        rate_per_second: float,
+        capacity: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Takes one token, blocking until one is available.
+        """
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate_per_second,
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate_per_second
+            self.sleep(wait_for)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_sender_limiter(sender_number: str) -> TokenBucket:
+    with _buckets_lock:
+        if sender_number not in _buckets:
+            _buckets[sender_number] = TokenBucket(MESSAGES_PER_SECOND, BURST)
+        return _buckets[sender_number]
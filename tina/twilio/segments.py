@@ -0,0 +1,72 @@
+from typing import Iterable, List
+
+
+# The GSM 03.38 default alphabet, which costs one septet per character.
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Characters from the extension table, which cost an escape septet plus their own.
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+GSM7_SINGLE_SEGMENT = 160
+GSM7_MULTI_SEGMENT = 153
+UCS2_SINGLE_SEGMENT = 70
+UCS2_MULTI_SEGMENT = 67
+
+# Coalesced messages are kept to at most this many segments, so a long turn still
+# arrives as a few readable messages rather than one wall of text.
+MAX_COALESCED_SEGMENTS = 3
+
+
+def is_gsm7(text: str) -> bool:
+    return all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text)
+
+
+def segment_count(text: str) -> int:
+    """
+    The number of SMS segments Twilio will bill for the text: GSM-7 if every character
+    is in the GSM alphabet, and UCS-2 (e.g. for emoji) otherwise. An escaped GSM
+    character or a UTF-16 surrogate pair is never split across two segments.
+    """
+    if is_gsm7(text):
+        costs = [2 if c in GSM7_EXTENDED else 1 for c in text]
+        single, multi = GSM7_SINGLE_SEGMENT, GSM7_MULTI_SEGMENT
+    else:
+        costs = [2 if ord(c) > 0xFFFF else 1 for c in text]
+        single, multi = UCS2_SINGLE_SEGMENT, UCS2_MULTI_SEGMENT
+
+    if sum(costs) <= single:
+        return 1
+    segments, used = 1, 0
+    for cost in costs:
+        if used + cost > multi:
+            segments += 1
+            used = 0
+        used += cost
+    return segments
+
+
+def coalesce(
+    messages: Iterable[str], max_segments: int = MAX_COALESCED_SEGMENTS
+) -> List[str]:
+    """
+    Joins consecutive messages into as few messages as possible, without costing any
+    extra segments. Messages are only ever joined whole, never split, so sentences
+    stay intact. A message is started afresh when joining would cost more segments
+    than sending separately (e.g. an emoji turning a GSM-7 message into UCS-2) or
+    would exceed max_segments.
+    """
+    coalesced: List[str] = []
+    for message in messages:
+        if coalesced:
+            current = coalesced[-1]
+            joined = current + " " + message
+            joined_segments = segment_count(joined)
+            if joined_segments <= max_segments and joined_segments <= (
+                segment_count(current) + segment_count(message)
+            ):
+                coalesced[-1] = joined
+                continue
+        coalesced.append(message)
+    return coalesced
@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from .dedupe import InboundDedupe
+
+
+NOW = datetime(2022, 6, 1, 12, tzinfo=timezone.utc)
+
+CONDITION_FAILED = ClientError(
+    {"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem"
+)
+
+
+class TestInboundDedupe(unittest.TestCase):
+    def setUp(self):
+        self.now = NOW
+        with patch("tina.twilio.dedupe.get_resource"):
+            self.dedupe = InboundDedupe(clock=lambda: self.now)
+        self.dedupe.table = MagicMock()
+
+    def test_first_delivery_claimed(self):
+        self.assertTrue(self.dedupe.claim("SM1"))
+        args = self.dedupe.table.put_item.call_args.kwargs
+        self.assertEqual("SM1", args["Item"]["MessageSid"])
+        self.assertIn("attribute_not_exists", args["ConditionExpression"])
+
+    def test_repeat_in_same_container_skips_dynamo(self):
+        self.dedupe.claim("SM1")
+        self.assertFalse(self.dedupe.claim("SM1"))
+        self.assertEqual(1, self.dedupe.table.put_item.call_count)
+
+    def test_repeat_seen_by_another_container(self):
+        self.dedupe.table.put_item.side_effect = CONDITION_FAILED
+        self.assertFalse(self.dedupe.claim("SM1"))
+
+    def test_release_allows_retry(self):
+        self.dedupe.claim("SM1")
+        self.dedupe.release("SM1")
+        self.dedupe.table.delete_item.assert_called_once_with(Key={"MessageSid": "SM1"})
+        self.assertTrue(self.dedupe.claim("SM1"))
+
+    def test_memory_expires(self):
+        self.dedupe.claim("SM1")
+        self.now += timedelta(hours=2)
+        self.assertTrue(self.dedupe.claim("SM1"))
+        self.assertEqual(2, self.dedupe.table.put_item.call_count)
@@ -0,0 +1,210 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+import requests
+from .api import retry_outbox, send_sms
+from .delivery import CircuitBreaker, CircuitOpenError, DeliveryService, RetryPolicy
+from .outbox import OutboxMessage
+from .transport import MessageResult, TwilioError
+from ..utils.testing import FakeClock
+
+
+NOW = datetime(2022, 6, 1, 12, tzinfo=timezone.utc)
+OK = MessageResult(sid="SM1", status="queued", to="+1")
+
+
+class FakeTransport:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def send(self, to_number, from_number, body):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+class FakeOutbox:
+    def __init__(self, *messages):
+        self.messages = list(messages)
+        self.failures = []
+        self.removed = []
+        self.clock = lambda: NOW
+
+    def get_pending(self):
+        return list(self.messages)
+
+    def record_failure(self, message, error):
+        self.failures.append(message.messageId)
+
+    def remove(self, messages):
+        self.removed.extend(message.messageId for message in messages)
+
+
+def make_service(breaker=None, max_attempts=4):
+    sleeps = []
+    service = DeliveryService(
+        breaker=breaker or CircuitBreaker(),
+        policy=RetryPolicy(max_attempts=max_attempts),
+        sleep=sleeps.append,
+    )
+    return service, sleeps
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff_is_capped(self):
+        policy = RetryPolicy(base_delay_seconds=1, max_delay_seconds=4)
+        for attempt in range(10):
+            self.assertLessEqual(policy.delay_for(attempt), 4)
+
+    def test_retry_after_is_honoured(self):
+        self.assertEqual(7, RetryPolicy().delay_for(0, retry_after=7))
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(8, RetryPolicy().delay_for(0, retry_after=3600))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_and_half_opens_after_timeout(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=2, reset_timeout_seconds=10, clock=clock
+        )
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # Only one trial call at a time
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout_seconds=10, clock=clock
+        )
+        breaker.record_failure()
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+
+class TestDeliveryService(unittest.TestCase):
+    def test_retries_transient_errors(self):
+        service, sleeps = make_service()
+        transport = FakeTransport(
+            TwilioError(503, "Unavailable"),
+            TwilioError(429, "Too many requests", retry_after=2),
+            OK,
+        )
+        self.assertEqual(OK, service.deliver(transport, "+1", "+2", "Hi"))
+        self.assertEqual(3, transport.calls)
+        self.assertEqual(2, sleeps[1])
+
+    def test_does_not_retry_client_errors(self):
+        service, sleeps = make_service()
+        transport = FakeTransport(TwilioError(400, "Invalid 'To' number"))
+        with self.assertRaises(TwilioError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        self.assertEqual(1, transport.calls)
+        self.assertEqual([], sleeps)
+
+    def test_gives_up_after_max_attempts(self):
+        service, sleeps = make_service(max_attempts=2)
+        transport = FakeTransport(requests.ConnectionError(), requests.Timeout())
+        with self.assertRaises(requests.Timeout):
+            service.deliver(transport, "+1", "+2", "Hi")
+        self.assertEqual(1, len(sleeps))
+
+    def test_fails_fast_while_circuit_open(self):
+        service, _ = make_service(CircuitBreaker(failure_threshold=1), max_attempts=3)
+        transport = FakeTransport(TwilioError(500, "Error"))
+        with self.assertRaises(CircuitOpenError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        with self.assertRaises(CircuitOpenError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        self.assertEqual(1, transport.calls)
+
+    def test_rejected_trial_closes_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout_seconds=10, clock=clock
+        )
+        service, _ = make_service(breaker, max_attempts=1)
+        transport = FakeTransport(
+            TwilioError(503, "Unavailable"), TwilioError(400, "Invalid 'To' number")
+        )
+        with self.assertRaises(TwilioError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        clock.now = 10
+        with self.assertRaises(TwilioError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        self.assertFalse(breaker.is_open)
+        self.assertTrue(breaker.allow())
+
+    def test_trial_failing_locally_allows_another_trial(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            failure_threshold=1, reset_timeout_seconds=10, clock=clock
+        )
+        service, _ = make_service(breaker, max_attempts=1)
+        transport = FakeTransport(TwilioError(503, "Unavailable"), KeyError("sid"))
+        with self.assertRaises(TwilioError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        clock.now = 10
+        with self.assertRaises(KeyError):
+            service.deliver(transport, "+1", "+2", "Hi")
+        self.assertTrue(breaker.allow())
+
+
+@patch("tina.twilio.api.get_transport")
+@patch("tina.twilio.api.get_twilio_creds", return_value=("AC1", "token"))
+@patch("tina.twilio.api.get_sender_number", return_value="+2")
+class TestSendSms(unittest.TestCase):
+    def test_undeliverable_message_saved_to_outbox(self, *_):
+        service = MagicMock()
+        service.deliver.side_effect = CircuitOpenError()
+        with patch("tina.twilio.api.get_delivery_service", return_value=service), patch(
+            "tina.twilio.api.Outbox"
+        ) as outbox:
+            self.assertIsNone(send_sms("+1", "Hi"))
+        outbox.return_value.enqueue.assert_called_once()
+
+    def test_permanent_errors_raised(self, *_):
+        service = MagicMock()
+        service.deliver.side_effect = TwilioError(400, "Invalid 'To' number")
+        with patch("tina.twilio.api.get_delivery_service", return_value=service), patch(
+            "tina.twilio.api.Outbox"
+        ) as outbox:
+            with self.assertRaises(TwilioError):
+                send_sms("+1", "Hi")
+        outbox.return_value.enqueue.assert_not_called()
+
+    def test_retry_outbox(self, *_):
+        fresh = OutboxMessage("m1", "+1", "Hi", NOW - timedelta(minutes=5))
+        failing = OutboxMessage("m2", "+3", "Hi", NOW - timedelta(minutes=4))
+        stale = OutboxMessage("m3", "+4", "Hi", NOW - timedelta(days=2))
+        outbox = FakeOutbox(fresh, failing, stale)
+        service = MagicMock()
+        service.deliver.side_effect = [OK, TwilioError(503, "Unavailable")]
+        with patch("tina.twilio.api.get_delivery_service", return_value=service):
+            self.assertEqual(1, retry_outbox(outbox))
+        self.assertEqual(["m1", "m3"], sorted(outbox.removed))
+        self.assertEqual(["m2"], outbox.failures)
+
+    def test_retry_outbox_stops_when_circuit_open(self, *_):
+        outbox = FakeOutbox(
+            OutboxMessage("m1", "+1", "Hi", NOW), OutboxMessage("m2", "+3", "Hi", NOW)
+        )
+        service = MagicMock()
+        service.deliver.side_effect = CircuitOpenError()
+        with patch("tina.twilio.api.get_delivery_service", return_value=service):
+            self.assertEqual(0, retry_outbox(outbox))
+        self.assertEqual(1, service.deliver.call_count)
+        self.assertEqual([], outbox.removed)
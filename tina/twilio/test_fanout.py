@@ -0,0 +1,67 @@
+import threading
+import unittest
+from unittest.mock import patch
+from .fanout import send_many
+from .ratelimit import TokenBucket
+from .transport import MessageResult
+from ..utils.testing import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_paced(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, 3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual([], clock.sleeps)
+        bucket.acquire()
+        self.assertEqual([0.5], clock.sleeps)
+
+    def test_tokens_refill_over_time(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, 2, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+        clock.now += 10
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual([], clock.sleeps)
+
+
+class TestSendMany(unittest.TestCase):
+    def test_sends_concurrently(self):
+        recipients = ["+1", "+2", "+3"]
+        barrier = threading.Barrier(len(recipients), timeout=5)
+
+        def fake_send(recipient, body):
+            barrier.wait()
+            return MessageResult(sid=f"SM{recipient}", status="queued", to=recipient)
+
+        with patch("tina.twilio.fanout.send_sms", side_effect=fake_send):
+            results = send_many(recipients, "Hello")
+        self.assertEqual(recipients, [r.recipient for r in results])
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertEqual("SM+2", results[1].result.sid)
+
+    def test_failures_reported_per_recipient(self):
+        def fake_send(recipient, body):
+            if recipient == "+2":
+                raise RuntimeError("Twilio is down")
+            return MessageResult(sid="SM1", status="queued", to=recipient)
+
+        with patch("tina.twilio.fanout.send_sms", side_effect=fake_send):
+            results = send_many(["+1", "+2"], "Hello")
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, RuntimeError)
+
+    def test_outboxed_messages_reported_as_queued(self):
+        def fake_send(recipient, body):
+            if recipient == "+2":
+                return None
+            return MessageResult(sid="SM1", status="queued", to=recipient)
+
+        with patch("tina.twilio.fanout.send_sms", side_effect=fake_send):
+            results = send_many(["+1", "+2"], "Hello")
+        self.assertFalse(results[0].queued)
+        self.assertTrue(results[1].queued)
+        self.assertIsNone(results[1].error)
@@ -0,0 +1,48 @@
+import unittest
+from .segments import coalesce, is_gsm7, segment_count
+
+
+class TestSegmentCount(unittest.TestCase):
+    def test_gsm7(self):
+        self.assertTrue(is_gsm7("Great, let's get started."))
+        self.assertEqual(1, segment_count("a" * 160))
+        self.assertEqual(2, segment_count("a" * 161))
+        self.assertEqual(3, segment_count("a" * 307))
+
+    def test_extended_characters_count_double(self):
+        self.assertTrue(is_gsm7("€"))
+        self.assertEqual(1, segment_count("€" * 80))
+        self.assertEqual(2, segment_count("€" * 81))
+
+    def test_escaped_character_not_split(self):
+        # 152 septets then a 2-septet character: it moves to the second segment.
+        self.assertEqual(2, segment_count("a" * 152 + "€" + "a" * 7))
+        self.assertEqual(3, segment_count("a" * 152 + "€" + "a" * 152))
+
+    def test_ucs2(self):
+        self.assertFalse(is_gsm7("Thanks 🙂"))
+        self.assertEqual(1, segment_count("é" * 10 + "ł" * 60))
+        self.assertEqual(2, segment_count("ł" * 71))
+        self.assertEqual(2, segment_count("🙂" * 36))
+
+
+class TestCoalesce(unittest.TestCase):
+    def test_joins_short_messages(self):
+        self.assertEqual(
+            ["Great, let's get started. How many eggs do you have?"],
+            coalesce(["Great, let's get started.", "How many eggs do you have?"]),
+        )
+
+    def test_does_not_join_when_it_costs_segments(self):
+        gsm = "a" * 150
+        self.assertEqual([gsm, "🙂"], coalesce([gsm, "🙂"]))
+
+    def test_respects_max_segments(self):
+        messages = ["a" * 150] * 4
+        self.assertEqual(
+            [" ".join(["a" * 150] * 2)] * 2, coalesce(messages, max_segments=2)
+        )
+
+    def test_never_splits_messages(self):
+        long = "b" * 500
+        self.assertEqual(["a", long], coalesce(["a", long]))
@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import MagicMock
+from .transport import MessageResult, TwilioError, TwilioTransport, get_transport
+
+
+def mock_response(status_code, payload, headers=None):
+    response = MagicMock()
+    response.ok = status_code < 400
+    response.status_code = status_code
+    response.reason = "Reason"
+    response.json.return_value = payload
+    response.headers = headers or {}
+    return response
+
+
+class TestTransport(unittest.TestCase):
+    def test_send_parses_result(self):
+        transport = TwilioTransport("AC123", "token")
+        transport.session = MagicMock()
+        transport.session.post.return_value = mock_response(
+            201,
+            {
+                "sid": "SM1",
+                "status": "queued",
+                "to": "+447700900000",
+                "num_segments": "2",
+            },
+        )
+        result = transport.send("+447700900000", "+447700900001", "Hello")
+        self.assertEqual(MessageResult("SM1", "queued", "+447700900000", 2), result)
+        _, kwargs = transport.session.post.call_args
+        self.assertEqual(
+            {"To": "+447700900000", "From": "+447700900001", "Body": "Hello"},
+            kwargs["data"],
+        )
+        self.assertEqual(transport.timeout, kwargs["timeout"])
+
+    def test_error_response_raises(self):
+        transport = TwilioTransport("AC123", "token")
+        transport.session = MagicMock()
+        transport.session.post.return_value = mock_response(
+            429, {"code": 20429, "message": "Too Many Requests"}, {"Retry-After": "2"}
+        )
+        with self.assertRaises(TwilioError) as context:
+            transport.send("+447700900000", "+447700900001", "Hello")
+        self.assertEqual(429, context.exception.status_code)
+        self.assertEqual(20429, context.exception.code)
+        self.assertEqual(2.0, context.exception.retry_after)
+
+    def test_http_date_retry_after_ignored(self):
+        transport = TwilioTransport("AC123", "token")
+        transport.session = MagicMock()
+        transport.session.post.return_value = mock_response(
+            503,
+            {"message": "Service Unavailable"},
+            {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"},
+        )
+        with self.assertRaises(TwilioError) as context:
+            transport.send("+447700900000", "+447700900001", "Hello")
+        self.assertEqual(503, context.exception.status_code)
+        self.assertIsNone(context.exception.retry_after)
+
+    def test_auth_set_once_on_session(self):
+        transport = TwilioTransport("AC123", "token")
+        self.assertEqual(("AC123", "token"), transport.session.auth)
+        self.assertIn("/Accounts/AC123/", transport.url)
+
+
+class TestSharedTransport(unittest.TestCase):
+    def test_transport_reused_until_credentials_change(self):
+        first = get_transport("AC123", "token")
+        self.assertIs(first, get_transport("AC123", "token"))
+        self.assertIsNot(first, get_transport("AC123", "rotated"))
@@ -0,0 +1,18 @@
+import unittest
+from .twiml import messaging_response
+
+
+class TestMessagingResponse(unittest.TestCase):
+    def test_empty_response(self):
+        self.assertEqual(
+            '<?xml version="1.0" encoding="UTF-8"?><Response></Response>',
+            messaging_response(),
+        )
+
+    def test_messages_escaped(self):
+        self.assertEqual(
+            '<?xml version="1.0" encoding="UTF-8"?><Response>'
+            "<Message>Fish &amp; chips?</Message><Message>&lt;3</Message>"
+            "</Response>",
+            messaging_response(["Fish & chips?", "<3"]),
+        )
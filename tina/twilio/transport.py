@@ -0,0 +1,125 @@
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+
+TWILIO_SMS_URL = "https://api.twilio.com/2010-04-01/Accounts/{}/Messages.json"
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 3.05
+DEFAULT_READ_TIMEOUT_SECONDS = 10
+DEFAULT_POOL_SIZE = 10
+
+
+@dataclass
+class MessageResult:
+    sid: str
+    status: str  # e.g. 'queued', 'sent'
+    to: str
+    numSegments: Optional[int] = None
+
+
+class TwilioError(Exception):
+    def __init__(
+        self,
+        status_code: int,
+        message: str,
+        code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(f"Twilio returned {status_code}: {message}")
+        self.status_code = status_code
+        self.code = code  # Twilio's own error code, if it sent one
+        self.retry_after = retry_after  # Seconds, from the Retry-After header
+
+
+class TwilioTransport:
+    """
+    Sends messages through the Twilio Messages API over a pooled, keep-alive HTTPS
+    session, so repeated sends reuse one TLS connection and one auth header.
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = DEFAULT_READ_TIMEOUT_SECONDS,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ):
+        # Imported here so that handlers which only reply inline don't pay for it.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.account_sid = account_sid
+        self.url = TWILIO_SMS_URL.format(account_sid)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+
+    def send(self, to_number: str, from_number: str, body: str) -> MessageResult:
+        response = self.session.post(
+            self.url,
+            data={"To": to_number, "From": from_number, "Body": body},
+            timeout=self.timeout,
+        )
+        if not response.ok:
+            raise self._parse_error(response)
+        payload = response.json()
+        num_segments = payload.get("num_segments")
+        return MessageResult(
+            sid=payload["sid"],
+            status=payload.get("status"),
+            to=payload.get("to", to_number),
+            numSegments=int(num_segments) if num_segments is not None else None,
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+    @staticmethod
+    def _parse_error(response: "requests.Response") -> TwilioError:
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        return TwilioError(
+            response.status_code,
+            payload.get("message", response.reason),
+            code=payload.get("code"),
+            retry_after=TwilioTransport._parse_retry_after(
+                response.headers.get("Retry-After")
+            ),
+        )
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        # Only the delay-seconds form is used; an HTTP date falls back to backoff.
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+_transport: Optional[TwilioTransport] = None
+_transport_credentials: Optional[Tuple[str, str]] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(account_sid: str, auth_token: str) -> TwilioTransport:
+    """
+    Returns a process-wide transport, reused across warm invocations. A new one is
+    created if the credentials change, e.g. after the auth token is rotated.
+    """
+    global _transport, _transport_credentials
+    with _transport_lock:
+        if _transport is None or _transport_credentials != (account_sid, auth_token):
+            if _transport is not None:
+                _transport.close()
+            _transport = TwilioTransport(account_sid, auth_token)
+            _transport_credentials = (account_sid, auth_token)
+        return _transport
@@ -0,0 +1,11 @@
+from typing import Iterable
+from xml.sax.saxutils import escape
+
+
+def messaging_response(messages: Iterable[str] = ()) -> str:
+    """
+    Renders a TwiML response that replies to the inbound message with each of the
+    given messages.
+    """
+    body = "".join(f"<Message>{escape(message)}</Message>" for message in messages)
+    return f'<?xml version="1.0" encoding="UTF-8"?><Response>{body}</Response>'
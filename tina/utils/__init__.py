@@ -1,2 +1,4 @@
 import imp
+from .concurrency import FanOutResult, fan_out
 from .dateutils import to_epoch_time, parse_epoch_time
+from .dynamo import paginate
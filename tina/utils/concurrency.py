@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Generic, Iterable, List, Optional, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+DEFAULT_FAN_OUT_WORKERS = 8
+
+
+@dataclass
+class FanOutResult(Generic[T, R]):
+    item: T
+    result: Optional[R] = None
+    error: Optional[BaseException] = None
+
+
+def fan_out(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    max_workers: int = DEFAULT_FAN_OUT_WORKERS,
+) -> List[FanOutResult[T, R]]:
+    """
+    Calls fn on every item concurrently, on at most max_workers threads, and returns
+    one result per item in the original order. Exceptions are captured per item rather
+    than raised, so one failure doesn't stop the others.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item: T) -> FanOutResult[T, R]:
+        try:
+            return FanOutResult(item, result=fn(item))
+        except Exception as e:
+            return FanOutResult(item, error=e)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
@@ -6,4 +6,4 @@ def to_epoch_time(time: datetime):
 
 
 def parse_epoch_time(epoch_time: int):
-    return datetime.fromtimestamp(epoch_time, timezone.utc)
+    return datetime.fromtimestamp(float(epoch_time), timezone.utc)
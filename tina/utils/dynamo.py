@@ -0,0 +1,16 @@
+from typing import Any, Callable, Dict, Iterator
+
+
+def paginate(
+    operation: Callable[..., Dict[str, Any]], **kwargs
+) -> Iterator[Dict[str, Any]]:
+    """
+    Calls a DynamoDB scan or query operation repeatedly, following LastEvaluatedKey,
+    and yields every item from every page.
+    """
+    while True:
+        response = operation(**kwargs)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
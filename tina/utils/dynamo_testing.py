@@ -0,0 +1,31 @@
+from typing import Any, Dict
+from boto3.dynamodb.conditions import ConditionBase
+
+
+def matches(condition: ConditionBase, item: Dict[str, Any]) -> bool:
+    """
+    Evaluates a boto3 condition against an item, for mock tables in tests. Supports
+    the subset of conditions the app uses.
+    """
+    expression = condition.get_expression()
+    operator, values = expression["operator"], expression["values"]
+    if operator == "AND":
+        return all(matches(value, item) for value in values)
+    if operator == "OR":
+        return any(matches(value, item) for value in values)
+    if operator == "attribute_exists":
+        return values[0].name in item
+    if operator == "attribute_not_exists":
+        return values[0].name not in item
+    if values[0].name not in item:
+        return False
+    actual, expected = item[values[0].name], values[1]
+    if operator == "=":
+        return actual == expected
+    if operator == "<":
+        return actual < expected
+    if operator == "<=":
+        return actual <= expected
+    if operator == "IN":
+        return actual in expected
+    raise NotImplementedError(f"Mock table doesn't support operator {operator}")
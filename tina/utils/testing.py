@@ -0,0 +1,19 @@
+from typing import List
+
+
+class FakeClock:
+    """
+    A monotonic clock for tests that only moves when told to, either by setting now
+    or by sleeping, which records how long it was asked to sleep for.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: List[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds